@@ -0,0 +1,214 @@
+"""
+Time each stage of the pipeline on synthetic data, non-interactively.
+
+For each scale, synthetic legislators and MTurk results are generated (see
+synthetic_data.py) and each script is run in its own process, recording
+wall time and peak memory. Standard input is empty, so reconciliation
+(with --count) counts and then stops at its first prompt. Counting doesn't
+geocode, so address normalization is a stage of its own (smarty_normalize.py
+on the detail results), run against a local smarty_stub server with a fresh
+geocode cache. Results are appended to a JSON file, and each stage is
+compared with the previous run at the same scale so regressions stand out.
+
+    python benchmark.py --scales 1 10 --results bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import patch_details
+import smarty_stub
+from synthetic_data import Generator
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def stages(data, out):
+    """
+    (name, script, args) for each stage, reading `data`, writing `out`.
+    """
+    return [
+        ('generate_hits', 'generate_hits.py',
+         [data('legislators.yaml'), '-a', '-o', out('list_hits.csv')]),
+        ('reconcile_list_count', 'reconcile_list_results.py',
+         [data('list_results.csv'), out('list_out.csv'),
+          out('list_review.csv'), '--count']),
+        ('split_to_office_hits', 'split_to_office_hits.py',
+         [data('list_results_out.csv'), '-o', out('detail_hits.csv')]),
+        ('reconcile_detail_count', 'reconcile_detail_results.py',
+         [data('detail_results.csv'), out('detail_out.csv'),
+          out('detail_review.csv'), '--count']),
+        ('normalize_addresses', 'smarty_normalize.py',
+         [data('detail_results.csv'), '-o', out('normalized.csv'),
+          '--geocode-cache', out('geocode.sqlite')]),
+        ('convert_office_results', 'convert_office_results.py',
+         [data('detail_results_out.csv'), data('legislators.yaml'),
+          out('offices.yaml')]),
+        ('patch_details', 'patch_details.py',
+         [out('patch.yaml'), out('offices.yaml'), out('patched.yaml')]),
+    ]
+
+
+def run_stage(stats_file, script, args):
+    """
+    Run a script in this process and record its time and peak memory.
+    """
+    sys.argv = [script] + args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    start = time.perf_counter()
+    status = 0
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except EOFError:
+        pass  # reached a reconcile prompt, with nothing to answer it
+    seconds = time.perf_counter() - start
+    with open(stats_file, 'w') as f:
+        json.dump({
+            'seconds': round(seconds, 3),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'exit': status,
+        }, f)
+    sys.exit(status)
+
+
+def write_patch(offices_file, patch_file, share=0.1):
+    """
+    Take every tenth legislator's block as a patch to apply.
+    """
+    data = patch_details.read_mapped(offices_file)
+    blocks = patch_details.index_blocks(data)
+    step = max(1, int(1 / share))
+    with open(patch_file, 'wb') as f:
+        for block in blocks[::step]:
+            f.write(bytes(data[block.start:block.end]))
+
+
+def benchmark_scale(scale, args, stub_url):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = os.path.join(tmp, 'data')
+        out_dir = os.path.join(tmp, 'out')
+        os.makedirs(out_dir)
+        sizes = Generator(scale, args.disagreement, args.assignments,
+                          args.seed).write(data_dir, args.shuffle)
+
+        with open(os.path.join(tmp, 'smarty_creds.py'), 'w') as f:
+            f.write("SMARTY_AUTH_ID = 'bench'\nSMARTY_AUTH_TOKEN = 'bench'\n")
+
+        env = dict(os.environ,
+                   SMARTY_API_URL=stub_url,
+                   CONGRESS_TURK_CACHE=os.path.join(tmp, 'cache'),
+                   PYTHONPATH=os.pathsep.join(
+                       [tmp, HERE, os.environ.get('PYTHONPATH', '')]))
+
+        def data(name):
+            return os.path.join(data_dir, name)
+
+        def out(name):
+            return os.path.join(out_dir, name)
+
+        for name, script, stage_args in stages(data, out):
+            if name == 'patch_details':
+                write_patch(out('offices.yaml'), out('patch.yaml'))
+            stats_file = os.path.join(tmp, name + '.json')
+            with open(os.path.join(tmp, name + '.log'), 'w') as log:
+                subprocess.call(
+                    [sys.executable, os.path.abspath(__file__),
+                     '--run-stage', stats_file,
+                     os.path.join(HERE, script)] + stage_args,
+                    env=env, stdin=subprocess.DEVNULL, stdout=log,
+                    stderr=subprocess.STDOUT)
+            try:
+                with open(stats_file) as f:
+                    results[name] = json.load(f)
+            except (OSError, ValueError):
+                results[name] = {'exit': 'crashed'}
+            print("  %-24s %s" % (name, results[name]))
+
+    return {'sizes': sizes, 'stages': results}
+
+
+def version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=HERE,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def load_results(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def compare(previous, run, tolerance):
+    """
+    Report stages that got slower than `tolerance` allows.
+    """
+    for name, stats in run['stages'].items():
+        before = previous['stages'].get(name, {}).get('seconds')
+        after = stats.get('seconds')
+        if before and after and after > before * (1 + tolerance):
+            print("  REGRESSION %s: %.3fs -> %.3fs (%s -> %s)" % (
+                name, before, after, previous['version'], run['version']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        'Benchmark the pipeline scripts on synthetic data')
+    parser.add_argument("--scales", type=float, nargs='+', default=[1, 10],
+        help="Multiples of today's ~1500 offices to run at")
+    parser.add_argument("--disagreement", type=float, default=0.2)
+    parser.add_argument("--assignments", type=int, default=2)
+    parser.add_argument("--shuffle", action="store_true",
+        help="Don't keep each HIT's assignments together in the exports")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-latency", type=float, default=0.05,
+        help="Seconds the stub geocoder waits per request")
+    parser.add_argument("--results", default='bench_results.json',
+        help="JSON file to append results to")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+        help="Slowdown relative to the last run to report as a regression")
+    args = parser.parse_args()
+
+    history = load_results(args.results)
+    stub = smarty_stub.start_server(latency=args.stub_latency)
+
+    for scale in args.scales:
+        print("scale %g" % scale)
+        run = dict(benchmark_scale(scale, args, stub.url),
+                   scale=scale, disagreement=args.disagreement,
+                   assignments=args.assignments, shuffle=args.shuffle,
+                   version=version(), python=platform.python_version(),
+                   timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+        previous = [r for r in history if r['scale'] == scale and
+                    r['shuffle'] == args.shuffle]
+        if previous:
+            compare(previous[-1], run, args.tolerance)
+        history.append(run)
+
+    with open(args.results, 'w') as f:
+        json.dump(history, f, indent=1)
+
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run-stage']:
+        run_stage(sys.argv[2], sys.argv[3], sys.argv[4:])
+    main()
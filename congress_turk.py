@@ -0,0 +1,130 @@
+"""
+One command for all the scripts:
+
+    congress-turk generate legislators-current.yaml -a -o list_hits.csv
+    congress-turk reconcile-list list_results.csv out.csv review.csv
+    congress-turk split list_results_out.csv -o detail_hits.csv
+    ...
+
+Only the module for the subcommand is imported, and the modules put off
+importing their heavier dependencies (yaml, rtyaml, termcolor, boto3, the
+geocoding client) until they're used, so quick commands start quickly.
+`congress-turk startup` times each subcommand's startup against its budget.
+"""
+import importlib
+import os
+import sys
+import time
+
+
+# subcommand: (module, description, startup budget in ms beyond the bare
+# interpreter's own startup)
+COMMANDS = {
+    'generate': ('generate_hits', "Generate list HITs for legislators", 75),
+    'reconcile-list': ('reconcile_list_results',
+                       "Reconcile list HIT results", 100),
+    'split': ('split_to_office_hits', "Split list results into detail HITs",
+              50),
+    'reconcile-detail': ('reconcile_detail_results',
+                         "Reconcile detail HIT results", 120),
+    'normalize': ('smarty_normalize',
+                  "Normalize and geocode detail results' addresses", 75),
+    'packing': ('packing', "Unpack packed detail results or their reviews",
+                50),
+    'serve': ('reconcile_server',
+              "Reconcile with several operators in their browsers", 120),
+    'convert': ('convert_office_results', "Convert detail results to YAML",
+                75),
+    'patch': ('patch_details', "Patch offices into the district offices file",
+              50),
+    'state': ('reconcile_state', "Export CSVs from a reconcile state store",
+              50),
+    'geocoder': ('local_geocoder', "Build or query the offline geocoder",
+                 50),
+    'stats': ('turk_stats', "Worker throughput and batch forecasts", 75),
+    'trust': ('worker_trust', "List workers by how often they agreed", 50),
+    'snapshot': ('legislators', "Build cached legislators snapshots", 50),
+    'pipeline': ('pipeline', "Run the stale stages of the pipeline", 75),
+    'mturk': ('mturk', "Publish, harvest and review HITs via the API", 75),
+}
+
+
+def usage():
+    lines = ["usage: congress-turk COMMAND [options]", "", "commands:"]
+    for name, (_, description, _) in COMMANDS.items():
+        lines.append("  %-18s %s" % (name, description))
+    lines.append("  %-18s %s" % ('startup', "Check startup times of the "
+                                 "commands against their budgets"))
+    lines += ["", "Run `congress-turk COMMAND --help` for a command's options."]
+    return '\n'.join(lines)
+
+
+def run(command, argv):
+    module = importlib.import_module(COMMANDS[command][0])
+    sys.argv[0] = 'congress-turk %s' % command
+    return module.main(argv)
+
+
+def time_command(args, runs):
+    """
+    Best wall time in ms of running `args` in a fresh interpreter.
+    """
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [here, os.environ.get('PYTHONPATH', '')]))
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.call([sys.executable] + args, env=env,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_startup(argv):
+    """
+    Time `congress-turk COMMAND --help` for each command and compare the
+    time beyond bare interpreter startup with the command's budget.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='congress-turk startup',
+        description='Check startup times of the commands')
+    parser.add_argument("commands", nargs='*', default=list(COMMANDS))
+    parser.add_argument("--runs", type=int, default=10,
+        help="Take the best of this many runs")
+    args = parser.parse_args(argv)
+
+    baseline = time_command(['-c', 'pass'], args.runs)
+    print("interpreter startup: %.0f ms" % baseline)
+    over = 0
+    for command in args.commands:
+        elapsed = time_command(['-m', 'congress_turk', command, '--help'],
+                               args.runs) - baseline
+        budget = COMMANDS[command][2]
+        ok = elapsed <= budget
+        over += not ok
+        print("%-18s %4.0f ms (budget %d ms)%s" % (
+            command, elapsed, budget, '' if ok else '  OVER BUDGET'))
+    return 1 if over else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    command, argv = argv[0], argv[1:]
+    if command == 'startup':
+        return check_startup(argv)
+    if command not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        print("\ncongress-turk: unknown command %r" % command, file=sys.stderr)
+        return 2
+    return run(command, argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
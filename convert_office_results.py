@@ -1,40 +1,68 @@
 import argparse
 import csv
 import re
-import rtyaml as yaml
+import sys
 from collections import defaultdict, OrderedDict
-from itertools import groupby, count
+from itertools import count, groupby
 from operator import itemgetter
 
-parser = argparse.ArgumentParser(
-    description='Convert results of a "details" task to yaml')
+import metrics
+import spatial
+from grouping import CHUNK_SIZE, external_sort, sorted_groups
+from legislators import load_snapshot
+from packing import unpacked_source
 
-parser.add_argument(
-    "source",
-    help="Reconciled CSV results of MTurk HITs.",
-    type=argparse.FileType('r'),
-    default='-')
 
-parser.add_argument(
-    "ids_source",
-    help=("Source from which to get other ids (govtrack, thomas)"
-          "(legistators-current.yaml"),
-    type=argparse.FileType('r'))
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert results of a "details" task to yaml')
 
-parser.add_argument(
-    "destination",
-    help="destination for results (legislators-district-offices.yaml)",
-    type=argparse.FileType('w'),
-    default='-')
+    parser.add_argument(
+        "source",
+        help="Reconciled CSV results of MTurk HITs.",
+        type=argparse.FileType('r'),
+        default='-')
 
-args = parser.parse_args()
+    parser.add_argument(
+        "ids_source",
+        help=("Source from which to get other ids (govtrack, thomas)"
+              "(legistators-current.yaml"),
+        type=argparse.FileType('r'))
 
-by_id = itemgetter('Input.id')
+    parser.add_argument(
+        "destination",
+        help="destination for results (legislators-district-offices.yaml)",
+        type=argparse.FileType('w'),
+        default='-')
+
+    parser.add_argument(
+        "-w", "--workers",
+        help="Convert legislators in this many processes",
+        type=int, default=1)
+    parser.add_argument(
+        "--carried",
+        help="Merge in offices carried over by split_to_office_hits.py "
+             "--existing (carried_offices.yaml)",
+        type=argparse.FileType('r'))
+    parser.add_argument(
+        "--near",
+        help="Flag geocoded offices this many meters apart or closer "
+             "(default: %(default)s)",
+        type=float, default=spatial.NEAR)
+    parser.add_argument(
+        "--report",
+        help="Write a CSV of possible duplicate and shared offices here",
+        type=argparse.FileType('w'))
+    metrics.add_arguments(parser)
 
-rows = list(csv.DictReader(args.source))
+    args = parser.parse_args(argv)
+    if not args.near > 0:
+        parser.error("--near must be a positive number of meters")
+    metrics.start(args)
+    return args
 
-rows.sort(key=by_id)
-grouped = groupby(rows, key=by_id)
+
+by_id = itemgetter('Input.id')
 
 FIELD_ORDER = """
     id
@@ -52,65 +80,209 @@ def reorder_office(office):
         if office.get(k)])
 
 
-office_ids = defaultdict(count)
-
-
-def id_office(bioguide_id, office):
-
+def id_office(bioguide_id, office, office_ids, taken=()):
+    """
+    Give `office` the next id for its city that isn't in `taken`.
+    """
     locality = office.get('city', 'no_city').lower()
     locality = re.sub(r'\W', '_', locality)
 
-    office_id = '-'.join([bioguide_id, locality])
+    base_id = '-'.join([bioguide_id, locality])
 
-    city_count = next(office_ids[office_id])
-    if city_count:
-        office_id = '-'.join([office_id, str(city_count)])
+    office_id = base_id
+    while True:
+        city_count = next(office_ids[base_id])
+        if city_count:
+            office_id = '-'.join([base_id, str(city_count)])
+        if office_id not in taken:
+            break
 
     office['id'] = office_id
 
 
-other_ids = None
+def office_sort_key(office):
+    """
+    Orders a legislator's offices by their contents, not by row order.
+    """
+    return tuple(str(office.get(k, '')) for k in FIELD_ORDER if k != 'id')
+
+
+def convert_office(item):
+    """
+    Office for a result row, or None if it lacks the minimum fields.
+    """
+    office = {k.replace("Answer.", ""): v
+              for k, v in item.items()
+              if k.startswith("Answer.") and v.strip()}
+
+    if not (office.get('city') and office.get('state') and
+            (office.get('phone') or office.get('address'))):
+        print("Missing minimum fields for office: %r" % office,
+              file=sys.stderr)
+        return None
+
+    if item.get('latitude'):
+        office['latitude'] = float(item['latitude'])
+    if item.get('longitude'):
+        office['longitude'] = float(item['longitude'])
+
+    if office.get('suite') and re.match(r'^\d+$', office['suite']):
+        office['suite'] = 'Suite ' + office['suite']
+
+    return office
+
+
+def convert_legislator(key, items, ids, carried=()):
+    """
+    Entry for one legislator's results.
+
+    Ids are given to offices in order of their contents, so the result
+    doesn't depend on the order of the rows. Carried over offices keep
+    their ids, and new offices are given ids that don't clash with them.
+    """
+    offices = [o for o in map(convert_office, items) if o]
+    offices.sort(key=office_sort_key)
+
+    office_ids = defaultdict(count)
+    taken = {office['id'] for office in carried}
+    for office in offices:
+        id_office(key, office, office_ids, taken)
+
+    offices = ([OrderedDict(office) for office in carried] +
+               [reorder_office(office) for office in offices])
+    offices.sort(key=lambda o: (o.get('city'), o['id']))
+
+    return {'id': ids, 'offices': offices}
+
+
+def office_points(key, offices):
+    return [spatial.Point(key, o['id'], o['latitude'], o['longitude'])
+            for o in offices if 'latitude' in o and 'longitude' in o]
+
+
+def convert_group(job):
+    """
+    (YAML block, geocoded office points) for one legislator.
+    """
+    import rtyaml as yaml
+
+    key, items, ids, carried = job
+    entry = convert_legislator(key, items, ids, carried)
+    with metrics.timed('yaml_dump'):
+        return yaml.dump([entry]), office_points(key, entry['offices'])
+
+
+def read_groups(source):
+    if source.seekable():
+        def read_rows():
+            source.seek(0)
+            return metrics.timed_iter('csv_parse', csv.DictReader(source))
+        return sorted_groups(read_rows, by_id)
+    return groupby(external_sort(csv.DictReader(source), by_id, CHUNK_SIZE),
+                   key=by_id)
+
+
+def load_carried(source):
+    """
+    {bioguide: [offices]} from a carried over offices manifest.
+    """
+    import yaml
+    Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with metrics.timed('yaml_load'):
+        return yaml.load(source, Loader=Loader) or {}
+
+
+def jobs(groups, other_ids, carried=None):
+    """
+    (bioguide, result rows, ids, carried offices) for each legislator in
+    order, including legislators with only carried over offices.
+    """
+    carried = carried or {}
+    pending = sorted(carried, reverse=True)
+
+    def job(key, group):
+        ids = {'bioguide': key}
+        if other_ids:
+            ids = other_ids.other_ids(key)
+        return key, list(group), ids, carried.get(key, [])
+
+    for key, group in groups:
+        while pending and pending[-1] < key:
+            yield job(pending.pop(), [])
+        if pending and pending[-1] == key:
+            pending.pop()
+        yield job(key, group)
+    while pending:
+        yield job(pending.pop(), [])
+
+
+def convert(source, destination, other_ids=None, workers=1, carried=None):
+    """
+    Write YAML for each legislator as soon as it is converted, and return
+    the geocoded offices.
+
+    With several workers, legislators are converted in a process pool;
+    blocks are still written in order, so the output is the same.
+    """
+    work = jobs(read_groups(source), other_ids, carried)
+    pool = None
+    if workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+        blocks = pool.imap(convert_group, work, chunksize=16)
+    else:
+        blocks = map(convert_group, work)
+
+    empty = True
+    points = []
+    try:
+        for block, found in blocks:
+            metrics.incr('legislators_written')
+            destination.write(block)
+            points.extend(found)
+            empty = False
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if empty:
+        destination.write("[]\n")
+    return points
+
 
-# if ids_sources was supplied, build a dict of other ids by bioguide id
-if args.ids_source:
-    legislators = yaml.load(args.ids_source.read())
-    id_types = ['bioguide', 'thomas', 'govtrack']
-    other_ids = {el['id']['bioguide']:
-                 {t: el['id'][t] for t in id_types if el['id'].get(t)}
-                 for el in legislators}
+def check_locations(points, near, report=None):
+    """
+    Flag offices that geocoded to (nearly) the same place.
+    """
+    with metrics.timed('spatial_check'):
+        findings = spatial.close_offices(points, near)
+    metrics.incr('offices_geocoded', len(points))
+    metrics.incr('close_office_pairs', len(findings))
+    print(spatial.summary(findings), file=sys.stderr)
+    if report:
+        spatial.write_report(findings, report)
+    return findings
 
-data = []
-for key, group in grouped:
-    offices = []
-    for item in group:
-        office = {k.replace("Answer.", ""): v
-                  for k, v in item.items()
-                  if k.startswith("Answer.") and v.strip()}
 
-        if not (office.get('city') and office.get('state') and
-                (office.get('phone') or office.get('address'))):
-            print("Missing minimum fields for office: %r" % office)
-            continue
+def main(argv=None):
+    args = parse_args(argv)
 
-        id_office(key, office)
+    other_ids = None
 
-        if 'latitude' in item:
-            office['latitude'] = float(item['latitude'])
-        if 'longitude' in item:
-            office['longitude'] = float(item['longitude'])
+    # if ids_sources was supplied, look up other ids by bioguide id
+    if args.ids_source:
+        other_ids = load_snapshot(args.ids_source.name)
 
-        if office.get('suite') and re.match(r'^\d+$', office['suite']):
-            office['suite'] = 'Suite ' + office['suite']
+    carried = load_carried(args.carried) if args.carried else None
 
-        office = reorder_office(office)
-        offices.append(office)
+    # packed detail results are converted as one row per office
+    source = unpacked_source(args.source)
 
-    offices.sort(key=lambda o: o.get('city'))
+    points = convert(source, args.destination, other_ids, args.workers,
+                     carried)
+    check_locations(points, args.near, args.report)
 
-    ids = {'bioguide': key}
-    if other_ids:
-        ids = other_ids[key]
-    data.append({'id': ids, 'offices': offices})
 
-out = yaml.dump(data)
-args.destination.write(out)
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,42 @@
 import argparse
 import csv
-import yaml
-from decimal import Decimal
 
+import metrics
+from legislators import load_snapshot
 
-def load_data(source_file):
-    return yaml.load(open(source_file))
 
+def load_data(source_file):
+    return load_snapshot(source_file)
 
-def get_predicates(args):
-    predicates = []  # a list of tests for each legislator record
 
+def get_selection(snapshot, args):
+    """
+    Positions in the snapshot of the legislators chosen by args.
+    """
     if args.all:
-        predicates.append(lambda r: True)
-        return predicates
+        return set(range(len(snapshot)))
+
+    selected = set()  # legislators matching any of the options
 
-    if args.names: 
+    if args.names:
         names = [n.lower() for n in args.names]
-        predicates.append(lambda r: r['name']['last'].lower() in names)
+        selected |= snapshot.lookup(snapshot.by_last_name, names)
 
     if args.type:
-        predicates.append(lambda r: r['terms'][-1]['type'] == args.type)
+        selected |= snapshot.lookup(snapshot.by_chamber, [args.type])
 
     if args.districts:
-        districts = set(args.districts)
-        def is_district(record):
-            term = record['terms'][-1]  # last term is current term
-            if term['type'] != 'rep':
-                return False
-            district = "{}_{}".format(term['state'],
-                                      str(term['district']).zfill(2))
-            return district in districts
-
-        predicates.append(is_district)
+        selected |= snapshot.lookup(snapshot.by_district, args.districts)
 
     if args.seats:
-        seats = set(args.seats)
-        def is_seat(record):
-            term = record['terms'][-1]  # last term is current term
-            if term['type'] != 'sen':
-                return False
-            rank_num = {'senior': 1, 'junior': 2}[term['state_rank']]
-            seat_code = "{state}_{rank_num}".format(rank_num=rank_num, **term)
-            return seat_code in seats
-
-        predicates.append(is_seat)
+        selected |= snapshot.lookup(snapshot.by_seat, args.seats)
 
-    return predicates
+    return selected
 
 
-def get_legislators(data, predicates):
-    for record in data:
-        if any((p(record) for p in predicates)):
-            yield record
+def get_legislators(snapshot, selection):
+    for i in sorted(selection):
+        yield snapshot.records[i]
 
     
 def generate_header():
@@ -76,12 +60,12 @@ def generate_csv(legislators, outfile):
     writer.writerow(generate_header())
     for legislator in legislators:
         row = generate_row(legislator)
-        if not row[2]:  # check that URL is not empty
+        if not row[3]:  # check that URL is not empty
             continue
         writer.writerow(row)
 
 
-def get_args():
+def get_args(argv=None):
     parser = argparse.ArgumentParser(description=
         'Generate a CSV for Mech Turk HITs gathering district office data.')
     parser.add_argument("source_file",
@@ -100,23 +84,54 @@ def get_args():
     legislators.add_argument("--districts", nargs="*",
         help="Districts of House Representatives, e.g. CA_01")
 
-    args = parser.parse_args()
+    sites = parser.add_argument_group('Skip unchanged websites')
+    sites.add_argument("--changed-only", metavar="CACHE",
+        help="Only generate HITs for legislators whose websites changed "
+             "since the last run with this cache file (e.g. sites.sqlite)")
+    sites.add_argument("--concurrency", type=int, default=16,
+        help="Fetch this many websites at once (default: %(default)s)")
+    sites.add_argument("--timeout", type=float, default=20,
+        help="Seconds to wait for each website (default: %(default)s)")
+
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    metrics.start(args)
 
     if not any([args.all, args.type, args.names, args.seats, args.districts]):
         parser.error("Need at least one of --all, --names, --seats, --districts.")
 
     return args 
 
+def changed_legislators(legislators, args):
+    """
+    The legislators whose websites changed since the last run.
+    """
+    import site_changes
+
+    legislators = [l for l in legislators if generate_row(l)[3]]
+    changed = site_changes.changed_urls(
+        [generate_row(l)[3] for l in legislators], args.changed_only,
+        args.concurrency, args.timeout)
+    return [l for l in legislators if generate_row(l)[3] in changed]
+
+
 def generate_hits(args):
     source_data = load_data(args.source_file)
-    predicates = get_predicates(args)
-    legislators = get_legislators(source_data, predicates)
-    generate_csv(legislators, args.out)
+    selection = get_selection(source_data, args)
+    legislators = get_legislators(source_data, selection)
+    if args.changed_only:
+        legislators = changed_legislators(legislators, args)
+    with metrics.timed('csv_write'):
+        generate_csv(legislators, args.out)
+
+
+def main(argv=None):
+    generate_hits(get_args(argv))
 
 
 if __name__ == "__main__":
-    args = get_args()
-    generate_hits(args)
+    main()
 
 
 
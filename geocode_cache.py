@@ -0,0 +1,207 @@
+"""
+Persistent cache of address lookups, shared between runs and processes.
+
+Entries are keyed on smarty_normalize's memo key (the sorted address
+fields). Matches live in one table and negative results (no match, or a
+C#/F# footnote saying the match can't be trusted) in another, so the two
+can expire on different schedules. SQLite in WAL mode lets several
+reconcile processes read and write the same cache file at once.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+DAY = 24 * 60 * 60
+
+MISSING = object()  # returned by get() when a key isn't cached
+
+QUERY_CHUNK = 500  # keys per IN (...) query, within SQLite's variable limit
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS negative (
+        key TEXT PRIMARY KEY,
+        reason TEXT NOT NULL,
+        created REAL NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+    CREATE INDEX IF NOT EXISTS negative_accessed ON negative (accessed);
+"""
+
+
+def negative_reason(result):
+    """
+    Why a lookup result is unusable, or None if it's a good match.
+    """
+    if not result:
+        return 'no match'
+    footnotes = result.get('analysis', {}).get('footnotes', '')
+    if re.match('(C|F)#', footnotes):
+        return footnotes
+    return None
+
+
+class GeocodeCache(object):
+    """
+    A SQLite-backed cache of address lookup results.
+
+    `ttl` and `negative_ttl` are in seconds (None never expires);
+    `max_entries` bounds each table, evicting least recently used entries.
+    """
+
+    def __init__(self, path, ttl=365 * DAY, negative_ttl=30 * DAY,
+                 max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = self.negative_hits = self.misses = 0
+        self.writes = 0
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                  isolation_level=None)
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    @staticmethod
+    def encode_key(key):
+        return json.dumps([list(item) for item in key])
+
+    def _fresh(self, created, ttl, now):
+        return ttl is None or created + ttl > now
+
+    def _select(self, sql, keys):
+        """
+        Rows of `sql`, whose `IN (%s)` is filled in with placeholders for
+        `keys`, queried a chunk of keys at a time.
+        """
+        for i in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[i:i + QUERY_CHUNK]
+            yield from self.db.execute(
+                sql % ', '.join('?' * len(chunk)), chunk)
+
+    def get_many(self, keys):
+        """
+        Look up many keys at once; returns {key: result} for cached keys.
+
+        Negative entries come back as None. The entries found are marked
+        as used in one transaction.
+        """
+        now = time.time()
+        keys = {self.encode_key(key): key for key in keys}
+        with self.lock:
+            results = [
+                (k, value) for k, value, created in self._select(
+                    'SELECT key, value, created FROM results '
+                    'WHERE key IN (%s)', list(keys))
+                if self._fresh(created, self.ttl, now)]
+            found = {keys[k]: json.loads(value) for k, value in results}
+            negative = [
+                k for k, created in self._select(
+                    'SELECT key, created FROM negative WHERE key IN (%s)',
+                    [k for k in keys if keys[k] not in found])
+                if self._fresh(created, self.negative_ttl, now)]
+            found.update((keys[k], None) for k in negative)
+
+            self.hits += len(results)
+            self.negative_hits += len(negative)
+            self.misses += len(keys) - len(found)
+
+            if found:
+                self.db.execute('BEGIN IMMEDIATE')
+                try:
+                    for table, used in (('results', [k for k, _ in results]),
+                                        ('negative', negative)):
+                        self.db.executemany(
+                            'UPDATE %s SET accessed = ? WHERE key = ?'
+                            % table, [(now, k) for k in used])
+                    self.db.execute('COMMIT')
+                except BaseException:
+                    self.db.execute('ROLLBACK')
+                    raise
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key, MISSING)
+
+    def set_many(self, items):
+        """
+        Store (key, result) pairs in one transaction.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for key, result in items:
+                    k = self.encode_key(key)
+                    reason = negative_reason(result)
+                    if reason:
+                        self.db.execute('DELETE FROM results WHERE key = ?',
+                                        (k,))
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO negative '
+                            'VALUES (?, ?, ?, ?)', (k, reason, now, now))
+                    else:
+                        self.db.execute('DELETE FROM negative WHERE key = ?',
+                                        (k,))
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO results '
+                            'VALUES (?, ?, ?, ?)',
+                            (k, json.dumps(result), now, now))
+                    self.writes += 1
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+        if self.max_entries:
+            self.evict()
+
+    def set(self, key, result):
+        self.set_many([(key, result)])
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used ones over the limit.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            for table, ttl in (('results', self.ttl),
+                               ('negative', self.negative_ttl)):
+                if ttl is not None:
+                    self.db.execute('DELETE FROM %s WHERE created <= ?'
+                                    % table, (now - ttl,))
+                if self.max_entries:
+                    self.db.execute(
+                        'DELETE FROM {0} WHERE key IN (SELECT key FROM {0} '
+                        'ORDER BY accessed DESC LIMIT -1 OFFSET ?)'
+                        .format(table), (self.max_entries,))
+            self.db.execute('COMMIT')
+
+    def __len__(self):
+        with self.lock:
+            return sum(self.db.execute('SELECT COUNT(*) FROM %s' % t)
+                       .fetchone()[0] for t in ('results', 'negative'))
+
+    def stats(self):
+        return {'hits': self.hits, 'negative_hits': self.negative_hits,
+                'misses': self.misses, 'writes': self.writes}
+
+    def report(self):
+        return ("geocode cache: %(hits)d hits, %(negative_hits)d negative "
+                "hits, %(misses)d misses" % self.stats())
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,107 @@
+"""
+Group CSV rows by a key in bounded memory.
+
+Results exports are usually already clustered by HIT, in which case groups
+are streamed in a single pass. Otherwise rows are put in order with an
+external merge sort: sorted chunks are spilled to temporary files and
+merged back lazily.
+"""
+import heapq
+import pickle
+import tempfile
+from itertools import groupby
+
+
+CHUNK_SIZE = 10000  # rows held in memory at once while sorting
+
+
+def is_sorted(rows, key):
+    """
+    Whether `rows` are in order of `key`, holding only one row at a time.
+    """
+    previous = None
+    for i, row in enumerate(rows):
+        k = key(row)
+        if i and k < previous:
+            return False
+        previous = k
+    return True
+
+
+def _spill(chunk):
+    f = tempfile.TemporaryFile()
+    for row in chunk:
+        pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _unspill(f):
+    with f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def external_sort(rows, key, chunk_size=CHUNK_SIZE):
+    """
+    Sort `rows` by `key`, holding at most `chunk_size` of them in memory.
+
+    All of `rows` is consumed before this returns; the sorted rows are then
+    yielded lazily. The sort is stable.
+    """
+    chunks = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            chunk.sort(key=key)
+            chunks.append(_spill(chunk))
+            chunk = []
+    chunk.sort(key=key)
+
+    if not chunks:
+        return iter(chunk)
+
+    if chunk:
+        chunks.append(_spill(chunk))
+    return heapq.merge(*[_unspill(f) for f in chunks], key=key)
+
+
+def sorted_rows(open_rows, key, chunk_size=CHUNK_SIZE):
+    """
+    Rows from `open_rows()` in order of `key`.
+
+    `open_rows` is called to get a fresh iterator over the rows: once to
+    check whether they're already in order, and again to stream them.
+    """
+    if is_sorted(open_rows(), key):
+        return open_rows()
+    return external_sort(open_rows(), key, chunk_size)
+
+
+def sorted_groups(open_rows, key, chunk_size=CHUNK_SIZE):
+    """
+    Like itertools.groupby, but rows needn't be in order of `key` already.
+    """
+    return groupby(sorted_rows(open_rows, key, chunk_size), key=key)
+
+
+def batched_groups(groups, batch_rows):
+    """
+    Collect (key, rows) groups into lists holding about `batch_rows` rows.
+    """
+    batch = []
+    size = 0
+    for key, group in groups:
+        group = tuple(group)
+        batch.append((key, group))
+        size += len(group)
+        if size >= batch_rows:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
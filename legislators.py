@@ -0,0 +1,154 @@
+"""
+Compiled, indexed snapshots of congress-legislators YAML files.
+
+Parsing legislators-current.yaml (let alone legislators-historical.yaml)
+is slow, so the parsed records are pickled along with lookup indexes, in a
+cache file named for the hash of the YAML's contents. Editing the YAML
+changes the hash, so a stale snapshot is never used.
+
+    python legislators.py legislators-current.yaml   # build ahead of time
+"""
+import hashlib
+import os
+import pickle
+import sys
+from collections import defaultdict
+
+import metrics
+
+
+CACHE_DIR = os.environ.get(
+    'CONGRESS_TURK_CACHE', os.path.expanduser('~/.cache/congress-turk'))
+
+SNAPSHOT_VERSION = 1  # bump when the snapshot layout changes
+
+ID_TYPES = ['bioguide', 'thomas', 'govtrack']
+
+SEAT_RANKS = {'senior': 1, 'junior': 2}
+
+
+def current_term(record):
+    return record['terms'][-1]  # last term is current term
+
+
+def district_code(term):
+    return "{}_{}".format(term['state'], str(term['district']).zfill(2))
+
+
+def seat_code(term):
+    return "{}_{}".format(term['state'], SEAT_RANKS[term['state_rank']])
+
+
+class LegislatorSnapshot(object):
+    """
+    Legislator records with indexes from each lookup key to positions in
+    `records`.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.by_bioguide = {}
+        self.by_last_name = defaultdict(list)
+        self.by_chamber = defaultdict(list)
+        self.by_district = defaultdict(list)
+        self.by_seat = defaultdict(list)
+
+        for i, record in enumerate(records):
+            self.by_bioguide[record['id']['bioguide']] = i
+            self.by_last_name[record['name']['last'].lower()].append(i)
+
+            if not record.get('terms'):
+                continue
+            term = current_term(record)
+            self.by_chamber[term['type']].append(i)
+            if term['type'] == 'rep' and 'district' in term:
+                self.by_district[district_code(term)].append(i)
+            if term['type'] == 'sen' and term.get('state_rank') in SEAT_RANKS:
+                self.by_seat[seat_code(term)].append(i)
+
+        for index in (self.by_last_name, self.by_chamber,
+                      self.by_district, self.by_seat):
+            index.default_factory = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def get(self, bioguide):
+        i = self.by_bioguide.get(bioguide)
+        return None if i is None else self.records[i]
+
+    def other_ids(self, bioguide):
+        """
+        Ids of the legislator in each of ID_TYPES that they have.
+        """
+        ids = self.get(bioguide)['id']
+        return {t: ids[t] for t in ID_TYPES if ids.get(t)}
+
+    def lookup(self, index, keys):
+        """
+        Positions of records matching any of `keys` in one of the indexes.
+        """
+        found = set()
+        for key in keys:
+            found.update(index.get(key, ()))
+        return found
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_path(path, cache_dir=CACHE_DIR):
+    name = os.path.basename(path)
+    return os.path.join(cache_dir, '%s-%s-v%d.pickle' % (
+        name, file_hash(path)[:20], SNAPSHOT_VERSION))
+
+
+def load_snapshot(path, cache_dir=CACHE_DIR):
+    """
+    A LegislatorSnapshot of the YAML file at `path`, from cache if possible.
+    """
+    cached = snapshot_path(path, cache_dir)
+    try:
+        with open(cached, 'rb') as f, metrics.timed('snapshot_load'):
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    import yaml
+    try:
+        from yaml import CSafeLoader as Loader
+    except ImportError:
+        from yaml import SafeLoader as Loader
+
+    with open(path) as f, metrics.timed('yaml_load'):
+        snapshot = LegislatorSnapshot(yaml.load(f, Loader=Loader))
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        partial = '%s.%d.tmp' % (cached, os.getpid())
+        with open(partial, 'wb') as f:
+            pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, cached)
+    except OSError as e:
+        print("Couldn't cache legislators snapshot: %s" % e, file=sys.stderr)
+
+    return snapshot
+
+
+def main(argv=None):
+    for path in sys.argv[1:] if argv is None else argv:
+        snapshot = load_snapshot(path)
+        print("%s: %d legislators (%s)" % (path, len(snapshot),
+                                           snapshot_path(path)))
+
+
+if __name__ == '__main__':
+    main()
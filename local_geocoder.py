@@ -0,0 +1,287 @@
+"""
+Geocode addresses offline from an index built from public data.
+
+The index is built once from files on disk:
+
+    python local_geocoder.py build -o local_geocoder.idx \\
+        --zcta 2020_Gaz_zcta_national.txt --addresses us/*/*.csv.gz
+
+`--zcta` is a Census ZCTA gazetteer file (GEOID, INTPTLAT and INTPTLONG
+columns), giving each ZIP code's centroid; `--addresses` are OpenAddresses
+CSVs (LON, LAT, NUMBER, STREET and POSTCODE columns), giving the location
+of individual addresses. Both become sorted fixed-size records in one
+file, which is memory-mapped and binary searched, so opening it costs
+nothing and lookups only touch the pages they need.
+
+Addresses are matched on house number, street name (upper case, without
+punctuation, with the usual suffixes and directions abbreviated the USPS
+way) and five digit ZIP. A matched address is as good as a delivery point
+match from the remote service; otherwise a known ZIP gives only its
+centroid, which smarty_normalize treats as low precision.
+
+    python local_geocoder.py lookup local_geocoder.idx "3579 Hill St" 22429
+"""
+import argparse
+import csv
+import hashlib
+import re
+import struct
+import sys
+from operator import itemgetter
+
+
+MAGIC = b'CTGEO001'
+HEADER = struct.Struct('<8sQQ')  # magic, ZIP records, address records
+ZCTA = struct.Struct('<Iii')  # ZIP, latitude and longitude in microdegrees
+ADDRESS = struct.Struct('<Qii')  # address key, latitude, longitude
+
+SCALE = 1000000
+
+# USPS abbreviations (Publication 28) for the commonest street words
+ABBREVIATIONS = {
+    'ALLEY': 'ALY', 'AVENUE': 'AVE', 'BOULEVARD': 'BLVD', 'CIRCLE': 'CIR',
+    'COURT': 'CT', 'DRIVE': 'DR', 'EXPRESSWAY': 'EXPY', 'FREEWAY': 'FWY',
+    'HIGHWAY': 'HWY', 'LANE': 'LN', 'PARKWAY': 'PKWY', 'PLACE': 'PL',
+    'PLAZA': 'PLZ', 'ROAD': 'RD', 'SQUARE': 'SQ', 'STREET': 'ST',
+    'TERRACE': 'TER', 'TRAIL': 'TRL', 'WAY': 'WAY',
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE',
+    'SOUTHWEST': 'SW',
+}
+
+UNIT = re.compile(r'\s+(SUITE|STE|ROOM|RM|UNIT|FLOOR|FL|#).*$')
+
+
+def normalize_street(street):
+    """
+    Street name in upper case, without punctuation or a unit, abbreviated.
+    """
+    street = re.sub(r'[^A-Z0-9# ]+', ' ', street.upper())
+    street = UNIT.sub('', ' '.join(street.split()))
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in street.split())
+
+
+def split_address(line):
+    """
+    (house number, normalized street) of an address line, or None.
+    """
+    match = re.match(r'\s*(\d+[A-Za-z]?)\s+(.+)', line or '')
+    if not match:
+        return None
+    street = normalize_street(match.group(2))
+    return (match.group(1).upper(), street) if street else None
+
+
+def zip5(zipcode):
+    match = re.match(r'\s*(\d{5})', zipcode or '')
+    return match.group(1) if match else None
+
+
+def address_key(number, street, zipcode):
+    text = '|'.join([number, street, zipcode]).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(text, digest_size=8).digest(),
+                          'little')
+
+
+def degrees(value):
+    return int(round(float(value) * SCALE))
+
+
+def read_zcta(path):
+    """
+    (ZIP, latitude, longitude) for each row of a ZCTA gazetteer file.
+    """
+    with open(path, newline='') as f:
+        rows = csv.reader(f, delimiter='\t')
+        header = [h.strip() for h in next(rows)]
+        geoid, lat, lon = (header.index(c)
+                           for c in ('GEOID', 'INTPTLAT', 'INTPTLONG'))
+        for row in rows:
+            yield int(row[geoid]), degrees(row[lat]), degrees(row[lon])
+
+
+def read_addresses(path):
+    """
+    (address key, latitude, longitude) for each usable row of an
+    OpenAddresses CSV (optionally gzipped).
+    """
+    if path.endswith('.gz'):
+        import gzip
+        f = gzip.open(path, 'rt', newline='', encoding='utf-8')
+    else:
+        f = open(path, newline='', encoding='utf-8')
+    with f:
+        for row in csv.DictReader(f):
+            zipcode = zip5(row.get('POSTCODE'))
+            number = (row.get('NUMBER') or '').strip().upper()
+            street = normalize_street(row.get('STREET') or '')
+            if not (zipcode and number and street and row.get('LAT') and
+                    row.get('LON')):
+                continue
+            yield (address_key(number, street, zipcode),
+                   degrees(row['LAT']), degrees(row['LON']))
+
+
+def write_records(out, fmt, records):
+    """
+    Write sorted records, skipping repeated keys; returns how many.
+    """
+    count = 0
+    previous = None
+    for record in records:
+        if record[0] == previous:
+            continue
+        previous = record[0]
+        out.write(fmt.pack(*record))
+        count += 1
+    return count
+
+
+def build(path, zcta_files=(), address_files=(), chunk_size=1000000):
+    """
+    Build an index at `path`; returns (ZIP records, address records).
+    """
+    from grouping import external_sort
+
+    zctas = sorted(r for f in zcta_files for r in read_zcta(f))
+    addresses = external_sort(
+        (r for f in address_files for r in read_addresses(f)),
+        key=itemgetter(0), chunk_size=chunk_size)
+
+    with open(path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, 0, 0))
+        n_zcta = write_records(out, ZCTA, zctas)
+        n_addresses = write_records(out, ADDRESS, addresses)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, n_zcta, n_addresses))
+    return n_zcta, n_addresses
+
+
+class LocalGeocoder(object):
+    """
+    Lookups in a memory-mapped index; see build().
+    """
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_zcta, self.n_addresses = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a local geocoder index" % path)
+        self.zcta_offset = HEADER.size
+        self.address_offset = self.zcta_offset + self.n_zcta * ZCTA.size
+
+    def _search(self, fmt, offset, count, key):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = fmt.unpack_from(self.map, offset + mid * fmt.size)
+            if record[0] < key:
+                lo = mid + 1
+            elif record[0] > key:
+                hi = mid
+            else:
+                return record
+        return None
+
+    def zip_centroid(self, zipcode):
+        """
+        (latitude, longitude) of a ZIP code's centroid, or None.
+        """
+        zipcode = zip5(zipcode)
+        record = zipcode and self._search(ZCTA, self.zcta_offset,
+                                          self.n_zcta, int(zipcode))
+        return (record[1] / SCALE, record[2] / SCALE) if record else None
+
+    def locate(self, street, zipcode):
+        """
+        (latitude, longitude) of an address, or None.
+        """
+        parts = split_address(street)
+        zipcode = zip5(zipcode)
+        if not (parts and zipcode):
+            return None
+        record = self._search(ADDRESS, self.address_offset,
+                              self.n_addresses, address_key(*parts, zipcode))
+        if record is None:
+            return None
+        return record[1] / SCALE, record[2] / SCALE
+
+    def street_address(self, query):
+        """
+        A result shaped like the remote service's first candidate for a
+        smarty_normalize query (street, city, state, zipcode), or None.
+
+        Only the coordinates come from the index: the address is given back
+        as it was asked for, suite and all, since the index only has the
+        normalized form it matches on.
+        """
+        found = self.locate(query.get('street'), query.get('zipcode'))
+        if found:
+            latitude, longitude = found
+            precision = 'Zip9'  # the address itself, like a delivery point
+        else:
+            centroid = self.zip_centroid(query.get('zipcode'))
+            if not centroid:
+                return None
+            latitude, longitude = centroid
+            precision = 'Zip5'
+        return {
+            'delivery_line_1': query.get('street', ''),
+            'components': {'city_name': query.get('city', ''),
+                           'state_abbreviation': query.get('state', ''),
+                           'zipcode': query.get('zipcode', '')},
+            'metadata': {'precision': precision, 'latitude': latitude,
+                         'longitude': longitude},
+            'analysis': {'source': 'local'},
+        }
+
+    def close(self):
+        self.map.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Build or query an offline geocoding index')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('build', help="Build an index from data files")
+    p.add_argument("-o", "--out", required=True,
+        help="Index file to write (e.g. local_geocoder.idx)")
+    p.add_argument("--zcta", nargs='*', default=[],
+        help="Census ZCTA gazetteer files")
+    p.add_argument("--addresses", nargs='*', default=[],
+        help="OpenAddresses CSV files (.csv or .csv.gz)")
+    p.add_argument("--chunk-size", type=int, default=1000000,
+        help="Addresses held in memory at once while sorting")
+
+    p = commands.add_parser('lookup', help="Look up an address")
+    p.add_argument("index")
+    p.add_argument("street")
+    p.add_argument("zipcode")
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        if not (args.zcta or args.addresses):
+            parser.error("need --zcta or --addresses files")
+        n_zcta, n_addresses = build(args.out, args.zcta, args.addresses,
+                                    args.chunk_size)
+        print("%s: %d ZIP codes, %d addresses" % (
+            args.out, n_zcta, n_addresses))
+    else:
+        geocoder = LocalGeocoder(args.index)
+        result = geocoder.street_address(
+            {'street': args.street, 'zipcode': args.zipcode})
+        if result is None:
+            print("not found")
+            return 1
+        print("%(precision)s %(latitude).6f %(longitude).6f" %
+              result['metadata'], result['delivery_line_1'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
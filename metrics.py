@@ -0,0 +1,175 @@
+"""
+Optional timing, counters and profiling shared by all the scripts.
+
+Scripts add the options with add_arguments(parser) and call start(args)
+after parsing. With --metrics, a JSON summary of wall time per stage,
+counters and latency histograms is written when the script exits; with
+--profile, a cProfile dump is written too (view it with `python -m pstats`).
+When neither is given, the hooks cost next to nothing.
+"""
+import atexit
+import contextlib
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+
+BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]  # seconds
+
+_noop = contextlib.nullcontext()
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def reset(self):
+        self.__init__()
+
+    @contextlib.contextmanager
+    def _timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """
+        Context manager adding the time spent inside it to `stage`.
+        """
+        if not self.enabled:
+            return _noop
+        return self._timer(stage)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Yield from `iterable`, timing how long each item takes to produce.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start, calls=0)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0, 0.0])
+            totals[0] += calls
+            totals[1] += seconds
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """
+        Record a value (e.g. a latency in seconds) in a histogram.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms.setdefault(name, []).append(value)
+
+    def summarize_histogram(self, values):
+        values = sorted(values)
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(p * len(values)))]
+
+        buckets = {}
+        for value in values:
+            i = bisect_left(BUCKETS, value)
+            label = '<=%g' % BUCKETS[i] if i < len(BUCKETS) else '>%g' % (
+                BUCKETS[-1])
+            buckets[label] = buckets.get(label, 0) + 1
+
+        return {
+            'count': len(values),
+            'sum': round(sum(values), 6),
+            'min': values[0],
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': values[-1],
+            'buckets': buckets,
+        }
+
+    def summary(self):
+        with self.lock:
+            return {
+                'script': sys.argv[0],
+                'wall_seconds': round(time.perf_counter() - self.started, 6),
+                'stages': {name: {'calls': calls, 'seconds': round(secs, 6)}
+                           for name, (calls, secs) in self.stages.items()},
+                'counters': dict(self.counters),
+                'histograms': {name: self.summarize_histogram(values)
+                               for name, values in self.histograms.items()
+                               if values},
+            }
+
+
+metrics = Metrics()
+
+timed = metrics.timed
+timed_iter = metrics.timed_iter
+incr = metrics.incr
+observe = metrics.observe
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('Instrumentation')
+    group.add_argument("--metrics",
+        help="Write a JSON summary of timings and counters here "
+             "('-' for stderr)")
+    group.add_argument("--profile",
+        help="Write a cProfile dump here")
+
+
+def start(args):
+    """
+    Turn on metrics and/or profiling as requested on the command line.
+    """
+    if not (getattr(args, 'metrics', None) or getattr(args, 'profile', None)):
+        return
+
+    metrics.reset()
+    metrics.enabled = True
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.metrics:
+            summary = json.dumps(metrics.summary(), indent=1)
+            if args.metrics == '-':
+                print(summary, file=sys.stderr)
+            else:
+                with open(args.metrics, 'w') as f:
+                    f.write(summary + '\n')
+
+    atexit.register(finish)
@@ -0,0 +1,553 @@
+"""
+Publish HITs, harvest results and push reviews through the MTurk API,
+instead of uploading and downloading CSVs on the requester website.
+
+    python mturk.py publish list_hits.csv --layout-id ... --title ... \
+        --reward 0.50
+    python mturk.py harvest list_hits list_results.csv
+    python mturk.py review list_results_review.csv   # or --state ...
+
+Published HITs, harvested assignments and pushed decisions are tracked in a
+SQLite ledger (--ledger), so each command can be re-run and only does what
+is new: rows already published are skipped, only HITs still waiting for
+assignments are polled, and each decision is pushed once. Requests are made
+concurrently and rate limited, and throttled or failed calls are retried.
+
+boto3 is only imported when a command runs. Requests go to the sandbox
+unless --endpoint-url (or MTURK_ENDPOINT_URL) or --production says
+otherwise; mturk_stub.py is a local stand-in for trying things out.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import metrics
+from packing import merge_decisions, office_counts, report_incomplete
+from throttle import RateLimiter, TransientError, retry
+
+
+SANDBOX_URL = 'https://mturk-requester-sandbox.us-east-1.amazonaws.com'
+PRODUCTION_URL = 'https://mturk-requester.us-east-1.amazonaws.com'
+
+MTURK_ENDPOINT_URL = os.environ.get('MTURK_ENDPOINT_URL', SANDBOX_URL)
+
+THROTTLED = ('ThrottlingException', 'Throttling', 'ServiceFault',
+             'ServiceUnavailable')
+
+# columns of the requester website's batch results CSV, before the
+# Input.* and Answer.* columns
+RESULT_COLUMNS = [
+    'HITId', 'HITTypeId', 'Title', 'Reward', 'CreationTime',
+    'MaxAssignments', 'AssignmentId', 'WorkerId', 'AssignmentStatus',
+    'AcceptTime', 'SubmitTime', 'WorkTimeInSeconds',
+]
+
+STATUSES = {'approve': 'Approved', 'reject': 'Rejected'}
+
+# the error for a UniqueRequestToken that was used already names its HIT
+DUPLICATE_TOKEN = re.compile(r'HIT with ID "?(\w+)"? already exists')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS hits (
+        hit_id TEXT PRIMARY KEY,
+        batch TEXT NOT NULL,
+        token TEXT NOT NULL UNIQUE,
+        inputs TEXT NOT NULL,
+        hit TEXT NOT NULL,
+        done INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS hits_batch ON hits (batch, done);
+    CREATE TABLE IF NOT EXISTS assignments (
+        assignment_id TEXT PRIMARY KEY,
+        hit_id TEXT NOT NULL,
+        row TEXT NOT NULL,
+        fetched REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS assignments_hit ON assignments (hit_id);
+    CREATE TABLE IF NOT EXISTS reviews (
+        assignment_id TEXT PRIMARY KEY,
+        decision TEXT NOT NULL,
+        pushed REAL NOT NULL
+    );
+"""
+
+
+class MTurkLedger(object):
+    """
+    What has been published, harvested and reviewed, in a SQLite file.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def tokens(self, batch):
+        return {t for (t,) in self._execute(
+            'SELECT token FROM hits WHERE batch = ?', (batch,))}
+
+    def add_hit(self, batch, token, inputs, hit):
+        self._execute('INSERT OR REPLACE INTO hits VALUES (?, ?, ?, ?, ?, 0)',
+                      (hit['HITId'], batch, token, json.dumps(inputs),
+                       json.dumps(hit)))
+
+    def pending_hits(self, batch):
+        return [(hit_id, json.loads(hit)) for hit_id, hit in self._execute(
+            'SELECT hit_id, hit FROM hits WHERE batch = ? AND NOT done '
+            'ORDER BY rowid', (batch,))]
+
+    def inputs(self, hit_id):
+        return json.loads(self._execute(
+            'SELECT inputs FROM hits WHERE hit_id = ?', (hit_id,))[0][0])
+
+    def mark_done(self, hit_id):
+        self._execute('UPDATE hits SET done = 1 WHERE hit_id = ?', (hit_id,))
+
+    def add_assignments(self, rows):
+        """
+        Store newly seen assignments; returns how many were new.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            new = 0
+            for row in rows:
+                new += self.db.execute(
+                    'INSERT OR IGNORE INTO assignments VALUES (?, ?, ?, ?)',
+                    (row['AssignmentId'], row['HITId'], json.dumps(row),
+                     now)).rowcount
+            self.db.execute('COMMIT')
+        return new
+
+    def update_status(self, assignment_id, status):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT row FROM assignments WHERE assignment_id = ?',
+                (assignment_id,)).fetchall()
+            if rows:
+                row = dict(json.loads(rows[0][0]), AssignmentStatus=status)
+                self.db.execute(
+                    'UPDATE assignments SET row = ? WHERE assignment_id = ?',
+                    (json.dumps(row), assignment_id))
+
+    def results(self, batch):
+        """
+        Harvested assignment rows for a batch, each HIT's together.
+        """
+        return [json.loads(row) for (row,) in self._execute(
+            'SELECT a.row FROM assignments a JOIN hits h USING (hit_id) '
+            'WHERE h.batch = ? ORDER BY h.rowid, a.rowid', (batch,))]
+
+    def pushed(self):
+        return dict(self._execute(
+            'SELECT assignment_id, decision FROM reviews'))
+
+    def record_review(self, assignment_id, decision):
+        self._execute('INSERT OR REPLACE INTO reviews VALUES (?, ?, ?)',
+                      (assignment_id, decision, time.time()))
+
+    def close(self):
+        self.db.close()
+
+
+class MTurk(object):
+    """
+    A boto3 MTurk client whose calls are rate limited and retried.
+    """
+
+    def __init__(self, endpoint_url=MTURK_ENDPOINT_URL, region='us-east-1',
+                 rate=5, retries=4, workers=8):
+        import boto3
+        import botocore.exceptions
+        from botocore.config import Config
+
+        self.client = boto3.client(
+            'mturk', region_name=region, endpoint_url=endpoint_url,
+            config=Config(retries={'total_max_attempts': 1},
+                          max_pool_connections=workers))
+        self.ClientError = botocore.exceptions.ClientError
+        self.connection_errors = (botocore.exceptions.ConnectionError,
+                                  botocore.exceptions.HTTPClientError)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.workers = workers
+
+    def _call(self, method, params):
+        metrics.incr('mturk_api_requests')
+        try:
+            with metrics.timed('mturk_' + method):
+                return getattr(self.client, method)(**params)
+        except self.ClientError as e:
+            error = e.response.get('Error', {})
+            status = e.response.get('ResponseMetadata', {}).get(
+                'HTTPStatusCode', 0)
+            if error.get('Code') in THROTTLED or status >= 500:
+                raise TransientError('%s: %s' % (method, e))
+            raise
+        except self.connection_errors as e:
+            raise TransientError('%s: %s' % (method, e))
+
+    def call(self, method, **params):
+        return retry(lambda: self._call(method, params),
+                     retries=self.retries, retryable=(TransientError,),
+                     limiter=self.limiter)
+
+    def map(self, func, items):
+        """
+        func(item) for each item, over the worker threads, in order.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(func, items))
+
+    def error_message(self, e):
+        return e.response.get('Error', {}).get('Message') or str(e)
+
+
+def time_text(value):
+    """
+    A timestamp as the requester website's CSVs write it.
+    """
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value, timezone.utc)
+    return value.astimezone(timezone.utc).strftime('%a %b %d %H:%M:%S %Z %Y')
+
+
+def request_tokens(rows, batch, hit_type_id):
+    """
+    A stable UniqueRequestToken for each row of HIT inputs in a batch of
+    HITs of one type.
+
+    Identical rows are told apart by how many came before them, so a
+    re-run (or a retry after a lost response) never publishes a row twice;
+    another batch or HIT type can publish the same row again.
+    """
+    seen = Counter()
+    for row in rows:
+        key = json.dumps([batch, hit_type_id, sorted(row.items())])
+        seen[key] += 1
+        yield hashlib.sha1(('%s\n%d' % (key, seen[key])).encode(
+            'utf-8')).hexdigest()
+
+
+def parse_answers(xml):
+    """
+    {question identifier: answer} from a QuestionFormAnswers document.
+    """
+    from xml.etree import ElementTree
+
+    answers = {}
+    for answer in ElementTree.fromstring(xml):
+        fields = {child.tag.rsplit('}', 1)[-1]: child.text or ''
+                  for child in answer}
+        if 'QuestionIdentifier' in fields:
+            answers[fields['QuestionIdentifier']] = fields.get('FreeText', '')
+    return answers
+
+
+def result_row(hit, inputs, assignment):
+    row = {
+        'HITId': hit['HITId'],
+        'HITTypeId': hit['HITTypeId'],
+        'Title': hit['Title'],
+        'Reward': '$' + hit['Reward'],
+        'CreationTime': hit['CreationTime'],
+        'MaxAssignments': hit['MaxAssignments'],
+        'AssignmentId': assignment['AssignmentId'],
+        'WorkerId': assignment['WorkerId'],
+        'AssignmentStatus': assignment['AssignmentStatus'],
+        'AcceptTime': time_text(assignment['AcceptTime']),
+        'SubmitTime': time_text(assignment['SubmitTime']),
+        'WorkTimeInSeconds': int((assignment['SubmitTime'] -
+                                  assignment['AcceptTime']).total_seconds()),
+    }
+    row.update(('Input.' + k, v) for k, v in inputs.items())
+    row.update(('Answer.' + k, v)
+               for k, v in parse_answers(assignment['Answer']).items())
+    return row
+
+
+def publish(mturk, ledger, rows, batch, hit_type, layout_id, assignments,
+            lifetime):
+    """
+    Create a HIT for each row of inputs not already published.
+    """
+    hit_type_id = mturk.call('create_hit_type', **hit_type)['HITTypeId']
+    published = ledger.tokens(batch)
+    tokens = request_tokens(rows, batch, hit_type_id)
+    todo = [(token, row) for token, row in zip(tokens, rows)
+            if token not in published]
+    print("%d HITs to publish (%d already published)" % (
+        len(todo), len(rows) - len(todo)))
+
+    def create(item):
+        token, row = item
+        try:
+            hit = mturk.call(
+                'create_hit_with_hit_type',
+                HITTypeId=hit_type_id,
+                MaxAssignments=assignments,
+                LifetimeInSeconds=lifetime,
+                HITLayoutId=layout_id,
+                HITLayoutParameters=[{'Name': k, 'Value': v}
+                                     for k, v in row.items()],
+                UniqueRequestToken=token,
+                RequesterAnnotation=batch)['HIT']
+        except mturk.ClientError as e:
+            # published before, but the response was lost: record that HIT
+            existing = DUPLICATE_TOKEN.search(mturk.error_message(e))
+            if existing is None:
+                print("Couldn't publish %r: %s" % (
+                    row, mturk.error_message(e)), file=sys.stderr)
+                return False
+            hit = mturk.call('get_hit', HITId=existing.group(1))['HIT']
+            metrics.incr('hits_recovered')
+        ledger.add_hit(batch, token, row, {
+            'HITId': hit['HITId'],
+            'HITTypeId': hit['HITTypeId'],
+            'Title': hit['Title'],
+            'Reward': hit['Reward'],
+            'CreationTime': time_text(hit['CreationTime']),
+            'Expiration': hit['Expiration'].timestamp(),
+            'MaxAssignments': hit['MaxAssignments'],
+        })
+        metrics.incr('hits_published')
+        return True
+
+    return sum(mturk.map(create, todo))
+
+
+def harvest(mturk, ledger, batch):
+    """
+    Fetch assignments for the batch's HITs that are still open; returns the
+    number of new assignments.
+
+    A HIT stops being polled once all its assignments are in, or after it
+    has expired.
+    """
+    pending = ledger.pending_hits(batch)
+
+    def poll(item):
+        hit_id, hit = item
+        polled = time.time()
+        found, token = [], None
+        while True:
+            params = {'HITId': hit_id, 'MaxResults': 100,
+                      'AssignmentStatuses': ['Submitted', 'Approved',
+                                             'Rejected']}
+            if token:
+                params['NextToken'] = token
+            page = mturk.call('list_assignments_for_hit', **params)
+            found.extend(page['Assignments'])
+            token = page.get('NextToken')
+            if not token:
+                break
+
+        inputs = ledger.inputs(hit_id) if found else None
+        new = ledger.add_assignments(
+            result_row(hit, inputs, a) for a in found)
+        if len(found) >= hit['MaxAssignments'] or polled > hit['Expiration']:
+            ledger.mark_done(hit_id)
+        metrics.incr('assignments_harvested', new)
+        return new
+
+    new = sum(mturk.map(poll, pending))
+    print("%d new assignments from %d open HITs" % (new, len(pending)))
+    return new
+
+
+def write_results(rows, outfile):
+    """
+    Write harvested rows in the requester website's results CSV layout.
+    """
+    inputs, answers = {}, {}
+    for row in rows:
+        for k in row:
+            if k.startswith('Input.'):
+                inputs.setdefault(k)
+            elif k.startswith('Answer.'):
+                answers.setdefault(k)
+    fieldnames = RESULT_COLUMNS + list(inputs) + list(answers) + [
+        'Approve', 'Reject']
+    writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def csv_decisions(rows):
+    """
+    (assignment id, decision, reason) from the rows of a reconciler review
+    CSV.
+    """
+    for row in rows:
+        if row.get('Reject'):
+            yield row['AssignmentId'], 'reject', row['Reject']
+        elif row.get('Approve'):
+            yield row['AssignmentId'], 'approve', None
+
+
+def push_reviews(mturk, ledger, decisions, feedback=None):
+    """
+    Approve or reject each assignment whose decision hasn't been pushed.
+
+    An approval replaces an earlier rejection; MTurk doesn't allow the
+    reverse, so that is reported as an error.
+    """
+    pushed = ledger.pushed()
+    todo = [d for d in decisions if pushed.get(d[0]) != d[1]]
+    print("%d decisions to push (%d already pushed)" % (
+        len(todo), len(pushed)))
+
+    def push(item):
+        assignment_id, decision, reason = item
+        try:
+            if decision == 'approve':
+                params = {'AssignmentId': assignment_id}
+                if feedback:
+                    params['RequesterFeedback'] = feedback
+                if pushed.get(assignment_id) == 'reject':
+                    params['OverrideRejection'] = True
+                mturk.call('approve_assignment', **params)
+            else:
+                mturk.call('reject_assignment', AssignmentId=assignment_id,
+                           RequesterFeedback=reason[:1024])
+        except mturk.ClientError as e:
+            print("Couldn't %s %s: %s" % (decision, assignment_id,
+                                          mturk.error_message(e)),
+                  file=sys.stderr)
+            return False
+        ledger.record_review(assignment_id, decision)
+        ledger.update_status(assignment_id, STATUSES[decision])
+        metrics.incr('reviews_pushed')
+        return True
+
+    return sum(mturk.map(push, todo))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Publish HITs, harvest results and push reviews via the MTurk API')
+    parser.add_argument("--ledger", default='mturk.sqlite',
+        help="SQLite file tracking published HITs, assignments and reviews")
+    parser.add_argument("--endpoint-url", default=MTURK_ENDPOINT_URL,
+        help="MTurk API endpoint (default: the sandbox)")
+    parser.add_argument("--production", action="store_const",
+        dest="endpoint_url", const=PRODUCTION_URL,
+        help="Use the production endpoint: real workers, real money")
+    parser.add_argument("--region", default='us-east-1')
+    parser.add_argument("--rate", type=float, default=5,
+        help="Most API calls per second")
+    parser.add_argument("--workers", type=int, default=8,
+        help="Concurrent API calls")
+    metrics.add_arguments(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('publish', help="Create HITs from a HITs CSV")
+    p.add_argument("hits", type=argparse.FileType('r'),
+        help="CSV from generate_hits.py or split_to_office_hits.py")
+    p.add_argument("--batch",
+        help="Name to harvest the HITs by (default: the CSV's name)")
+    p.add_argument("--layout-id", required=True,
+        help="Layout of the project made from list_offices.html or "
+             "office_details.html on the requester website")
+    p.add_argument("--title", required=True)
+    p.add_argument("--description", default='')
+    p.add_argument("--keywords", default='')
+    p.add_argument("--reward", required=True, help="In dollars, e.g. 0.50")
+    p.add_argument("--assignments", type=int, default=2,
+        help="Assignments per HIT")
+    p.add_argument("--lifetime-days", type=float, default=7)
+    p.add_argument("--duration-minutes", type=float, default=60,
+        help="Time a worker has to complete an assignment")
+    p.add_argument("--auto-approve-days", type=float, default=3)
+
+    p = commands.add_parser('harvest',
+        help="Fetch new assignments and write the results CSV")
+    p.add_argument("batch", help="Batch name given when publishing")
+    p.add_argument("results",
+        help="Results CSV to write, as downloaded from the website")
+
+    p = commands.add_parser('review',
+        help="Push Approve/Reject decisions from reconciliation")
+    p.add_argument("review", nargs='?', type=argparse.FileType('r'),
+        help="Review CSV written by a reconcile script")
+    p.add_argument("--state",
+        help="Reconcile state store to take decisions from instead")
+    p.add_argument("--feedback",
+        help="Message to send with approvals")
+
+    args = parser.parse_args(argv)
+    if args.command == 'review' and not (args.review or args.state):
+        parser.error("review needs a review CSV or --state")
+    metrics.start(args)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mturk = MTurk(args.endpoint_url, args.region, args.rate,
+                  workers=args.workers)
+    ledger = MTurkLedger(args.ledger)
+
+    if args.command == 'publish':
+        batch = args.batch or os.path.splitext(
+            os.path.basename(args.hits.name))[0]
+        hit_type = {
+            'Title': args.title,
+            'Description': args.description or args.title,
+            'Keywords': args.keywords,
+            'Reward': args.reward,
+            'AssignmentDurationInSeconds': int(args.duration_minutes * 60),
+            'AutoApprovalDelayInSeconds': int(args.auto_approve_days * 86400),
+        }
+        rows = list(csv.DictReader(args.hits))
+        count = publish(mturk, ledger, rows, batch, hit_type, args.layout_id,
+                        args.assignments, int(args.lifetime_days * 86400))
+        print("published %d HITs as batch %r" % (count, batch))
+
+    elif args.command == 'harvest':
+        harvest(mturk, ledger, args.batch)
+        rows = ledger.results(args.batch)
+        with open(args.results, 'w', newline='') as f:
+            write_results(rows, f)
+        print("wrote %d assignments to %s" % (len(rows), args.results))
+
+    elif args.command == 'review':
+        if args.state:
+            from reconcile_state import ReconcileState
+            state = ReconcileState(args.state)
+            decisions = state.decisions()
+            rows = [row for _, _, group in state.decided_groups()
+                    for row in group]
+        else:
+            rows = list(csv.DictReader(args.review))
+            decisions = list(csv_decisions(rows))
+        # one decision for each assignment of a packed detail HIT, once
+        # all its offices have one
+        decisions, incomplete = merge_decisions(decisions,
+                                                office_counts(rows))
+        report_incomplete(incomplete)
+        count = push_reviews(mturk, ledger, decisions, args.feedback)
+        print("pushed %d decisions" % count)
+
+    ledger.close()
+
+
+if __name__ == '__main__':
+    main()
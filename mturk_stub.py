@@ -0,0 +1,250 @@
+"""
+A stand-in for the MTurk requester API, for testing mturk.py.
+
+    python mturk_stub.py --port 8766 &
+    AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x \
+        python mturk.py --endpoint-url http://localhost:8766 publish ...
+
+It speaks the JSON protocol boto3 uses for the operations mturk.py needs.
+HITs are kept in memory; each time a HIT's assignments are listed, one more
+made-up assignment is "submitted", until it has all it asked for. A
+fraction of requests can be throttled or fail to exercise retries.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+
+TARGET_PREFIX = 'MTurkRequesterServiceV20170117.'
+
+ANSWERS_XML = ('<QuestionFormAnswers xmlns="http://mechanicalturk.amazonaws'
+               '.com/AWSMechanicalTurkDataSchemas/2005-10-01/'
+               'QuestionFormAnswers.xsd">%s</QuestionFormAnswers>')
+
+
+class RequestError(Exception):
+
+    def __init__(self, message, kind='RequestError', status=400):
+        Exception.__init__(self, message)
+        self.kind = kind
+        self.status = status
+
+
+def fake_answers(inputs, n):
+    """
+    Answers echoing a HIT's inputs, varying between assignments.
+    """
+    if 'office' in inputs:
+        answers = {
+            'address': '%d Main St' % (100 + n % 2),
+            'city': inputs['office'],
+            'state': inputs.get('state', ''),
+            'phone': '202-555-01%02d' % (n % 2),
+        }
+    else:
+        answers = {'district_offices': 'Springfield\nCenterville'}
+    return ANSWERS_XML % ''.join(
+        '<Answer><QuestionIdentifier>%s</QuestionIdentifier>'
+        '<FreeText>%s</FreeText></Answer>' % (escape(k), escape(v))
+        for k, v in answers.items())
+
+
+class StubState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hit_types = {}
+        self.hits = {}
+        self.tokens = {}
+        self.assignments = {}
+
+    def CreateHITType(self, params):
+        key = json.dumps(params, sort_keys=True).encode('utf-8')
+        hit_type_id = 'T' + hashlib.sha1(key).hexdigest()[:19].upper()
+        self.hit_types[hit_type_id] = params
+        return {'HITTypeId': hit_type_id}
+
+    def CreateHITWithHITType(self, params):
+        hit_type = self.hit_types.get(params['HITTypeId'])
+        if hit_type is None:
+            raise RequestError('No such HIT type')
+        token = params.get('UniqueRequestToken')
+        if token in self.tokens:
+            raise RequestError(
+                'The HIT with ID "%s" already exists with this '
+                'UniqueRequestToken' % self.tokens[token])
+
+        now = time.time()
+        hit_id = '3S%018d' % len(self.hits)
+        hit = {
+            'HITId': hit_id,
+            'HITTypeId': params['HITTypeId'],
+            'HITLayoutId': params.get('HITLayoutId'),
+            'Title': hit_type['Title'],
+            'Reward': hit_type['Reward'],
+            'CreationTime': now,
+            'Expiration': now + params['LifetimeInSeconds'],
+            'MaxAssignments': params['MaxAssignments'],
+            'HITStatus': 'Assignable',
+            'RequesterAnnotation': params.get('RequesterAnnotation'),
+        }
+        self.hits[hit_id] = dict(hit, inputs={
+            p['Name']: p['Value'] for p in params['HITLayoutParameters']})
+        self.assignments[hit_id] = []
+        if token:
+            self.tokens[token] = hit_id
+        return {'HIT': hit}
+
+    def GetHIT(self, params):
+        hit = self.hits.get(params['HITId'])
+        if hit is None:
+            raise RequestError('No such HIT')
+        return {'HIT': {k: v for k, v in hit.items() if k != 'inputs'}}
+
+    def submit_one(self, hit_id):
+        hit = self.hits[hit_id]
+        done = self.assignments[hit_id]
+        if len(done) >= hit['MaxAssignments']:
+            return
+        n = len(done)
+        accepted = time.time() - 60 - n
+        done.append({
+            'AssignmentId': '%s_%d' % (hit_id, n),
+            'WorkerId': 'A%013d' % random.randrange(50),
+            'HITId': hit_id,
+            'AssignmentStatus': 'Submitted',
+            'AcceptTime': accepted,
+            'SubmitTime': accepted + 30 + n,
+            'Answer': fake_answers(hit['inputs'], n),
+        })
+
+    def ListAssignmentsForHIT(self, params):
+        hit_id = params['HITId']
+        if hit_id not in self.hits:
+            raise RequestError('No such HIT')
+        self.submit_one(hit_id)
+        statuses = params.get('AssignmentStatuses')
+        found = [a for a in self.assignments[hit_id]
+                 if not statuses or a['AssignmentStatus'] in statuses]
+        start = int(params.get('NextToken') or 0)
+        end = start + params.get('MaxResults', 10)
+        page = {'NumResults': len(found[start:end]),
+                'Assignments': found[start:end]}
+        if end < len(found):
+            page['NextToken'] = str(end)
+        return page
+
+    def find(self, assignment_id):
+        hit_id = assignment_id.rsplit('_', 1)[0]
+        for assignment in self.assignments.get(hit_id, ()):
+            if assignment['AssignmentId'] == assignment_id:
+                return assignment
+        raise RequestError('No such assignment')
+
+    def ApproveAssignment(self, params):
+        assignment = self.find(params['AssignmentId'])
+        status = assignment['AssignmentStatus']
+        if not (status == 'Submitted' or
+                (status == 'Rejected' and params.get('OverrideRejection'))):
+            raise RequestError('This operation can be called with a status '
+                               'of: Submitted')
+        assignment['AssignmentStatus'] = 'Approved'
+        return {}
+
+    def RejectAssignment(self, params):
+        assignment = self.find(params['AssignmentId'])
+        if assignment['AssignmentStatus'] != 'Submitted':
+            raise RequestError('This operation can be called with a status '
+                               'of: Submitted')
+        if not params.get('RequesterFeedback'):
+            raise RequestError('RequesterFeedback is required')
+        assignment['AssignmentStatus'] = 'Rejected'
+        return {}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # set on the server: state, failure_rate, latency, stats
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        operation = self.headers.get('X-Amz-Target', '')
+        operation = operation.replace(TARGET_PREFIX, '')
+
+        with server.lock:
+            server.stats['requests'] += 1
+            server.stats[operation] = server.stats.get(operation, 0) + 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        try:
+            if random.random() < server.failure_rate:
+                with server.lock:
+                    server.stats['failures'] += 1
+                raise random.choice([
+                    RequestError('Rate exceeded', 'ThrottlingException'),
+                    RequestError('Service unavailable', 'ServiceFault', 503),
+                ])
+            handler = getattr(server.state, operation, None)
+            if handler is None or not operation[:1].isupper():
+                raise RequestError('Unknown operation %r' % operation)
+            with server.state.lock:
+                result = handler(json.loads(body.decode('utf-8') or '{}'))
+            self.respond(200, result)
+        except RequestError as e:
+            self.respond(e.status, {'__type': e.kind, 'Message': str(e)})
+
+    def respond(self, status, result):
+        out = json.dumps(result).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=0, failure_rate=0, latency=0):
+    """
+    Create (but don't start) a stub server; port 0 picks a free port.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.state = StubState()
+    server.failure_rate = failure_rate
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'failures': 0}
+    server.url = 'http://127.0.0.1:%d' % server.server_port
+    return server
+
+
+def start_server(**kwargs):
+    """
+    Start a stub server in a background thread and return it.
+    """
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub MTurk requester API')
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--failure-rate", type=float, default=0,
+        help="Fraction of requests to throttle or fail")
+    parser.add_argument("--latency", type=float, default=0,
+        help="Seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.failure_rate, args.latency)
+    print("Listening on %s" % server.url)
+    server.serve_forever()
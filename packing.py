@@ -0,0 +1,285 @@
+"""
+Several offices of one legislator in one detail HIT, and back.
+
+A packed detail HIT lists up to MAX_OFFICES offices in `office_1` ...
+`office_10` (unused ones empty; office_details_packed.html shows a form for
+each of the others) so the worker finds the legislator's website once for
+all of them. Its answers come back numbered the same way: Answer.address_1,
+Answer.city_1 and so on.
+
+Unpacking turns each packed assignment back into one row per office, with
+`Input.office` and unnumbered answers, and `/<n>` appended to its HITId and
+AssignmentId; `Input.office_count` is kept. The rest of the pipeline then
+works on them as usual: reconcile_detail_results and convert_office_results
+unpack packed exports themselves. The review decisions for a packed
+assignment's offices are merged back into one for MTurk once every office
+has one, rejected if any of its offices was:
+
+    python packing.py unpack detail_results.csv detail_results_unpacked.csv
+    python packing.py review detail_results_review.csv detail_review_upload.csv
+"""
+import argparse
+import csv
+import re
+import sys
+from collections import OrderedDict
+
+
+MAX_OFFICES = 10  # office slots in office_details_packed.html
+SEPARATOR = '/'  # between a packed id and the office number
+
+# estimated seconds to find a legislator's offices on their website, and
+# then to fill in each office; together, the ~475s mean of a one-office HIT
+SITE_SECONDS = 240
+OFFICE_SECONDS = 235
+
+HIT_FIELDS = ['id', 'url', 'name', 'state', 'office_count'] + [
+    'office_%d' % n for n in range(1, MAX_OFFICES + 1)]
+
+NUMBERED = re.compile(r'^(Answer\..+|Input\.office)_(\d+)$')
+
+
+def estimate_seconds(offices, site_seconds=SITE_SECONDS,
+                     office_seconds=OFFICE_SECONDS):
+    return site_seconds + offices * office_seconds
+
+
+def offices_per_hit(limit=MAX_OFFICES, target_seconds=None, **estimates):
+    """
+    Most offices to put in one HIT: at most `limit`, and no more than fit
+    in `target_seconds` of estimated work (but always at least one).
+    """
+    n = min(limit, MAX_OFFICES)
+    if target_seconds:
+        while n > 1 and estimate_seconds(n, **estimates) > target_seconds:
+            n -= 1
+    return max(n, 1)
+
+
+def pack_offices(rows_out, per_hit):
+    """
+    Packed HIT rows for one legislator's split_to_office_hits rows, as
+    few HITs as `per_hit` allows with the offices spread evenly over them.
+    """
+    if not rows_out:
+        return
+    hits = -(-len(rows_out) // per_hit)
+    size, extra = divmod(len(rows_out), hits)
+    start = 0
+    for i in range(hits):
+        offices = rows_out[start:start + size + (i < extra)]
+        start += len(offices)
+        first = offices[0]
+        packed = {k: first[k] for k in ('id', 'url', 'name', 'state')}
+        packed['office_count'] = len(offices)
+        for n in range(1, MAX_OFFICES + 1):
+            packed['office_%d' % n] = (
+                offices[n - 1]['office'] if n <= len(offices) else '')
+        yield packed
+
+
+def is_packed(fieldnames):
+    return 'Input.office_1' in (fieldnames or ())
+
+
+def unpacked_fields(fieldnames):
+    """
+    Column names of unpacked rows, in the order of the packed ones.
+    """
+    fields = []
+    for field in fieldnames:
+        match = NUMBERED.match(field)
+        if match:
+            field = match.group(1)
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def unpack_row(row):
+    """
+    A row for each office of a packed result row.
+    """
+    common = {}
+    numbered = {}
+    for field, value in row.items():
+        match = NUMBERED.match(field)
+        if match:
+            numbered.setdefault(int(match.group(2)), {})[
+                match.group(1)] = value
+        else:
+            common[field] = value
+
+    for n in sorted(numbered):
+        fields = numbered[n]
+        if not (fields.get('Input.office') or '').strip():
+            continue
+        out = dict(common, **fields)
+        for key in ('HITId', 'AssignmentId'):
+            if out.get(key):
+                out[key] = '%s%s%d' % (out[key], SEPARATOR, n)
+        yield out
+
+
+def unpack(infile, outfile):
+    """
+    Write the rows of a packed results CSV unpacked; returns how many.
+    """
+    reader = csv.DictReader(infile)
+    writer = csv.DictWriter(outfile, unpacked_fields(reader.fieldnames))
+    writer.writeheader()
+    count = 0
+    for row in reader:
+        for out in unpack_row(row):
+            writer.writerow(out)
+            count += 1
+    return count
+
+
+def unpacked_source(source):
+    """
+    `source`, or if it's a packed results CSV, a temporary file of its rows
+    unpacked. Only files can be checked; unpack piped exports first.
+    """
+    if not source.seekable():
+        return source
+    header = next(csv.reader(source), [])
+    source.seek(0)
+    if not is_packed(header):
+        return source
+
+    import tempfile
+    unpacked = tempfile.TemporaryFile('w+', newline='')
+    count = unpack(source, unpacked)
+    unpacked.seek(0)
+    print("unpacked %s into %d office rows" % (source.name, count),
+          file=sys.stderr)
+    return unpacked
+
+
+def original_id(unpacked_id):
+    """
+    The packed HIT or assignment id an unpacked one came from.
+    """
+    base, separator, n = unpacked_id.rpartition(SEPARATOR)
+    return base if separator and n.isdigit() else unpacked_id
+
+
+def office_counts(rows):
+    """
+    {packed assignment id: its number of offices} from unpacked rows.
+    """
+    counts = {}
+    for row in rows:
+        key = original_id(row.get('AssignmentId', ''))
+        count = row.get('Input.office_count')
+        if key != row.get('AssignmentId') and count and count.isdigit():
+            counts[key] = int(count)
+    return counts
+
+
+def merge_decisions(decisions, counts):
+    """
+    Merge (assignment id, decision, reason) of unpacked rows into one per
+    packed assignment: rejected, with each office's reason, if any office
+    was. Decisions for assignments that weren't packed pass through.
+
+    A packed assignment is only merged once each of its offices (`counts`
+    has how many; see office_counts) has a decision, since MTurk can't take
+    an approval back. Returns the merged decisions, and the packed
+    assignment ids left out for want of some.
+    """
+    merged = OrderedDict()
+    decided = {}
+    for assignment_id, decision, reason in decisions:
+        key = original_id(assignment_id)
+        if key == assignment_id:
+            merged[key] = (decision, reason)
+            continue
+        decided.setdefault(key, set()).add(assignment_id)
+        previous, reasons = merged.get(key, ('approve', None))
+        if decision == 'reject':
+            office = assignment_id[len(key) + 1:]
+            reason = 'Office %s: %s' % (office, reason)
+            reasons = '\n'.join(filter(None, [reasons, reason]))
+            previous = 'reject'
+        merged[key] = (previous, reasons)
+
+    incomplete = [key for key, offices in decided.items()
+                  if len(offices) < counts.get(key, MAX_OFFICES + 1)]
+    for key in incomplete:
+        del merged[key]
+    return ([(a, d, r) for a, (d, r) in merged.items()], incomplete)
+
+
+def report_incomplete(incomplete):
+    if incomplete:
+        print("skipped %d packed assignments with offices still to decide: "
+              "%s" % (len(incomplete), ' '.join(incomplete)),
+              file=sys.stderr)
+
+
+def collapse_review(infile, outfile):
+    """
+    Write a review CSV with one row per packed assignment, with its
+    original ids and merged decision, to upload to mturk.com.
+    """
+    reader = csv.DictReader(infile)
+    rows = OrderedDict()
+    decisions = []
+    counts = {}
+    for row in reader:
+        counts.update(office_counts([row]))
+        assignment_id = original_id(row['AssignmentId'])
+        if assignment_id not in rows:
+            rows[assignment_id] = dict(row, HITId=original_id(row['HITId']))
+        if row.get('Reject'):
+            decisions.append((row['AssignmentId'], 'reject', row['Reject']))
+        elif row.get('Approve'):
+            decisions.append((row['AssignmentId'], 'approve', None))
+
+    writer = csv.DictWriter(outfile, reader.fieldnames)
+    writer.writeheader()
+    merged, incomplete = merge_decisions(decisions, counts)
+    report_incomplete(incomplete)
+    merged = {a: (d, r) for a, d, r in merged}
+    for key in incomplete:
+        del rows[key]
+    for assignment_id, row in rows.items():
+        decision, reason = merged.get(assignment_id, (None, None))
+        row['AssignmentId'] = assignment_id
+        row['Approve'] = 'x' if decision == 'approve' else ''
+        row['Reject'] = reason if decision == 'reject' else ''
+        writer.writerow(row)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Unpack packed detail HIT results, or merge their review decisions')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('unpack',
+        help="Write one row per office of packed detail results")
+    p.add_argument("results", type=argparse.FileType('r'))
+    p.add_argument("out", type=argparse.FileType('w'), nargs='?',
+                   default='-')
+
+    p = commands.add_parser('review',
+        help="Merge a review CSV of unpacked rows into one row per "
+             "assignment, for mturk.com")
+    p.add_argument("review", type=argparse.FileType('r'))
+    p.add_argument("out", type=argparse.FileType('w'), nargs='?',
+                   default='-')
+
+    args = parser.parse_args(argv)
+    if args.command == 'unpack':
+        count = unpack(args.results, args.out)
+        print("%d office rows" % count, file=sys.stderr)
+    else:
+        count = collapse_review(args.review, args.out)
+        print("%d assignments" % count, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,174 @@
+"""
+Patch office details into legislators-district-offices.yaml.
+
+Rather than loading and re-dumping the whole file, this indexes the byte
+offsets of each legislator's block and splices in the `offices` of the
+patched legislators, leaving every other byte of the file as it was.
+Legislators not yet in the file are inserted in bioguide order.
+"""
 import argparse
-import yaml
-from itertools import groupby
-
-parser = argparse.ArgumentParser(description=
-    'Patch office details into main file')
-parser.add_argument("patch",
-    help="File with offices to patch in",
-    type=argparse.FileType('r'),
-    default='-')
-parser.add_argument("source",
-    help="source (legislators-district-offices.yaml)",
-    type=argparse.FileType('r', 0))
-parser.add_argument("destination",
-    help="destination for patched results (legislators-district-offices.yaml)",
-    type=argparse.FileType('w', 0),
-    default='-')
-args = parser.parse_args()
-
-patch = yaml.load(args.patch)
-main = yaml.load(args.source)
-by_id = {r['id']['bioguide']: r for r in main}
-for r in patch:
-    by_id[r['id']['bioguide']]['offices'] = r['offices']
-
-args.destination.truncate()
-args.destination.write(yaml.dump(main, default_flow_style=False))
+import mmap
+import os
+import re
+import sys
+import tempfile
+from collections import OrderedDict, namedtuple
+
+import metrics
+
+BLOCK_START = re.compile(rb'^- ', re.M)
+BIOGUIDE = re.compile(rb'''^\s+bioguide:\s*['"]?([A-Za-z0-9]+)''', re.M)
+OFFICES = re.compile(rb'^  offices:', re.M)
+
+Block = namedtuple('Block', 'bioguide start end offices')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Patch office details into main file')
+    parser.add_argument("patch",
+        help="Files with offices to patch in (later files win; - for "
+             "standard input)",
+        nargs='+')
+    parser.add_argument("source",
+        help="source (legislators-district-offices.yaml)")
+    parser.add_argument("destination",
+        help="destination for patched results "
+             "(legislators-district-offices.yaml; may be the source)")
+    metrics.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    metrics.start(args)
+    return args
+
+
+def read_mapped(path):
+    """
+    Contents of a file, memory-mapped (or b'' if it's empty). `-` reads
+    standard input into memory instead, as it can't be mapped.
+    """
+    if path == '-':
+        return sys.stdin.buffer.read()
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def index_blocks(data):
+    """
+    Byte offsets of each top-level legislator block, in file order.
+
+    `offices` is where the block's "offices:" key starts (or its end).
+    """
+    starts = [m.start() for m in BLOCK_START.finditer(data)]
+    blocks = []
+    for start, end in zip(starts, starts[1:] + [len(data)]):
+        m = BIOGUIDE.search(data, start, end)
+        if not m:
+            raise ValueError("No bioguide id in block at byte %d" % start)
+        o = OFFICES.search(data, start, end)
+        blocks.append(Block(m.group(1).decode('ascii'), start, end,
+                            o.start() if o else end))
+    return blocks
+
+
+def offices_text(data, block):
+    text = bytes(data[block.offices:block.end])
+    if text and not text.endswith(b'\n'):
+        text += b'\n'
+    return text
+
+
+def load_patches(paths):
+    """
+    {bioguide: (data, block)} across patch files, later files winning.
+    """
+    patches = OrderedDict()
+    for path in paths:
+        data = read_mapped(path)
+        for block in index_blocks(data):
+            patches[block.bioguide] = (data, block)
+    return patches
+
+
+def patch(data, patches):
+    """
+    Splice patched offices into `data`.
+
+    Returns the new contents and a dict of bioguide ids that were changed,
+    added and unchanged.
+    """
+    blocks = index_blocks(data)
+    report = {'changed': [], 'added': [], 'unchanged': []}
+
+    existing = {b.bioguide for b in blocks}
+    additions = sorted(k for k in patches if k not in existing)
+
+    out = [bytes(data[:blocks[0].start]) if blocks else bytes(data)]
+
+    def add_new(before=None):
+        while additions and (before is None or additions[0] < before):
+            bioguide = additions.pop(0)
+            patch_data, patch_block = patches[bioguide]
+            text = bytes(patch_data[patch_block.start:patch_block.end])
+            if not text.endswith(b'\n'):
+                text += b'\n'
+            out.append(text)
+            report['added'].append(bioguide)
+
+    for block in blocks:
+        add_new(before=block.bioguide)
+
+        if block.bioguide not in patches:
+            out.append(bytes(data[block.start:block.end]))
+            continue
+
+        old = offices_text(data, block)
+        new = offices_text(*patches[block.bioguide])
+        if old == new:
+            report['unchanged'].append(block.bioguide)
+        else:
+            report['changed'].append(block.bioguide)
+        out.append(bytes(data[block.start:block.offices]))
+        out.append(new)
+
+    add_new()
+    return b''.join(out), report
+
+
+def write_atomic(path, contents):
+    if path == '-':
+        sys.stdout.buffer.write(contents)
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, partial = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(path):
+        os.chmod(partial, os.stat(path).st_mode)
+    os.replace(partial, path)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with metrics.timed('index_patches'):
+        patches = load_patches(args.patch)
+    with metrics.timed('patch'):
+        contents, report = patch(read_mapped(args.source), patches)
+    with metrics.timed('write'):
+        write_atomic(args.destination, contents)
+    for status, bioguides in report.items():
+        metrics.incr('legislators_' + status, len(bioguides))
+
+    for status in ('changed', 'added', 'unchanged'):
+        if report[status]:
+            print("%s: %s" % (status, ' '.join(report[status])),
+                  file=sys.stderr)
+
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""
+Run the pipeline scripts as a dependency graph, skipping up-to-date stages.
+
+Each stage's fingerprint covers its script and the repository's modules it
+imports, its arguments and the contents of its input files. A stage runs
+only when its fingerprint changed since it last succeeded or an output is
+missing; stages whose inputs don't exist yet (e.g. results not yet
+downloaded from mturk.com) are skipped, as is everything downstream of a
+stage that failed. Independent non-interactive stages run in parallel; the
+interactive reconcile stages run one at a time in the foreground.
+
+When only some legislators' reconciled details changed, the convert stage
+converts just those legislators and splices them into its previous output.
+
+File names default to those in the readme and can be overridden in a YAML
+config file:
+
+    legislators: congress-legislators/legislators-current.yaml
+    offices: congress-legislators/legislators-district-offices.yaml
+    select: [--type, sen]
+
+    python pipeline.py --config pipeline.yaml [--dry-run] [stage ...]
+"""
+import argparse
+import ast
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict, namedtuple
+
+import patch_details
+from legislators import file_hash
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULTS = {
+    'legislators': 'congress-legislators/legislators-current.yaml',
+    'offices': None,  # legislators-district-offices.yaml to patch, if any
+    'select': ['-a'],  # generate_hits options choosing legislators
+    'reconcile_args': [],  # extra options for both reconcile scripts
+    'split_args': [],  # split_to_office_hits options, e.g. [--pack, '4']
+    'carried': 'carried_offices.yaml',  # offices split --existing carries over
+    'list_hits': 'list_hits.csv',
+    'list_results': 'list_results.csv',
+    'list_results_out': 'list_results_out.csv',
+    'list_results_review': 'list_results_review.csv',
+    'detail_hits': 'detail_hits.csv',
+    'detail_results': 'detail_results.csv',
+    'detail_results_out': 'detail_results_out.csv',
+    'detail_results_review': 'detail_results_review.csv',
+    'detail_results_yaml': 'detail_results.yaml',
+    'state': '.pipeline-state.json',
+}
+
+Stage = namedtuple('Stage', 'name script args inputs outputs interactive')
+
+
+def option(args, name):
+    """
+    Value of option `name` in a list of arguments, or None.
+    """
+    for i, arg in enumerate(args):
+        if arg == name and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return None
+
+
+def carried_manifest(c):
+    """
+    Where split writes the offices it carries over, if it's given
+    --existing, or None.
+    """
+    if option(c['split_args'], '--existing') is None:
+        return None
+    return option(c['split_args'], '--carried') or c['carried']
+
+
+def build_stages(c):
+    # with --existing, split carries offices over in a manifest, which
+    # convert must merge back in or they'd be dropped from its output
+    carried = carried_manifest(c)
+    split_args = list(c['split_args'])
+    if carried and option(split_args, '--carried') is None:
+        split_args += ['--carried', carried]
+    carried = [carried] if carried else []
+
+    stages = [
+        Stage('generate', 'generate_hits.py',
+              [c['legislators']] + c['select'] + ['-o', c['list_hits']],
+              [c['legislators']], [c['list_hits']], False),
+        Stage('reconcile_list', 'reconcile_list_results.py',
+              [c['list_results'], c['list_results_out'],
+               c['list_results_review']] + c['reconcile_args'],
+              [c['list_results']],
+              [c['list_results_out'], c['list_results_review']], True),
+        Stage('split', 'split_to_office_hits.py',
+              [c['list_results_out'], '-o', c['detail_hits']] + split_args,
+              [c['list_results_out']], [c['detail_hits']] + carried, False),
+        Stage('reconcile_detail', 'reconcile_detail_results.py',
+              [c['detail_results'], c['detail_results_out'],
+               c['detail_results_review']] + c['reconcile_args'],
+              [c['detail_results']],
+              [c['detail_results_out'], c['detail_results_review']], True),
+        Stage('convert', 'convert_office_results.py',
+              [c['detail_results_out'], c['legislators'],
+               c['detail_results_yaml']] +
+              (['--carried'] + carried if carried else []),
+              [c['detail_results_out'], c['legislators']] + carried,
+              [c['detail_results_yaml']], False),
+    ]
+    if c['offices']:
+        stages.append(Stage(
+            'patch', 'patch_details.py',
+            [c['detail_results_yaml'], c['offices'], c['offices']],
+            [c['detail_results_yaml'], c['offices']], [c['offices']], False))
+    return stages
+
+
+def dependencies(stages):
+    """
+    {stage name: names of stages producing its inputs}
+    """
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producers.setdefault(path, stage.name)
+    return {stage.name: {producers[p] for p in stage.inputs
+                         if p in producers and producers[p] != stage.name}
+            for stage in stages}
+
+
+def local_modules(script):
+    """
+    Sorted paths of `script` and the modules next to it that it imports,
+    directly or through each other (including imports inside functions).
+    """
+    found = set()
+    pending = [os.path.join(HERE, script)]
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.add(path)
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module = os.path.join(HERE, name.split('.')[0] + '.py')
+                if os.path.exists(module):
+                    pending.append(module)
+    return sorted(found)
+
+
+def fingerprint(stage):
+    """
+    Hash of a stage's script and local modules, arguments and inputs.
+
+    Files the stage rewrites in place (inputs that are also outputs) are
+    left out, or the stage would always look stale after running.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([stage.script, stage.args]).encode('utf-8'))
+    for path in local_modules(stage.script):
+        digest.update(file_hash(path).encode())
+    for path in stage.inputs:
+        if path not in stage.outputs:
+            digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def legislator_hashes(path):
+    """
+    {bioguide id: hash of that legislator's rows}, ignoring row order.
+    """
+    rows = defaultdict(list)
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            rows[row['Input.id']].append(hashlib.sha256(
+                json.dumps(sorted(row.items())).encode('utf-8')).hexdigest())
+    return {key: hashlib.sha256(''.join(sorted(digests)).encode()).hexdigest()
+            for key, digests in rows.items()}
+
+
+class Pipeline(object):
+
+    def __init__(self, config, jobs=4, dry_run=False, force=()):
+        self.config = config
+        self.stages = build_stages(config)
+        self.by_name = {s.name: s for s in self.stages}
+        self.deps = dependencies(self.stages)
+        self.jobs = jobs
+        self.dry_run = dry_run
+        self.force = set(force)
+        self.state = self.load_state()
+
+    def load_state(self):
+        try:
+            with open(self.config['state']) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        partial = self.config['state'] + '.tmp'
+        with open(partial, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(partial, self.config['state'])
+
+    def missing_inputs(self, stage):
+        return [p for p in stage.inputs if not os.path.exists(p)]
+
+    def is_stale(self, stage):
+        if stage.name in self.force:
+            return True
+        done = self.state.get(stage.name, {})
+        if any(not os.path.exists(p) for p in stage.outputs):
+            return True
+        return done.get('fingerprint') != fingerprint(stage)
+
+    def run_script(self, stage, args=None):
+        command = [sys.executable, os.path.join(HERE, stage.script)]
+        command += stage.args if args is None else args
+        print("running %s: %s" % (stage.name, ' '.join(command[1:])))
+        return subprocess.call(command)
+
+    def run_convert(self, stage):
+        """
+        Convert only the legislators whose reconciled rows changed, when the
+        previous output can be patched; otherwise convert everything.
+        """
+        source, legislators, output = stage.args[:3]
+        previous = self.state.get(stage.name, {})
+        hashes = legislator_hashes(source)
+        old = previous.get('legislators')
+        others = {p: file_hash(p) for p in stage.inputs[1:]}
+
+        if not (old and os.path.exists(output) and
+                set(old) <= set(hashes) and
+                previous.get('inputs') == others and
+                previous.get('script') == file_hash(
+                    os.path.join(HERE, stage.script))):
+            status = self.run_script(stage)
+        else:
+            changed = {k for k, v in hashes.items() if old.get(k) != v}
+            status = 0
+            if changed:
+                status = self.convert_some(stage, changed)
+
+        if not status:
+            self.state[stage.name].update(
+                legislators=hashes, inputs=others,
+                script=file_hash(os.path.join(HERE, stage.script)))
+        return status
+
+    def convert_some(self, stage, changed):
+        source, legislators, output = stage.args[:3]
+        print("converting %d changed legislators" % len(changed))
+        with tempfile.TemporaryDirectory() as tmp:
+            subset = os.path.join(tmp, 'subset.csv')
+            converted = os.path.join(tmp, 'subset.yaml')
+            with open(source, newline='') as f, \
+                    open(subset, 'w', newline='') as out:
+                reader = csv.DictReader(f)
+                writer = csv.DictWriter(out, fieldnames=reader.fieldnames)
+                writer.writeheader()
+                writer.writerows(r for r in reader
+                                 if r['Input.id'] in changed)
+
+            status = self.run_script(
+                stage, [subset, legislators, converted] + stage.args[3:])
+            if status:
+                return status
+
+            contents, _ = patch_details.patch(
+                patch_details.read_mapped(output),
+                patch_details.load_patches([converted]))
+            patch_details.write_atomic(output, contents)
+        return 0
+
+    def run_stage(self, stage):
+        self.state.setdefault(stage.name, {})
+        if stage.name == 'convert':
+            status = self.run_convert(stage)
+        else:
+            status = self.run_script(stage)
+        if not status:
+            self.state[stage.name]['fingerprint'] = fingerprint(stage)
+        return status
+
+    def plan(self, targets=None):
+        """
+        Stages to consider, with their upstream stages, in graph order.
+        """
+        wanted = set(targets or self.by_name)
+        pending = list(wanted)
+        while pending:
+            for dep in self.deps[pending.pop()]:
+                if dep not in wanted:
+                    wanted.add(dep)
+                    pending.append(dep)
+        return [s for s in self.stages if s.name in wanted]
+
+    def run(self, targets=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        stages = self.plan(targets)
+        done, failed, blocked = set(), set(), set()
+        remaining = list(stages)
+
+        while remaining:
+            ready = [s for s in remaining
+                     if self.deps[s.name] <= done | blocked]
+            if not ready:
+                break
+            for stage in ready:
+                remaining.remove(stage)
+
+            to_run = []
+            for stage in ready:
+                upstream = self.deps[stage.name] & failed
+                missing = self.missing_inputs(stage)
+                if upstream or missing:
+                    print("skipping %s (waiting for %s)" % (
+                        stage.name, ', '.join(sorted(upstream) or missing)))
+                    blocked.add(stage.name)
+                elif self.is_stale(stage):
+                    to_run.append(stage)
+                else:
+                    print("%s is up to date" % stage.name)
+                    done.add(stage.name)
+
+            if self.dry_run:
+                for stage in to_run:
+                    print("would run %s" % stage.name)
+                    done.add(stage.name)
+                continue
+
+            batch = [s for s in to_run if not s.interactive]
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                statuses = list(pool.map(self.run_stage, batch))
+            for stage in to_run:
+                if stage.interactive:
+                    statuses.append(self.run_stage(stage))
+                    batch.append(stage)
+
+            for stage, status in zip(batch, statuses):
+                (failed if status else done).add(stage.name)
+                if status:
+                    print("%s failed (exit %s)" % (stage.name, status))
+            self.save_state()
+
+        return not failed
+
+
+def load_config(path):
+    config = dict(DEFAULTS)
+    if path:
+        import yaml
+        with open(path) as f:
+            config.update(yaml.safe_load(f) or {})
+    return config
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Run the stale stages of the district offices pipeline')
+    parser.add_argument("targets", nargs='*',
+        help="Stages to bring up to date (default: all): %s" % ', '.join(
+            s.name for s in build_stages(dict(DEFAULTS, offices='x'))))
+    parser.add_argument("--config", help="YAML file of paths and options")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+        help="Show which stages would run")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+        help="Stages to run at once")
+    parser.add_argument("--force", nargs='*', default=[],
+        help="Stages to run even if up to date")
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(load_config(args.config), args.jobs, args.dry_run,
+                        args.force)
+    sys.exit(0 if pipeline.run(args.targets) else 1)
+
+
+if __name__ == '__main__':
+    main()
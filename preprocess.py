@@ -0,0 +1,129 @@
+"""
+Column-at-a-time preprocessing of answer fields.
+
+Reconcilers name a list of processors (plain functions of one value) for
+each answer field. Each field's list is composed into one function up
+front, and a batch of rows is processed a column at a time. Processors must
+be pure and defined at module level, so large batches can be sharded over
+a process pool: only the answer columns are sent to the workers, and the
+processed columns (and optionally each row's fingerprint) come back.
+"""
+import os
+
+SHARD_ROWS = 2000  # fewest rows worth sending to a worker process
+
+
+def compile_chain(processors):
+    """
+    One function applying `processors` in order, or None if there are none.
+    """
+    processors = tuple(processors)
+    if not processors:
+        return None
+    if len(processors) == 1:
+        return processors[0]
+
+    def chain(value):
+        for processor in processors:
+            value = processor(value)
+        return value
+    return chain
+
+
+def process_columns(chains, fingerprint, columns, fingerprints=False):
+    """
+    Apply each column's chain to its values.
+
+    Returns the processed columns, and the fingerprint of each row's
+    answers if asked for.
+    """
+    out = {}
+    for field, values in columns.items():
+        chain = chains.get(field)
+        out[field] = list(map(chain, values)) if chain else values
+    found = None
+    if fingerprints:
+        fields = list(out)
+        found = [fingerprint(dict(zip(fields, answers)))
+                 for answers in zip(*out.values())]
+    return out, found
+
+
+_worker = None  # (chains, fingerprint) in pool worker processes
+
+
+def _init_worker(processors, fingerprint):
+    global _worker
+    _worker = ({f: compile_chain(p) for f, p in processors.items()},
+               fingerprint)
+
+
+def _process_shard(columns, fingerprints):
+    chains, fingerprint = _worker
+    return process_columns(chains, fingerprint, columns, fingerprints)
+
+
+class ColumnPreprocessor(object):
+    """
+    Preprocesses the answer columns of batches of rows.
+
+    `processors` maps each answer field to its list of processors;
+    `fingerprint` hashes a row's {field: answer} dict. With `workers` > 1,
+    batches of at least twice SHARD_ROWS rows are split over that many
+    processes.
+    """
+
+    def __init__(self, processors, fingerprint, workers=1,
+                 shard_rows=SHARD_ROWS):
+        self.processors = {f: tuple(p) for f, p in processors.items()}
+        self.fields = list(self.processors)
+        self.chains = {f: compile_chain(p)
+                       for f, p in self.processors.items()}
+        self.fingerprint = fingerprint
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_rows = shard_rows
+        self.pool = None
+
+    def get_pool(self):
+        if self.pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.processors, self.fingerprint))
+        return self.pool
+
+    def shards(self, size):
+        count = min(self.workers, size // self.shard_rows)
+        step = -(-size // count)
+        return [slice(i, i + step) for i in range(0, size, step)]
+
+    def apply(self, rows, fingerprints=False):
+        """
+        Process `rows` in place; returns their fingerprints if asked for.
+        """
+        columns = {f: [row[f] for row in rows] for f in self.fields}
+
+        if self.workers > 1 and len(rows) >= 2 * self.shard_rows:
+            shards = self.shards(len(rows))
+            results = list(self.get_pool().map(
+                _process_shard,
+                [{f: v[s] for f, v in columns.items()} for s in shards],
+                [fingerprints] * len(shards)))
+            columns = {f: [v for out, _ in results for v in out[f]]
+                       for f in self.fields}
+            found = ([fp for _, fps in results for fp in fps]
+                     if fingerprints else None)
+        else:
+            columns, found = process_columns(
+                self.chains, self.fingerprint, columns, fingerprints)
+
+        for field, values in columns.items():
+            if self.chains.get(field):
+                for row, value in zip(rows, values):
+                    row[field] = value
+        return found
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
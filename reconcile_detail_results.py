@@ -1,12 +1,14 @@
 import re
+from geocode_cache import DAY
+from packing import unpacked_source
 from reconcile_turk_results import TurkResultReconciler
+from smarty_normalize import (
+    GEOCODE_CACHE, LOCAL_GEOCODER, configure_cache, configure_local,
+    get_cache, has_credentials, normalize_address, normalize_addresses)
 
-try:
-    from smarty_normalize import normalize_address
 
-except ImportError:
-    print("smarty not found, not doing address normalization")
-    normalize_address = None
+NOT_AVAILABLE = re.compile(r'^n\s*\/\s*a$', re.I)
+PHONE = re.compile(r'.*(\d{3}).*(\d{3}).*(\d{4}).*')
 
 
 def remove_empty(s):
@@ -18,11 +20,11 @@ def remove_empty(s):
 def remove_not_available(s):
     if not s:
         return s
-    return re.sub(r'^n\s*\/\s*a$', '', s.strip(), flags=re.I)
+    return NOT_AVAILABLE.sub('', s.strip())
 
 
 def normalize_phone(phone):
-    return re.sub(r'.*(\d{3}).*(\d{3}).*(\d{4}).*', r'\1-\2-\3', phone)
+    return PHONE.sub(r'\1-\2-\3', phone)
 
 
 class DetailTaskResultReconciler(TurkResultReconciler):
@@ -35,42 +37,82 @@ class DetailTaskResultReconciler(TurkResultReconciler):
     @property
     def output_fields(self):
         fieldnames = self.reader.fieldnames
-        if normalize_address and 'latitude' not in fieldnames:
+        if self.geocoding and 'latitude' not in fieldnames:
             fieldnames += ['latitude', 'longitude']
         return fieldnames
 
-    def tempfile_edit(self, row):
+    def add_arguments(self, parser):
+        parser.add_argument("--geocode-workers",
+            help="Concurrent address normalization requests",
+            type=int, default=4)
+        parser.add_argument("--geocode-cache",
+            help="SQLite file caching address lookups between runs",
+            default=GEOCODE_CACHE)
+        parser.add_argument("--geocode-cache-days",
+            help="Days before a cached address lookup expires",
+            type=float, default=365)
+        parser.add_argument("--geocode-cache-size",
+            help="Most cached lookups to keep (least recently used go first)",
+            type=int)
+        parser.add_argument("--local-geocoder",
+            help="Index built by local_geocoder.py to look addresses up in "
+                 "before the remote service",
+            default=LOCAL_GEOCODER)
+
+    def parse_args(self, argv=None):
+        args = super(DetailTaskResultReconciler, self).parse_args(argv)
+        args.source = unpacked_source(args.source)  # one row per office
+        self.remote_geocoding = has_credentials()
+        self.geocoding = self.remote_geocoding or bool(args.local_geocoder)
+        if not self.geocoding:
+            print("smarty credentials not found, "
+                  "not doing address normalization")
+        elif not self.remote_geocoding:
+            print("smarty credentials not found, "
+                  "normalizing addresses from the local index only")
+        if args.local_geocoder:
+            configure_local(args.local_geocoder)
+        if self.remote_geocoding:
+            configure_cache(args.geocode_cache,
+                            ttl=args.geocode_cache_days * DAY,
+                            max_entries=args.geocode_cache_size)
+        return args
+
+    def apply_edit(self, row, answers):
         def addr(row):
             return [row.get('Answer.' + f) for f in
                     ['address', 'city', 'state', 'zip']]
 
         orig_addr = addr(row)
 
-        super(DetailTaskResultReconciler, self).tempfile_edit(row)
+        super(DetailTaskResultReconciler, self).apply_edit(row, answers)
 
         # if address fields changed, normalize again
-        if normalize_address and addr(row) != orig_addr:
+        if self.geocoding and addr(row) != orig_addr:
             normalize_address(row)
-        return row
 
-    def preprocessors(self, field):
-        field = field.replace('Answer.', '')
-        return self.STANDARD_PROCESSORS + self.FIELD_PROCESSORS.get(field, [])
+    def preprocess_rows(self, rows):
+        # geocoding (which changes answers) is skipped when counting
+        geocode = self.geocoding and not self.pure
+        rows = self.clean_rows(rows, fingerprint=not geocode)
 
-    def preprocess_row(self, row):
-        for field, answer in self.answers(row).items():
-            for proc in self.preprocessors(field):
-                answer = proc(answer)
-            row[field] = answer
-
-        if normalize_address:  # operates on whole row, handle separately
+        if geocode:  # operates on whole rows, handle separately
             try:
-                normalize_address(row)
+                normalize_addresses(rows, workers=self.args.geocode_workers)
             except Exception as e:
-                print("Error normalizing %r: %s" % (row, e))
+                print("Error normalizing addresses: %s" % e)
+
+        return rows
+
+    def reconcile_results(self):
+        super(DetailTaskResultReconciler, self).reconcile_results()
+        if self.remote_geocoding:
+            print(get_cache().report())
+
 
-        return row
+def main(argv=None):
+    DetailTaskResultReconciler(argv).reconcile_results()
 
 
 if __name__ == '__main__':
-    DetailTaskResultReconciler().reconcile_results()
+    main()
@@ -3,23 +3,32 @@ import string
 
 from reconcile_turk_results import TurkResultReconciler
 
+OFFICE_SUFFIX = re.compile(r'( district)? office$', re.I)
+DC = re.compile(r'washington,? d\.?c\.?', re.I)
+
+
+def split_offices(value):
+    offices = [o.strip() for o in value.strip().split('\n')]
+    offices = [OFFICE_SUFFIX.sub('', o) for o in offices]
+    offices = [o for o in offices if not DC.match(o)]
+    offices.sort(key=lambda s: s.lower())
+    return offices
+
+
 class ListTaskResultReconciler(TurkResultReconciler):
-    def preprocess_row(self, row):
-        offices = [o.strip()
-                   for o in row['Answer.district_offices'].strip().split('\n')]
-        office_suffix = re.compile(r'( district)? office$', re.I)
-        offices = [office_suffix.sub('', o) for o in offices]
-        dc = re.compile('washington,? d\.?c\.?', re.I)
-        offices = [o for o in offices if not dc.match(o)]
-        offices.sort(key=lambda s: s.lower())
-        row['Answer.district_offices'] = offices
-        return row
+    FIELD_PROCESSORS = {
+        'district_offices': [split_offices],
+    }
 
     def postprocess_row(self, row):
         row['Answer.district_offices'] = '\n'.join(row['Answer.district_offices'])
         return row
 
 
+def main(argv=None):
+    ListTaskResultReconciler(argv).reconcile_results()
+
+
 if __name__ == '__main__':
-    ListTaskResultReconciler().reconcile_results()
+    main()
 
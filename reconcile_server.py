@@ -0,0 +1,539 @@
+"""
+Reconcile results with several operators at once, in their browsers.
+
+    python reconcile_server.py detail detail_results.csv \\
+        detail_results_out.csv detail_results_review.csv --state state.sqlite
+
+takes the options of reconcile_list_results.py (`list`) or
+reconcile_detail_results.py (`detail`), plus --host, --port and --lease;
+--state is required. Groups whose answers agree are written out in the
+background as usual. Each operator claims the next disputed group, which
+is leased to them in the state store for --lease seconds (renewed while
+their page is open) so it isn't handed to anyone else. They see the
+answers side by side, edit them in place, pick one and reject any, and
+each decision is recorded in the store as it's made. Several servers can
+share a store; the CSVs are regenerated from it when the server stops.
+"""
+import argparse
+import html
+import importlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, quote, unquote
+
+import metrics
+from reconcile_turk_results import DONE, canonical
+
+KINDS = {
+    'list': ('reconcile_list_results', 'ListTaskResultReconciler'),
+    'detail': ('reconcile_detail_results', 'DetailTaskResultReconciler'),
+}
+
+LEASE = 600  # seconds
+WAIT = 5  # seconds to wait for the next group to be preprocessed
+
+SHADES = ['#fdd', '#ddf', '#dfd', '#fdf', '#dff', '#ffd']
+
+STYLE = """
+    body { font-family: sans-serif; margin: 1em 2em; }
+    table { border-collapse: collapse; }
+    th, td { border: 1px solid #ccc; padding: 4px; text-align: left;
+             vertical-align: top; }
+    tr.contested th { color: #c00; }
+    input[type=text], textarea { width: 22em; }
+    .message { background: #ffc; padding: 4px; }
+"""
+
+
+def edit_text(value):
+    """
+    An answer as text for the edit form.
+    """
+    if isinstance(value, (list, tuple)):
+        return '\n'.join(value)
+    return '' if value is None else str(value)
+
+
+def parse_edit(text, original):
+    """
+    An edited answer, of the same kind as `original`.
+    """
+    text = text.replace('\r\n', '\n')
+    if isinstance(original, (list, tuple)):
+        return [line.strip() for line in text.split('\n') if line.strip()]
+    return text
+
+
+class ReconcileSession(object):
+    """
+    Disputed groups from a reconciler, handed out to operators under
+    leases kept in its state store.
+    """
+
+    def __init__(self, reconciler, lease=LEASE):
+        self.reconciler = reconciler
+        self.state = reconciler.state
+        self.lease = lease
+        self.pending = queue.Queue(maxsize=max(1, reconciler.args.lookahead))
+        self.stop = threading.Event()
+        self.worker = None
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)  # a take finished
+        self.taking = False  # whether someone is waiting on `pending`
+        self.taken = 0  # groups taken from `pending` so far
+        self.open = OrderedDict()  # HITId: group taken from `pending`
+        self.claimed_at = {}  # HITId: when it was first claimed
+        self.skipped = {}  # operator: HITIds they passed on
+        self.finished = False
+        self.error = None
+
+    def start(self):
+        self.worker = threading.Thread(
+            target=self.reconciler.prefetch, args=(self.pending, self.stop),
+            daemon=True)
+        self.worker.start()
+
+    def close(self):
+        self.stop.set()
+        if self.worker:
+            self.worker.join()
+        self.reconciler.preprocessor.close()
+        self.reconciler.export_state()
+
+    def _take(self, timeout):
+        """
+        Move one group from the background preprocessing to `open`, waiting
+        up to `timeout` seconds for it.
+
+        Called with the lock held, and releases it while waiting so that
+        decisions aren't held up. One caller at a time waits on `pending`;
+        the others wait for it to finish.
+        """
+        if self.taking:
+            self.changed.wait(timeout)
+            return
+        self.taking = True
+        self.lock.release()
+        try:
+            item = self.pending.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+        finally:
+            self.lock.acquire()
+            self.taking = False
+            self.changed.notify_all()
+        if item is None:
+            return
+        if item is DONE or isinstance(item, BaseException):
+            self.finished = True
+            self.error = None if item is DONE else item
+            return
+        self.open[item[0]['HITId']] = item
+        self.taken += 1
+
+    def claim_next(self, operator):
+        """
+        HITId of the group `operator` should work on next, or None if
+        there isn't one, or none came from the preprocessing for WAIT
+        seconds.
+        """
+        skipped = self.skipped.setdefault(operator, set())
+        with self.lock:
+            taken = self.taken
+            deadline = time.monotonic() + WAIT
+            while True:
+                for hit_id in list(self.open):
+                    if self.state.is_decided(hit_id):  # by another server
+                        del self.open[hit_id]
+                    elif hit_id not in skipped and self.claim(hit_id,
+                                                              operator):
+                        return hit_id
+                if self.taken != taken:
+                    taken = self.taken
+                    deadline = time.monotonic() + WAIT
+                remaining = deadline - time.monotonic()
+                if self.finished or remaining <= 0:
+                    skipped.clear()
+                    return None
+                self._take(remaining)
+
+    def claim(self, hit_id, operator):
+        """
+        Claim (or renew the claim on) an open group.
+        """
+        if hit_id not in self.open:
+            return False
+        if not self.state.claim(hit_id, operator, self.lease):
+            return False
+        self.claimed_at.setdefault(hit_id, time.perf_counter())
+        return True
+
+    def release(self, hit_id, operator):
+        self.skipped.setdefault(operator, set()).add(hit_id)
+        self.state.release(hit_id, operator)
+
+    def decide(self, hit_id, operator, edits, rejects, chosen=None):
+        """
+        Apply an operator's edits and rejections to a claimed group, and
+        record the result if it's settled: by the `chosen` row's index, or
+        by the edits leaving nothing contested.
+
+        Returns a message for the operator if the group is still open.
+        """
+        r = self.reconciler
+        group = self.open.get(hit_id)
+        if group is None or not self.claim(hit_id, operator):
+            return "This group was decided or claimed by someone else."
+
+        for index, answers in edits.items():
+            r.apply_edit(group[index], answers)
+        for index, row in enumerate(group):
+            reason = rejects.get(index)
+            row['Approve'] = '' if reason else 'x'
+            if reason or 'Reject' in row:
+                row['Reject'] = reason or ''
+
+        if chosen is None and r.contested(group):
+            return "Edits saved; choose one of the answers."
+
+        result = r.resolve(group, None if chosen is None else group[chosen])
+        with self.lock:
+            if self.open.pop(hit_id, None) is None:
+                return "This group was already decided."
+        try:
+            r.write_group(result, group)
+        except BaseException:
+            with self.lock:
+                self.open[hit_id] = group
+            raise
+        metrics.incr('groups_prompted')
+        metrics.observe('operator_seconds_per_decision',
+                        time.perf_counter() - self.claimed_at.pop(hit_id))
+        return None
+
+    def status(self):
+        return {
+            'decided': sum(self.state.counts().values()),
+            'open': len(self.open),
+            'claims': self.state.claims(),
+            'finished': self.finished and not self.open,
+            'error': self.error,
+        }
+
+
+def page(title, body):
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>%s'
+            '</title><style>%s</style></head><body>%s</body></html>' % (
+                html.escape(title), STYLE, body)).encode('utf-8')
+
+
+def render_index(operator, status):
+    e = html.escape
+    if not operator:
+        return page('Reconcile', """
+            <h1>Reconcile</h1>
+            <form method="post" action="/operator">
+              Your name: <input type="text" name="operator" autofocus>
+              <button>Start</button>
+            </form>""")
+
+    claims = ''.join('<li>%s: %s</li>' % (e(h), e(o))
+                     for h, o in sorted(status['claims'].items()))
+    if status['finished']:
+        action = '<p>All groups are reconciled.</p>'
+    else:
+        action = ('<form method="post" action="/next">'
+                  '<button autofocus>Next group</button></form>')
+    error = ('<p class="message">Preprocessing failed: %s</p>' %
+             e(str(status['error'])) if status['error'] else '')
+    return page('Reconcile', """
+        <h1>Reconcile</h1>
+        <p>Signed in as <b>%s</b>
+          (<a href="/operator">change</a>)</p>
+        %s
+        <p>%d assignments decided; %d disputed groups waiting.</p>
+        %s
+        <h2>Being worked on</h2><ul>%s</ul>""" % (
+            e(operator), error, status['decided'], status['open'], action,
+            claims or '<li>nothing</li>'))
+
+
+def render_group(reconciler, group, message, lease):
+    e = html.escape
+    hit_id = group[0]['HITId']
+    contested = set(reconciler.contested(group))
+
+    inputs = ''.join(
+        '<tr><th>%s</th><td>%s</td></tr>' % (
+            e(f), ('<a href="%s" target="_blank">%s</a>' % (e(v), e(v))
+                   if f == 'Input.url' else e(v)))
+        for f, v in sorted(reconciler.inputs(group[0]).items()))
+
+    header = ''.join('<th>%d<br><small>%s</small></th>' % (
+        i, e(row.get('WorkerId', ''))) for i, row in enumerate(group, 1))
+
+    rows = []
+    for field in reconciler.answers(group[0]):
+        shades = {}
+        cells = []
+        for i, row in enumerate(group):
+            value = row.get(field)
+            text = edit_text(value)
+            name = 'edit-%d-%s' % (i, field)
+            if isinstance(value, (list, tuple)) or '\n' in text:
+                widget = '<textarea name="%s" rows="%d">%s</textarea>' % (
+                    e(name), max(2, text.count('\n') + 1), e(text))
+            else:
+                widget = '<input type="text" name="%s" value="%s">' % (
+                    e(name), e(text))
+            style = ''
+            if field in contested:
+                shade = shades.setdefault(repr(canonical(value)), len(shades))
+                style = ' style="background: %s"' % (
+                    SHADES[shade % len(SHADES)])
+            cells.append('<td%s>%s</td>' % (style, widget))
+        rows.append('<tr%s><th>%s</th>%s</tr>' % (
+            ' class="contested"' if field in contested else '',
+            e(field.replace('Answer.', '')), ''.join(cells)))
+
+    choose = ''.join(
+        '<td><button name="choose" value="%d">Use %d</button></td>' % (i, i)
+        for i in range(1, len(group) + 1))
+    reject = ''.join(
+        '<td><input type="text" name="reject-%d" value="%s" '
+        'placeholder="reason, to reject"></td>' % (i, e(row.get('Reject', '')))
+        for i, row in enumerate(group))
+
+    renew = quote('/renew/%s' % hit_id)
+    return page('Discrepancy for %s' % hit_id, """
+        <p><a href="/">Reconcile</a></p>
+        <h1>Discrepancy for %s</h1>
+        %s
+        <table>%s</table>
+        <form method="post">
+        <h2>Answers</h2>
+        <table>
+          <tr><th></th>%s</tr>
+          %s
+          <tr><th>Reject</th>%s</tr>
+          <tr><th></th>%s</tr>
+        </table>
+        <p><button name="action" value="save">Save edits</button>
+           <button name="action" value="skip">Skip</button></p>
+        <p><small>Choosing an answer saves your edits too. Fields that
+          reached the quorum keep the winning value whichever is
+          chosen.</small></p>
+        </form>
+        <script>
+          setInterval(function () {
+            fetch("%s", {method: "POST"});
+          }, %d);
+        </script>""" % (
+            e(hit_id),
+            '<p class="message">%s</p>' % e(message) if message else '',
+            inputs, header, '\n'.join(rows), reject, choose, renew,
+            lease * 1000 // 3))
+
+
+def parse_decision(group, form):
+    """
+    ({row index: {field: answer}}, {row index: reason}, chosen index or
+    None, action) from the group page's form.
+    """
+    def get(name):
+        return form.get(name, [''])[0]
+
+    edits = {}
+    rejects = {}
+    for index, row in enumerate(group):
+        for field, value in row.items():
+            if not field.startswith('Answer.'):
+                continue
+            name = 'edit-%d-%s' % (index, field)
+            if name not in form:
+                continue
+            text = get(name).replace('\r\n', '\n')
+            if text != edit_text(value):
+                edits.setdefault(index, {})[field] = parse_edit(text, value)
+        reason = get('reject-%d' % index).strip()
+        if reason:
+            rejects[index] = reason
+
+    chosen = get('choose')
+    chosen = int(chosen) - 1 if chosen.isdigit() else None
+    if chosen is not None and not 0 <= chosen < len(group):
+        chosen = None
+    return edits, rejects, chosen, get('action')
+
+
+def make_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class ReconcileHandler(BaseHTTPRequestHandler):
+        # set on the server: session
+
+        def operator(self):
+            cookie = SimpleCookie(self.headers.get('Cookie', ''))
+            if 'operator' in cookie:
+                return unquote(cookie['operator'].value) or None
+            return None
+
+        def form(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return parse_qs(self.rfile.read(length).decode('utf-8'),
+                            keep_blank_values=True)
+
+        def send(self, body, status=200):
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def redirect(self, location, cookie=None):
+            self.send_response(303)
+            self.send_header('Location', location)
+            if cookie is not None:
+                self.send_header('Set-Cookie', 'operator=%s; Path=/' % quote(
+                    cookie))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def hit_id(self):
+            parts = self.path.split('?')[0].split('/')
+            return unquote(parts[2]) if len(parts) > 2 else None
+
+        def do_GET(self):
+            session = self.server.session
+            operator = self.operator()
+            path = self.path.split('?')[0]
+            if path == '/':
+                self.send(render_index(operator, session.status()))
+            elif path == '/operator':
+                self.send(render_index(None, None))
+            elif path.startswith('/group/') and operator:
+                hit_id = self.hit_id()
+                group = session.open.get(hit_id)
+                if group is None or not session.claim(hit_id, operator):
+                    self.send(page('Not available', '<p>That group was '
+                                   'decided or claimed by someone else. '
+                                   '<a href="/">Back</a></p>'), 409)
+                    return
+                self.send(render_group(session.reconciler, group, None,
+                                       session.lease))
+            elif path.startswith('/group/'):
+                self.redirect('/')
+            else:
+                self.send(page('Not found', '<p>Not found</p>'), 404)
+
+        def do_POST(self):
+            session = self.server.session
+            operator = self.operator()
+            path = self.path.split('?')[0]
+            form = self.form()
+
+            if path == '/operator':
+                name = form.get('operator', [''])[0].strip()
+                self.redirect('/', cookie=name)
+            elif not operator:
+                self.redirect('/')
+            elif path == '/next':
+                self.next_group(operator)
+            elif path.startswith('/renew/'):
+                ok = session.claim(self.hit_id(), operator)
+                self.send(b'', 200 if ok else 409)
+            elif path.startswith('/group/'):
+                self.decide(self.hit_id(), operator, form)
+            else:
+                self.send(page('Not found', '<p>Not found</p>'), 404)
+
+        def next_group(self, operator):
+            hit_id = self.server.session.claim_next(operator)
+            if hit_id is None:
+                self.redirect('/')
+            else:
+                self.redirect('/group/%s' % quote(hit_id))
+
+        def decide(self, hit_id, operator, form):
+            session = self.server.session
+            group = session.open.get(hit_id)
+            if group is None:
+                self.redirect('/')
+                return
+            edits, rejects, chosen, action = parse_decision(group, form)
+            if action == 'skip':
+                session.release(hit_id, operator)
+                self.next_group(operator)
+                return
+
+            message = session.decide(hit_id, operator, edits, rejects,
+                                     chosen)
+            if message is None:
+                self.next_group(operator)
+            elif hit_id in session.open:
+                self.send(render_group(session.reconciler, group, message,
+                                       session.lease))
+            else:
+                self.redirect('/')
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReconcileHandler
+
+
+def make_server(session, host='127.0.0.1', port=0):
+    """
+    Create (but don't start) a server for `session`; port 0 picks a free
+    port.
+    """
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), make_handler())
+    server.daemon_threads = True
+    server.session = session
+    server.url = 'http://%s:%d/' % (host, server.server_port)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve reconciliation of MTurk results to several '
+                    'operators at once',
+        epilog="Other arguments go to the reconciler; see "
+               "reconcile_list_results.py --help.")
+    parser.add_argument("kind", choices=sorted(KINDS),
+        help="Which results are being reconciled")
+    parser.add_argument("--host", default='127.0.0.1',
+        help="Address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8000,
+        help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--lease", type=float, default=LEASE,
+        help="Seconds a claimed group stays claimed without activity "
+             "(default: %(default)s)")
+    args, rest = parser.parse_known_args(argv)
+
+    module, name = KINDS[args.kind]
+    reconciler = getattr(importlib.import_module(module), name)(rest)
+    if not reconciler.state:
+        parser.error("--state is required, to share decisions between "
+                     "operators")
+
+    session = ReconcileSession(reconciler, args.lease)
+    server = make_server(session, args.host, args.port)
+    session.start()
+    print("Reconciling at %s (Ctrl-C to stop)" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
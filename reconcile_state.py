@@ -0,0 +1,286 @@
+"""
+Transactional store of reconciliation progress.
+
+Decisions for each assignment (approve, or reject with a reason), whether
+it was edited, and the reconciled result for each HIT are recorded in a
+SQLite database, one transaction per group. Resuming checks assignments
+against the primary key instead of re-reading the review CSV, and the
+MTurk upload (review) CSV and the reconciled output CSV can be regenerated
+from the store at any time:
+
+    python reconcile_state.py state.sqlite --results out.csv --review review.csv
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS assignments (
+        assignment_id TEXT PRIMARY KEY,
+        hit_id TEXT NOT NULL,
+        bioguide TEXT,
+        worker_id TEXT,
+        decision TEXT NOT NULL,
+        reason TEXT,
+        edited INTEGER NOT NULL DEFAULT 0,
+        row TEXT NOT NULL,
+        decided REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS assignments_hit ON assignments (hit_id);
+    CREATE INDEX IF NOT EXISTS assignments_bioguide ON assignments (bioguide);
+    CREATE TABLE IF NOT EXISTS results (
+        hit_id TEXT PRIMARY KEY,
+        bioguide TEXT,
+        chosen TEXT,
+        edited INTEGER NOT NULL DEFAULT 0,
+        row TEXT NOT NULL,
+        decided REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS results_bioguide ON results (bioguide);
+    CREATE TABLE IF NOT EXISTS claims (
+        hit_id TEXT PRIMARY KEY,
+        operator TEXT NOT NULL,
+        expires REAL NOT NULL
+    );
+"""
+
+
+class ReconcileState(object):
+    """
+    A SQLite store of reconciliation decisions, safe across crashes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.executescript(SCHEMA)
+
+    def _transaction(self, statements):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, params in statements:
+                    self.db.execute(sql, params)
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    @property
+    def fieldnames(self):
+        rows = self._query("SELECT value FROM meta WHERE key = 'fieldnames'")
+        return json.loads(rows[0][0]) if rows else None
+
+    @fieldnames.setter
+    def fieldnames(self, fieldnames):
+        self._transaction([(
+            "INSERT OR REPLACE INTO meta VALUES ('fieldnames', ?)",
+            (json.dumps(list(fieldnames)),))])
+
+    def is_empty(self):
+        return not self._query('SELECT 1 FROM assignments LIMIT 1')
+
+    def is_reviewed(self, assignment_id):
+        return bool(self._query(
+            'SELECT 1 FROM assignments WHERE assignment_id = ?',
+            (assignment_id,)))
+
+    def is_decided(self, hit_id):
+        return bool(self._query('SELECT 1 FROM results WHERE hit_id = ?',
+                                (hit_id,)))
+
+    def decision(self, assignment_id):
+        rows = self._query(
+            'SELECT decision, reason, edited FROM assignments '
+            'WHERE assignment_id = ?', (assignment_id,))
+        return rows[0] if rows else None
+
+    def decisions(self):
+        """
+        (assignment id, 'approve' or 'reject', reason) for every assignment.
+        """
+        return self._query('SELECT assignment_id, decision, reason '
+                           'FROM assignments ORDER BY hit_id, assignment_id')
+
+    def assignments_for(self, bioguide):
+        return [json.loads(r[0]) for r in self._query(
+            'SELECT row FROM assignments WHERE bioguide = ? '
+            'ORDER BY hit_id, assignment_id', (bioguide,))]
+
+    def decided_groups(self):
+        """
+        (HIT id, chosen assignment id, assignment rows) for each decided
+        HIT. The chosen id is None for HITs imported from CSVs.
+        """
+        rows = self._query(
+            'SELECT r.hit_id, r.chosen, a.row FROM results r '
+            'JOIN assignments a ON a.hit_id = r.hit_id '
+            'ORDER BY r.hit_id, a.assignment_id')
+        for (hit_id, chosen), group in groupby(rows, key=itemgetter(0, 1)):
+            yield hit_id, chosen, [json.loads(row) for _, _, row in group]
+
+    def record_group(self, result, group, chosen=None, edited=()):
+        """
+        Record a reconciled result and the decision on each assignment.
+
+        `edited` holds the AssignmentIds of rows the operator edited.
+        """
+        now = time.time()
+        statements = []
+        for row in group:
+            assignment_id = row['AssignmentId']
+            decision = 'reject' if row.get('Reject') else 'approve'
+            statements.append((
+                'INSERT OR REPLACE INTO assignments '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (assignment_id, row['HITId'], row.get('Input.id'),
+                 row.get('WorkerId'), decision, row.get('Reject') or None,
+                 assignment_id in edited, json.dumps(dict(row)), now)))
+        if result is not None:
+            statements.append((
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (result['HITId'], result.get('Input.id'), chosen,
+                 chosen in edited, json.dumps(dict(result)), now)))
+            statements.append(('DELETE FROM claims WHERE hit_id = ?',
+                               (result['HITId'],)))
+        self._transaction(statements)
+
+    def claim(self, hit_id, operator, lease):
+        """
+        Claim a HIT for `operator` for `lease` seconds, unless it has been
+        decided or someone else holds an unexpired claim on it. Claiming a
+        HIT again renews the lease. Returns whether `operator` now holds
+        the claim.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                if self.db.execute('SELECT 1 FROM results WHERE hit_id = ?',
+                                   (hit_id,)).fetchone():
+                    self.db.execute('COMMIT')
+                    return False
+                self.db.execute(
+                    'INSERT INTO claims VALUES (?, ?, ?) '
+                    'ON CONFLICT (hit_id) DO UPDATE SET '
+                    'operator = excluded.operator, expires = excluded.expires '
+                    'WHERE claims.operator = excluded.operator '
+                    'OR claims.expires <= ?',
+                    (hit_id, operator, now + lease, now))
+                holder = self.db.execute(
+                    'SELECT operator FROM claims WHERE hit_id = ?',
+                    (hit_id,)).fetchone()[0]
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return holder == operator
+
+    def release(self, hit_id, operator):
+        self._transaction([(
+            'DELETE FROM claims WHERE hit_id = ? AND operator = ?',
+            (hit_id, operator))])
+
+    def claims(self):
+        """
+        {hit id: operator} for unexpired claims.
+        """
+        return dict(self._query(
+            'SELECT hit_id, operator FROM claims WHERE expires > ?',
+            (time.time(),)))
+
+    def import_csv(self, results_file, review_file):
+        """
+        Seed the store from CSV output of an earlier run without a store.
+        """
+        now = time.time()
+        statements = []
+        for row in csv.DictReader(review_file):
+            statements.append((
+                'INSERT OR IGNORE INTO assignments '
+                'VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+                (row['AssignmentId'], row['HITId'], row.get('Input.id'),
+                 row.get('WorkerId'),
+                 'reject' if row.get('Reject') else 'approve',
+                 row.get('Reject') or None, json.dumps(row), now)))
+        for row in csv.DictReader(results_file):
+            statements.append((
+                'INSERT OR IGNORE INTO results '
+                'VALUES (?, ?, NULL, 0, ?, ?)',
+                (row['HITId'], row.get('Input.id'), json.dumps(row), now)))
+        self._transaction(statements)
+        return len(statements)
+
+    def _export(self, sql, outfile, fieldnames):
+        fieldnames = fieldnames or self.fieldnames
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames,
+                                extrasaction='ignore')
+        writer.writeheader()
+        with self.lock:
+            rows = self.db.execute(sql)
+            for (row,) in rows:
+                writer.writerow(json.loads(row))
+
+    def export_review(self, outfile, fieldnames=None):
+        """
+        Write the Approve/Reject CSV to upload to Mechanical Turk.
+        """
+        self._export('SELECT row FROM assignments '
+                     'ORDER BY hit_id, assignment_id', outfile, fieldnames)
+
+    def export_results(self, outfile, fieldnames=None):
+        """
+        Write the reconciled results CSV, one row per HIT.
+        """
+        self._export('SELECT row FROM results ORDER BY hit_id',
+                     outfile, fieldnames)
+
+    def counts(self):
+        return dict(self._query(
+            'SELECT decision, COUNT(*) FROM assignments GROUP BY decision'))
+
+    def close(self):
+        self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Export reconciled results and reviews from a reconcile state store')
+    parser.add_argument("state",
+        help="SQLite state store written by a reconcile script")
+    parser.add_argument("--results",
+        help="destination for CSV file of reconciled results",
+        type=argparse.FileType('w'))
+    parser.add_argument("--review",
+        help="destination for reviewed CSV file to upload to Mechanical Turk",
+        type=argparse.FileType('w'))
+    args = parser.parse_args(argv)
+
+    state = ReconcileState(args.state)
+    if args.results:
+        state.export_results(args.results)
+    if args.review:
+        state.export_review(args.review)
+    print(state.counts())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,123 @@
 import argparse
 import csv
+import hashlib
+import json
 import os
+import queue
 import tempfile
-import yaml
-from difflib import unified_diff
+import threading
+import time
+from collections import Counter
 from itertools import groupby
 from operator import itemgetter
-from subprocess import call, check_call
 
-from termcolor import colored
+import metrics
+from grouping import CHUNK_SIZE, batched_groups, external_sort, sorted_groups
+from preprocess import ColumnPreprocessor
+from reconcile_state import ReconcileState
+from rows import RowSchema
+from worker_trust import TrustIndex
 
 EDITOR = os.environ.get('EDITOR', 'vim')
 
+DONE = object()  # marks the end of the prefetched groups
+
+COLORS = ['red', 'blue', 'green', 'magenta', 'cyan', 'yellow']
+
+
+def canonical(value):
+    """
+    Case-insensitive form of an answer, for comparing assignments.
+    """
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if value is None:
+        return ''
+    return str(value).lower()
+
+
+def quorum(text):
+    """
+    A --quorum: a strict majority, so a tie is never settled by itself.
+    """
+    value = float(text)
+    if not 0.5 < value <= 1:
+        raise argparse.ArgumentTypeError(
+            "must be more than 0.5 and at most 1, not %s" % text)
+    return value
+
+
+def answer_fingerprint(answers):
+    """
+    Hash of a row's answers that's equal for rows that match.
+    """
+    normalized = sorted((f, canonical(v)) for f, v in answers.items())
+    return hashlib.sha1(json.dumps(normalized).encode('utf-8')).hexdigest()
+
 
 class TurkResultReconciler(object):
 
-    def __init__(self):
-        args = self.parse_args()
+    PREPROCESS_BATCH = 500  # rows preprocessed together
 
-        self.reader = csv.DictReader(args.source)
-        self.rows = None
+    # processors applied to every answer, then to particular answer fields
+    # (named without the "Answer." prefix); see preprocess.py
+    STANDARD_PROCESSORS = []
+    FIELD_PROCESSORS = {}
+
+    def __init__(self, argv=None):
+        args = self.args = self.parse_args(argv)
 
+        self._fingerprints = {}
+        self._diffs = {}
+        self.counting = False
+        self._write_lock = threading.Lock()
+
+        self.source = args.source
+        self.reader = csv.DictReader(args.source)
+        self.schema = RowSchema(self.output_fields)
+        self.preprocessor = ColumnPreprocessor(
+            {f: self.preprocessors(f) for f in self.reader.fieldnames or ()
+             if f.startswith('Answer.')},
+            answer_fingerprint,
+            workers=args.workers or (None if args.count else 1))
+
+        self.destination = args.destination
         self.writer = csv.DictWriter(args.destination,
                                      fieldnames=self.output_fields)
-        if not args.destination.tell():
-            self.writer.writeheader()
 
+        self.review_file = args.review
         self.review = csv.DictWriter(args.review,
                                      fieldnames=self.output_fields)
 
-        rows = list(self.reader)
-
-        if args.review.tell():
-            args.review.seek(0)
-            reviewed = set([self.row_key(r)
-                            for r in csv.DictReader(args.review)])
-            rows = [r for r in rows if self.row_key(r) not in reviewed]
+        self.state = None
+        self._edited = set()
+        if args.state:
+            self.open_state(args.state)
         else:
-            self.review.writeheader()
+            if not args.destination.tell():
+                self.writer.writeheader()
+            if not args.review.tell():
+                self.review.writeheader()
 
-        self.rows = rows
+        self.trust = None
+        if args.trust_index:
+            self.open_trust(args.trust_index)
 
         if args.count:
-            self.rows = [self.preprocess_row(r) for r in self.rows]
             self.print_count()
-            self._preprocessed = True
-        else:
-            self._preprocessed = False
 
     def row_key(self, row):
         return row['AssignmentId']
 
-    def parse_args(self):
+    @property
+    def pure(self):
+        """
+        Whether preprocessing must have no side effects (e.g. geocoding),
+        as while counting.
+        """
+        return self.counting
+
+    def parse_args(self, argv=None):
         parser = argparse.ArgumentParser(description=
             'Diff and merge results of a Mechanical Turk task')
         parser.add_argument("source",
@@ -66,37 +132,246 @@ class TurkResultReconciler(object):
         parser.add_argument("-c", "--count",
             help="Count groups and number needing reconciliation",
             action="store_true")
-
-        return parser.parse_args()
+        parser.add_argument("--chunk-size",
+            help="Rows held in memory when sorting an unsorted export",
+            type=int, default=CHUNK_SIZE)
+        parser.add_argument("--lookahead",
+            help="Groups needing review to preprocess ahead of the prompt "
+                 "(0 to preprocess in the foreground)",
+            type=int, default=20)
+        parser.add_argument("--quorum",
+            help="Share of assignments, more than half, that must agree on "
+                 "a field for it to be resolved without asking (default: "
+                 "all of them)",
+            type=quorum, default=1.0)
+        parser.add_argument("--workers",
+            help="Processes to preprocess large batches of rows in "
+                 "(default: 1, or one per CPU with --count)",
+            type=int)
+        parser.add_argument("--state",
+            help="SQLite file recording progress; the destination and "
+                 "review CSVs are regenerated from it")
+        parser.add_argument("--trust-index",
+            help="SQLite file counting, across runs, how often each "
+                 "worker's answers agreed with the results")
+        parser.add_argument("--trust-threshold",
+            help="Settle a contested group with the answer of a worker "
+                 "trusted at least this much (0-1), unless another such "
+                 "worker disagrees; needs --trust-index",
+            type=float)
+        self.add_arguments(parser)
+        metrics.add_arguments(parser)
+
+        args = parser.parse_args(argv)
+        if args.trust_threshold is not None and not args.trust_index:
+            parser.error("--trust-threshold needs --trust-index")
+        metrics.start(args)
+        return args
+
+    def add_arguments(self, parser):
+        # subclasses may add their own options
+        pass
 
     @property
     def output_fields(self):
         return self.reader.fieldnames
 
+    def open_state(self, path):
+        self.state = ReconcileState(path)
+        self.state.fieldnames = self.output_fields
+        if self.state.is_empty() and (self.destination.tell() or
+                                      self.review_file.tell()):
+            # carry over progress made before there was a store
+            self.destination.seek(0)
+            self.review_file.seek(0)
+            self.state.import_csv(self.destination, self.review_file)
+
+    def open_trust(self, path):
+        self.trust = TrustIndex(path)
+        if self.trust.is_empty() and self.state:
+            # learn from the decisions already in the store
+            for _, chosen, rows in self.state.decided_groups():
+                rows = [self.schema.from_mapping(r) for r in rows]
+                picked = [r for r in rows if self.row_key(r) == chosen]
+                if picked:
+                    self.trust.record(
+                        self.trust_outcomes(picked[0], rows, chosen))
+
+    def trust_outcomes(self, result, group, chosen=None):
+        """
+        (assignment id, worker id, agreed, chosen, rejected) for each row
+        of a group, where agreeing means having all of `result`'s answers.
+        """
+        answers = {f: canonical(v) for f, v in self.answers(result).items()}
+        for row in group:
+            key = self.row_key(row)
+            agreed = all(canonical(row.get(f)) == v
+                         for f, v in answers.items())
+            yield (key, row.get('WorkerId'), agreed, key == chosen,
+                   bool(row.get('Reject')))
+
+    def trusted_row(self, group):
+        """
+        In a contested group, the row of the most trusted worker if they
+        reach the --trust-threshold and no other worker who does disagrees
+        with them; otherwise None.
+        """
+        threshold = self.args.trust_threshold
+        if threshold is None:
+            return None
+        trusted = [row for row in group
+                   if self.trust.trust(row.get('WorkerId')) >= threshold]
+        if not trusted or not self.equal(*trusted):
+            return None
+        return max(trusted,
+                   key=lambda row: self.trust.trust(row.get('WorkerId')))
+
+    def export_state(self):
+        """
+        Regenerate the destination and review CSVs from the state store.
+        """
+        for f, export in ((self.destination, self.state.export_results),
+                          (self.review_file, self.state.export_review)):
+            f.seek(0)
+            f.truncate()
+            export(f, self.output_fields)
+            f.flush()
+
+    def read_rows(self):
+        self.source.seek(0)
+        values = csv.reader(self.source)
+        next(values, None)  # header
+        return metrics.timed_iter('csv_parse', self.schema.reader(values))
+
+    def reviewed_keys(self, key_column='HITId'):
+        """
+        (key, row key) of each row in the review file, in sorted order.
+        """
+        if not self.review_file.tell():
+            return iter(())
+        self.review_file.seek(0)
+        keys = ((r[key_column], self.row_key(r))
+                for r in csv.DictReader(self.review_file))
+        return external_sort(keys, key=itemgetter(0, 1),
+                             chunk_size=self.args.chunk_size)
+
+    def unreviewed(self, groups, key_column='HITId'):
+        """
+        Drop rows already in the review file from sorted groups of rows.
+        """
+        if self.state:
+            for key, group in groups:
+                rows = [r for r in group
+                        if not self.state.is_reviewed(self.row_key(r))]
+                if rows:
+                    yield key, rows
+            return
+
+        reviewed = self.reviewed_keys(key_column)
+        done = next(reviewed, None)
+        for key, group in groups:
+            seen = set()
+            while done is not None and done[0] <= key:
+                if done[0] == key:
+                    seen.add(done[1])
+                done = next(reviewed, None)
+            rows = [r for r in group if self.row_key(r) not in seen]
+            if rows:
+                yield key, rows
+
     def combine_by_hit(self, key_column='HITId'):
         key = itemgetter(key_column)
-        rows = sorted(self.rows, key=key)
-        return groupby(rows, key=key)
+        if self.source.seekable():
+            groups = sorted_groups(self.read_rows, key, self.args.chunk_size)
+        else:
+            # sort plain lists of values, which spill to disk compactly
+            values = external_sort(
+                self.reader.reader,
+                itemgetter(self.schema.index[key_column]),
+                self.args.chunk_size)
+            groups = groupby(self.schema.reader(values), key=key)
+        return self.unreviewed(groups, key_column)
+
+    def preprocessed_groups(self):
+        """
+        Unreviewed groups, preprocessed a batch of rows at a time.
+        """
+        batch_rows = self.PREPROCESS_BATCH
+        if self.preprocessor.workers > 1:
+            batch_rows = max(batch_rows, self.preprocessor.shard_rows *
+                             self.preprocessor.workers)
+        for batch in batched_groups(self.combine_by_hit(), batch_rows):
+            rows = [r for _, g in batch for r in g]
+            metrics.incr('rows_read', len(rows))
+            with metrics.timed('preprocess_row'):
+                rows = self.preprocess_rows(rows)
+            with metrics.timed('fingerprint'):
+                for row in rows:
+                    self.fingerprint(row)
+            start = 0
+            for key, group in batch:
+                yield key, tuple(rows[start:start + len(group)])
+                start += len(group)
+
+    def preprocessors(self, field):
+        field = field.replace('Answer.', '')
+        return self.STANDARD_PROCESSORS + self.FIELD_PROCESSORS.get(field, [])
+
+    def clean_rows(self, rows, fingerprint=False):
+        """
+        Run each answer field's processors over the rows, a column at a time.
+
+        With `fingerprint`, the rows' fingerprints are computed along the
+        way; only do that if nothing else will change their answers.
+        """
+        found = self.preprocessor.apply(rows, fingerprint)
+        for row, fp in zip(rows, found or ()):
+            self._fingerprints[self.row_key(row)] = fp
+        return rows
+
+    def preprocess_rows(self, rows):
+        # subclasses may add steps, e.g. ones that need a whole row
+        return self.clean_rows(rows, fingerprint=True)
 
     def preprocess_row(self, row):
-        # subclasses may change this
-        return row
+        return self.preprocess_rows([row])[0]
 
     def postprocess_row(self, row):
         # subclasses may change this
         return row
 
     def answers(self, row):
-        return {f: row[f] for f in row.keys() if f.startswith('Answer.')}
+        return row.answers
 
     def inputs(self, row):
-        return {f: row[f] for f in row.keys() if f.startswith('Input.')}
+        return row.inputs
+
+    def fingerprint(self, row):
+        """
+        Canonical hash of a row's answers, computed once per row.
+        """
+        key = self.row_key(row)
+        fp = self._fingerprints.get(key)
+        if fp is None:
+            fp = self._fingerprints[key] = answer_fingerprint(self.answers(row))
+        return fp
+
+    def forget(self, *rows):
+        """
+        Drop cached fingerprints (after rows change, or are done with).
+        """
+        for row in rows:
+            self._fingerprints.pop(self.row_key(row), None)
 
     def format_for_diff(self, row):
-        return yaml.dump(self.answers(row), default_flow_style=False)
+        import yaml
+        return yaml.dump(dict(self.answers(row)), default_flow_style=False)
 
     def tempfile_edit(self, row):
         # from http://stackoverflow.com/a/6309753/174653
+        import yaml
+        from subprocess import check_call
+
         initial_message = self.format_for_diff(row).encode('utf-8')
         with tempfile.NamedTemporaryFile(suffix=".tmp") as tf:
             tf.write(initial_message)
@@ -104,57 +379,172 @@ class TurkResultReconciler(object):
             check_call([EDITOR, tf.name])
 
             with open(tf.name) as f:
-                row.update(yaml.load(f))
+                self.apply_edit(row, yaml.safe_load(f))
 
-    def print_diff(self, row1, row2):
-        print("Discrepancy for {HITId}".format(**row1))
-        print(yaml.dump(self.inputs(row1), default_flow_style=False))
+    def apply_edit(self, row, answers):
+        """
+        Replace some of a row's answers with the operator's edits.
+        """
+        row.update(answers)
+        self.forget(row)
+        self._edited.add(self.row_key(row))
 
-        formatted = [self.format_for_diff(r).split('\n') for r in [row1, row2]]
-        diff = unified_diff(*formatted, n=20)
+    def vote(self, group):
+        """
+        Field-by-field vote over a group's answers.
 
-        for s in diff:
-            if s.strip() in ('---', '+++'):
-                continue
+        Returns {field: (value, share)} with the most common value of each
+        field (ignoring case) and the share of assignments giving it.
+        Every row's answers are voted on, so a field left out of one row
+        counts as a blank answer from it.
+        """
+        votes = {}
+        fields = dict.fromkeys(f for row in group for f in self.answers(row))
+        for field in fields:
+            counts = Counter()
+            values = {}
+            for row in group:
+                value = row.get(field)
+                c = json.dumps(canonical(value))
+                counts[c] += 1
+                values.setdefault(c, value)
+            c, n = counts.most_common(1)[0]
+            votes[field] = (values[c], n / len(group))
+        return votes
+
+    def contested(self, group):
+        """
+        Fields on which the group falls short of the --quorum.
+        """
+        if self.equal(*group):
+            return []
+        return sorted(field for field, (_, share) in self.vote(group).items()
+                      if share < self.args.quorum)
 
-            if s.startswith('-'):
-                print(colored("{:<40}".format(s[1:]), 'red'))
-            elif s.startswith('+'):
-                print(colored("{:<40}".format(s[1:]), 'blue'))
-            elif s.startswith(' '):
-                print(s[1:])
+    def resolve(self, group, chosen=None):
+        """
+        Result for a group: the chosen row (by default the one agreeing
+        with the vote on the most fields), with any field that reached the
+        quorum set to the winning value.
+        """
+        votes = self.vote(group)
+
+        def agreement(row):
+            return sum(canonical(row.get(f)) == canonical(v)
+                       for f, (v, _) in votes.items())
+
+        if chosen is None:
+            chosen = max(group, key=agreement)
+
+        result = chosen.copy()
+        for field, (value, share) in votes.items():
+            if share >= self.args.quorum and (
+                    canonical(result.get(field)) != canonical(value)):
+                result[field] = value
+        return result
+
+    def format_value(self, value):
+        import yaml
+        if isinstance(value, (list, tuple)):
+            return yaml.dump(list(value), default_flow_style=True).strip()
+        return value
+
+    def format_diff(self, group, contested):
+        import yaml
+        from difflib import unified_diff
+        from termcolor import colored
+
+        lines = ["Discrepancy for {HITId}".format(**group[0]),
+                 yaml.dump(dict(self.inputs(group[0])),
+                           default_flow_style=False)]
+
+        if len(group) == 2:
+            formatted = [
+                yaml.dump({f: row[f] for f in contested},
+                          default_flow_style=False).split('\n')
+                for row in group]
+            diff = unified_diff(*formatted, n=20)
+
+            for s in diff:
+                if s.strip() in ('---', '+++'):
+                    continue
+
+                if s.startswith('-'):
+                    lines.append(colored("{:<40}".format(s[1:]), 'red'))
+                elif s.startswith('+'):
+                    lines.append(colored("{:<40}".format(s[1:]), 'blue'))
+                elif s.startswith(' '):
+                    lines.append(s[1:])
+
+            return '\n'.join(lines)
+
+        agreed = len(self.answers(group[0])) - len(contested)
+        lines.append("%d assignments agree on %d fields; contested:" %
+                     (len(group), agreed))
+        for field in contested:
+            lines.append("%s:" % field)
+            shades = {}
+            for i, row in enumerate(group, 1):
+                c = json.dumps(canonical(row.get(field)))
+                color = COLORS[shades.setdefault(c, len(shades)) % len(COLORS)]
+                lines.append(colored("  %d: %s" % (
+                    i, self.format_value(row.get(field))), color))
+
+        return '\n'.join(lines)
+
+    def print_diff(self, group, contested):
+        # only rebuilt when an edit actually changed one of the answers
+        key = (group[0]['HITId'],) + tuple(self.fingerprint(r) for r in group)
+        if key not in self._diffs:
+            with metrics.timed('print_diff'):
+                self._diffs[key] = self.format_diff(group, contested)
+        print(self._diffs[key])
 
     def equal(self, *rows):
-        formatted = [self.format_for_diff(row).lower() for row in rows]
-        return len(set(formatted)) == 1
+        with metrics.timed('equal'):
+            return len(set(self.fingerprint(row) for row in rows)) == 1
 
-    def prompt_reconcile(self, row1, row2):
+    def pick(self, group, answer):
+        """
+        The row numbered in an answer like "2", "e2" or "R2", or None.
+        """
+        number = answer.lstrip('eR')
+        if number.isdigit() and 1 <= int(number) <= len(group):
+            return group[int(number) - 1]
+        return None
+
+    def prompt_reconcile(self, group):
+        numbers = '/'.join(str(i) for i in range(1, len(group) + 1))
         while True:
-            self.print_diff(row1, row2)
-            answer = input("Fix (1/2/e1/e2/R1/R2/o/?): ")
-            if answer.isdigit():
-                return {'1': row1, '2': row2}[answer]
+            contested = self.contested(group)
+            if not contested:
+                return self.resolve(group)
+
+            self.print_diff(group, contested)
+            answer = input("Fix (%s/e#/R#/o/?): " % numbers)
+            row = self.pick(group, answer)
+            if answer.isdigit() and row:
+                return self.resolve(group, chosen=row)
             elif answer == 'o':
-                call(["open", row1['Input.url']])
-            elif answer.startswith('e'):
-                edit = {'1': row1, '2': row2}[answer[1]]
-                self.tempfile_edit(edit)
-                print(edit)
-            elif answer.startswith('R'):
+                from subprocess import call
+                call(["open", group[0]['Input.url']])
+            elif answer.startswith('e') and row:
+                self.tempfile_edit(row)
+                print(row)
+            elif answer.startswith('R') and row:
                 reason = input("Reason this entry is rejected: ")
-                rejected = {'1': row1, '2': row2}[answer[1]]
-                rejected['Approve'] = ''
-                rejected['Reject'] = reason
+                row['Approve'] = ''
+                row['Reject'] = reason
             elif answer == '?':
                 print("""
-                    1  -- choose left option
-                    2  -- choose right '+' option
-                    e1 -- edit left option
-                    e2 -- edit right option
-                    R1 -- REJECT left option
-                    R2 -- REJECT right option
+                    1  -- choose first option (2 for second, etc.)
+                    e1 -- edit first option
+                    R1 -- REJECT first option
                     o  -- open URL in browser
                     ?  -- this help text
+
+                    Fields that reached the quorum keep the winning value
+                    whichever option is chosen.
                 """)
             else:
                 print("Oops! Unsupported option {}".format(answer))
@@ -164,38 +554,129 @@ class TurkResultReconciler(object):
         For a group of HIT results, let the user reconcile any differences.
         """
         group = tuple(group)
-        assert len(group) == 2, "Only works on pairs %r" % group
+        assert len(group) >= 2, "Need at least two results %r" % (group,)
 
-        if not self._preprocessed:
-            group = [self.preprocess_row(row) for row in group]
+        for row in group:
+            row['Approve'] = 'x'
 
-        row1, row2 = group
-        row1['Approve'] = 'x'
-        row2['Approve'] = 'x'
-        result = None
+        contested = self.contested(group)
+        trusted = self.trusted_row(group) if contested else None
 
-        if self.equal(row1, row2):
-            result = row1
+        if not contested:
+            result = self.resolve(group)
+            metrics.incr('groups_auto_accepted')
+        elif trusted is not None:
+            result = self.resolve(group, chosen=trusted)
+            metrics.incr('groups_trust_resolved')
         else:
-            result = self.prompt_reconcile(row1, row2)
-
+            start = time.perf_counter()
+            result = self.prompt_reconcile(group)
+            metrics.observe('operator_seconds_per_decision',
+                            time.perf_counter() - start)
+            metrics.incr('groups_prompted')
+            self._diffs.clear()
+
+        # a group settled by trust says nothing new about the workers
+        self.write_group(result, group, learn=trusted is None)
+
+    def write_group(self, result, group, learn=True):
+        chosen = self.row_key(result)
+        if self.trust and learn:
+            self.trust.record(self.trust_outcomes(result, group, chosen))
         result = self.postprocess_row(result)
-        self.writer.writerow(result)
+        with self._write_lock, metrics.timed('write'):
+            if self.state:
+                self.state.record_group(result, group, chosen=chosen,
+                                        edited=self._edited)
+            else:
+                self.writer.writerow(result)
+                for row in group:
+                    self.review.writerow(row)
 
-        self.review.writerow(row1)
-        self.review.writerow(row2)
+        self.forget(*group)
+        self._edited.difference_update(self.row_key(r) for r in group)
+
+    def prefetch(self, pending, stop):
+        """
+        Preprocess groups in the background, writing out the ones that
+        already agree and queueing the rest for the prompt.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        try:
+            for _, group in self.preprocessed_groups():
+                if stop.is_set():
+                    return
+                if (not self.contested(group) or
+                        self.trusted_row(group) is not None):
+                    self.reconcile_group(group)
+                else:
+                    put(group)
+        except BaseException as e:
+            put(e)
+        finally:
+            put(DONE)
 
     def reconcile_results(self):
-        for _, group in self.combine_by_hit():
-            self.reconcile_group(group)
+        try:
+            self.run_reconciliation()
+        finally:
+            self.preprocessor.close()
+            if self.state:
+                self.export_state()
+
+    def run_reconciliation(self):
+        if not self.args.lookahead:
+            for _, group in self.preprocessed_groups():
+                self.reconcile_group(group)
+            return
+
+        pending = queue.Queue(maxsize=self.args.lookahead)
+        stop = threading.Event()
+        worker = threading.Thread(target=self.prefetch, args=(pending, stop),
+                                  daemon=True)
+        worker.start()
+        try:
+            while True:
+                group = pending.get()
+                if group is DONE:
+                    break
+                if isinstance(group, BaseException):
+                    raise group
+                self.reconcile_group(group)
+        finally:
+            stop.set()
+            if worker.is_alive():
+                print("Waiting for background preprocessing to stop...")
+            worker.join()
 
     def print_count(self):
-        equal = 0
-        for count, (_, group) in enumerate(self.combine_by_hit(), 1):
-            if self.equal(*tuple(group)):
-                equal += 1
-        print("%d same / %d total (%d need reconciliation)" %
-              (equal, count, count - equal))
+        equal = settled = trusted = count = 0
+        self.counting = True
+        try:
+            for count, (_, group) in enumerate(self.preprocessed_groups(),
+                                               1):
+                if self.equal(*group):
+                    equal += 1
+                elif not self.contested(group):
+                    settled += 1
+                elif self.trusted_row(group) is not None:
+                    trusted += 1
+                self.forget(*group)
+        finally:
+            self.counting = False
+        self.preprocessor.close()
+        print("%d same, %d settled by quorum / %d total "
+              "(%d need reconciliation)" %
+              (equal, settled, count, count - equal - settled))
+        if self.args.trust_threshold is not None:
+            print("%d of those can be settled by trusted workers" % trusted)
 
 
 if __name__ == '__main__':
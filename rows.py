@@ -0,0 +1,202 @@
+"""
+Compact records for rows of MTurk results.
+
+A results export has dozens of columns and a row per assignment; as
+`csv.DictReader` dicts every row carries its own hash table of them. Here
+rows share one RowSchema (the column names and their positions) and hold
+just a list of values. HIT-level columns, the same for every assignment of
+a HIT, share the previous row's value objects, so a HIT's title, reward,
+inputs and so on are kept once rather than once per assignment.
+
+Rows pickle as just their values and the number of their schema, which
+is looked up again when they're loaded, so rows spilled to disk by an
+external sort stay small and come back sharing the one schema. They can
+only be unpickled in the process that made the schema.
+
+Rows behave as mutable mappings, so they can be written with
+`csv.DictWriter`; `answers` and `inputs` are views of the Answer.* and
+Input.* fields that read through to the row rather than copying it.
+"""
+import itertools
+import weakref
+from collections.abc import Mapping, MutableMapping
+
+class _Missing(object):
+    def __reduce__(self):
+        return 'MISSING'  # the same object when unpickled
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()  # a column the row has no value for
+
+_schemas = weakref.WeakValueDictionary()  # number: schema, for unpickling
+_numbers = itertools.count()
+
+# columns that can differ between the assignments of one HIT
+ASSIGNMENT_COLUMNS = {
+    'AssignmentId', 'WorkerId', 'AssignmentStatus', 'AcceptTime',
+    'SubmitTime', 'AutoApprovalTime', 'ApprovalTime', 'RejectionTime',
+    'RequesterFeedback', 'WorkTimeInSeconds', 'LifetimeApprovalRate',
+    'Last30DaysApprovalRate', 'Last7DaysApprovalRate', 'Approve', 'Reject',
+}
+
+
+class RowSchema(object):
+    """
+    Column names and positions shared by a set of rows.
+
+    Columns set on a row that aren't in the schema yet (e.g. coordinates
+    added by geocoding) are appended to it.
+    """
+
+    def __init__(self, fieldnames):
+        self.fields = []
+        self.index = {}
+        self.answer_fields = {}  # field: position
+        self.input_fields = {}
+        self.shared = []  # positions of HIT-level columns
+        for field in fieldnames:
+            self.add(field)
+        self._previous = None
+        self.number = next(_numbers)
+        _schemas[self.number] = self
+
+    def add(self, field):
+        if field in self.index:
+            return self.index[field]
+        position = self.index[field] = len(self.fields)
+        self.fields.append(field)
+        if field.startswith('Answer.'):
+            self.answer_fields[field] = position
+        else:
+            if field.startswith('Input.'):
+                self.input_fields[field] = position
+            if field not in ASSIGNMENT_COLUMNS:
+                self.shared.append(position)
+        return position
+
+    def row(self, values):
+        """
+        A Row of `values` in column order, as read by `csv.reader`.
+        """
+        values = list(values)
+        missing = len(self.fields) - len(values)
+        if missing > 0:
+            values.extend([MISSING] * missing)
+
+        previous = self._previous
+        if previous is not None:
+            for i in self.shared:
+                if i < len(previous) and values[i] == previous[i]:
+                    values[i] = previous[i]
+        self._previous = values
+        return Row(self, values)
+
+    def from_mapping(self, mapping):
+        """
+        A Row with the items of a dict.
+        """
+        row = Row(self, [MISSING] * len(self.fields))
+        row.update(mapping)
+        return row
+
+    def reader(self, rows):
+        """
+        Rows for the lists of values in `rows`.
+        """
+        return map(self.row, rows)
+
+
+class Row(MutableMapping):
+    """
+    One result row: a list of values laid out by a RowSchema.
+    """
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def __getitem__(self, field):
+        i = self.schema.index[field]
+        if i >= len(self.values) or self.values[i] is MISSING:
+            raise KeyError(field)
+        return self.values[i]
+
+    def get(self, field, default=None):
+        i = self.schema.index.get(field)
+        if i is None or i >= len(self.values) or self.values[i] is MISSING:
+            return default
+        return self.values[i]
+
+    def __contains__(self, field):
+        return self.get(field, MISSING) is not MISSING
+
+    def __setitem__(self, field, value):
+        i = self.schema.add(field)
+        if i >= len(self.values):
+            self.values.extend([MISSING] * (i + 1 - len(self.values)))
+        self.values[i] = value
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+        self.values[self.schema.index[field]] = MISSING
+
+    def __iter__(self):
+        for field, value in zip(self.schema.fields, self.values):
+            if value is not MISSING:
+                yield field
+
+    def __len__(self):
+        return sum(value is not MISSING for value in self.values)
+
+    def __repr__(self):
+        return 'Row(%r)' % dict(self)
+
+    def __reduce__(self):
+        return _unpickle_row, (self.schema.number, self.values)
+
+    def copy(self):
+        return Row(self.schema, list(self.values))
+
+    @property
+    def answers(self):
+        return FieldsView(self, self.schema.answer_fields)
+
+    @property
+    def inputs(self):
+        return FieldsView(self, self.schema.input_fields)
+
+
+def _unpickle_row(number, values):
+    return Row(_schemas[number], values)
+
+
+class FieldsView(Mapping):
+    """
+    Some of a row's fields ({field: position}), reading through to the row.
+    """
+    __slots__ = ('row', 'fields')
+
+    def __init__(self, row, fields):
+        self.row = row
+        self.fields = fields
+
+    def __getitem__(self, field):
+        values = self.row.values
+        i = self.fields[field]
+        if i >= len(values) or values[i] is MISSING:
+            raise KeyError(field)
+        return values[i]
+
+    def __iter__(self):
+        values = self.row.values
+        for field, i in self.fields.items():
+            if i < len(values) and values[i] is not MISSING:
+                yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
@@ -0,0 +1,46 @@
+from setuptools import setup
+
+setup(
+    name='congress-turk',
+    version='0.1.0',
+    description='Gather Congress district office data through Mechanical Turk',
+    url='https://github.com/TheWalkers/congress-turk',
+    license='GPL-3.0',
+    python_requires='>=3.7',
+    py_modules=[
+        'congress_turk',
+        'convert_office_results',
+        'generate_hits',
+        'geocode_cache',
+        'grouping',
+        'legislators',
+        'local_geocoder',
+        'metrics',
+        'mturk',
+        'mturk_stub',
+        'packing',
+        'patch_details',
+        'pipeline',
+        'preprocess',
+        'reconcile_detail_results',
+        'reconcile_list_results',
+        'reconcile_server',
+        'reconcile_state',
+        'reconcile_turk_results',
+        'rows',
+        'site_changes',
+        'site_stub',
+        'smarty_normalize',
+        'smarty_stub',
+        'spatial',
+        'split_to_office_hits',
+        'throttle',
+        'turk_stats',
+        'worker_trust',
+    ],
+    install_requires=['PyYAML', 'rtyaml', 'termcolor'],
+    extras_require={'mturk': ['boto3']},
+    entry_points={
+        'console_scripts': ['congress-turk = congress_turk:main'],
+    },
+)
@@ -0,0 +1,188 @@
+"""
+Find legislators whose websites changed since the last run.
+
+Each site is fetched with a conditional request (If-None-Match and
+If-Modified-Since from the last response), so unchanged pages usually cost
+a 304 and no body. Sites that ignore the validators are compared by a hash
+of their content instead, with scripts, styles and whitespace left out so
+rotating tokens and reformatting don't count as changes. Fetches run on a
+pool of `concurrency` threads. Sites that can't be fetched count as
+changed, so their legislators still get a HIT.
+
+What was seen is kept in a SQLite file between runs.
+"""
+import hashlib
+import re
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+import metrics
+from throttle import TransientError, retry
+
+
+CONCURRENCY = 16
+TIMEOUT = 20  # seconds
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pages (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        digest TEXT,
+        checked REAL NOT NULL,
+        changed REAL NOT NULL
+    );
+"""
+
+Page = namedtuple('Page', 'etag last_modified digest')
+
+# status is 'new', 'changed', 'unchanged' or 'error'
+Check = namedtuple('Check', 'url status page error')
+
+IGNORED = re.compile(rb'<(script|style)\b.*?</\1\s*>', re.I | re.S)
+
+
+def page_digest(body):
+    """
+    Hash of a page's content, ignoring scripts, styles and whitespace.
+    """
+    body = IGNORED.sub(b'', body)
+    return hashlib.sha256(b' '.join(body.split())).hexdigest()
+
+
+class PageCache(object):
+    """
+    Validators and content hash of each site as last fetched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def get_many(self, urls):
+        found = {}
+        for url in urls:
+            row = self.db.execute(
+                'SELECT etag, last_modified, digest FROM pages '
+                'WHERE url = ?', (url,)).fetchone()
+            if row:
+                found[url] = Page(*row)
+        return found
+
+    def set_many(self, checks):
+        """
+        Record the pages fetched by `checks`; errors leave entries as they
+        were.
+        """
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for check in checks:
+                if check.status == 'error':
+                    continue
+                page = check.page
+                self.db.execute(
+                    'INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (url) DO UPDATE SET etag = excluded.etag, '
+                    'last_modified = excluded.last_modified, '
+                    'digest = excluded.digest, checked = excluded.checked, '
+                    'changed = CASE WHEN pages.digest IS excluded.digest '
+                    'THEN pages.changed ELSE excluded.changed END',
+                    (check.url, page.etag, page.last_modified, page.digest,
+                     now, now))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self.db.close()
+
+
+def fetch(url, cached=None, timeout=TIMEOUT):
+    """
+    Fetch `url`, conditionally if it was seen before; returns the Page, or
+    `cached` itself if the server says it's not modified.
+    """
+    import socket
+    import urllib.error
+    import urllib.request
+
+    headers = {'User-Agent': 'congress-turk'}
+    if cached and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
+
+    request = urllib.request.Request(url, headers=headers)
+    metrics.incr('site_requests')
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as r:
+            return Page(r.headers.get('ETag'), r.headers.get('Last-Modified'),
+                        page_digest(r.read()))
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            return cached
+        if e.code == 429 or e.code >= 500:
+            raise TransientError('HTTP %d' % e.code)
+        raise
+    except (urllib.error.URLError, socket.timeout, ConnectionError) as e:
+        raise TransientError(str(e))
+    finally:
+        metrics.observe('site_fetch_seconds', time.perf_counter() - start)
+
+
+def check_page(url, cached, timeout=TIMEOUT, retries=2):
+    try:
+        page = retry(lambda: fetch(url, cached, timeout), retries=retries,
+                     retryable=(TransientError,))
+    except Exception as e:
+        return Check(url, 'error', cached, '%s: %s' % (url, e))
+    if cached is None:
+        status = 'new'
+    elif page.digest == cached.digest:
+        status = 'unchanged'
+    else:
+        status = 'changed'
+    return Check(url, status, page, None)
+
+
+def check_pages(urls, cached, concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """
+    Check each of `urls` against its `cached` Page, `concurrency` at a time.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(
+            lambda url: check_page(url, cached.get(url), timeout), urls))
+
+
+def changed_urls(urls, cache_path, concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """
+    The set of `urls` that are new, changed or couldn't be checked, after
+    updating the cache at `cache_path`.
+    """
+    urls = sorted(set(urls))
+    cache = PageCache(cache_path)
+    try:
+        cached = cache.get_many(urls)
+        with metrics.timed('site_checks'):
+            checks = check_pages(urls, cached, concurrency, timeout)
+        cache.set_many(checks)
+    finally:
+        cache.close()
+
+    counts = dict.fromkeys(['new', 'changed', 'unchanged', 'error'], 0)
+    for check in checks:
+        counts[check.status] += 1
+        metrics.incr('sites_%s' % check.status)
+        if check.error:
+            print("couldn't fetch %s" % check.error, file=sys.stderr)
+    print("sites: %(new)d new, %(changed)d changed, %(unchanged)d unchanged, "
+          "%(error)d couldn't be fetched" % counts, file=sys.stderr)
+    return {c.url for c in checks if c.status != 'unchanged'}
@@ -0,0 +1,138 @@
+"""
+A stand-in for legislators' websites, for testing generate_hits.py
+--changed-only.
+
+Serves the files in a directory of fixture pages, `/<path>` from
+`<directory>/<path>` (or `<path>/index.html`), and answers conditional
+requests with 304 when a page's ETag or modification time hasn't changed:
+
+    python site_stub.py fixtures/ --port 8766 &
+    python generate_hits.py legislators.yaml -a --changed-only sites.sqlite
+
+with each legislator's `url` pointing at http://localhost:8766/<page>.
+`--no-validators` leaves out the ETag and Last-Modified headers, so
+changes have to be found by comparing content, and a fraction of requests
+can be made to fail with 503.
+"""
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    # set on the server: root, validators, failure_rate, latency, stats
+
+    def page_path(self):
+        path = os.path.normpath(self.path.split('?')[0].lstrip('/'))
+        if path.startswith('..'):
+            return None
+        path = os.path.join(self.server.root, path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        return path if os.path.isfile(path) else None
+
+    def not_modified(self, etag, mtime):
+        if 'If-None-Match' in self.headers:
+            return self.headers['If-None-Match'] == etag
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.stats['requests'] += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if random.random() < server.failure_rate:
+            with server.lock:
+                server.stats['failures'] += 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        path = self.page_path()
+        if path is None:
+            self.send_error(404)
+            return
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        mtime = os.path.getmtime(path)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+
+        if server.validators and self.not_modified(etag, mtime):
+            with server.lock:
+                server.stats['not_modified'] += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(root, port=0, validators=True, failure_rate=0, latency=0):
+    """
+    Create (but don't start) a stub server; port 0 picks a free port.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), SiteHandler)
+    server.root = root
+    server.validators = validators
+    server.failure_rate = failure_rate
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'failures': 0, 'not_modified': 0}
+    server.url = 'http://127.0.0.1:%d/' % server.server_port
+    return server
+
+
+def start_server(root, **kwargs):
+    """
+    Start a stub server in a background thread and return it.
+    """
+    server = make_server(root, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+        'Stub legislator websites served from a directory of fixture pages')
+    parser.add_argument("root", help="Directory of fixture pages")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--no-validators", dest='validators',
+        action='store_false',
+        help="Don't send ETag or Last-Modified headers, or answer 304")
+    parser.add_argument("--failure-rate", type=float, default=0,
+        help="Fraction of requests to fail with 503")
+    parser.add_argument("--latency", type=float, default=0,
+        help="Seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    server = make_server(args.root, args.port, args.validators,
+                         args.failure_rate, args.latency)
+    print("Serving %s on %s" % (args.root, server.url))
+    server.serve_forever()
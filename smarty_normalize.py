@@ -1,23 +1,168 @@
+import importlib.util
+import json
+import os
 import re
-import smartystreets  # https://github.com/bennylope/smartystreets.py/
-import smarty_creds
+import sys
+import time
 
+import metrics
+from geocode_cache import GeocodeCache, MISSING
+from throttle import RateLimiter, TransientError, retry
 
-smarty = smartystreets.Client(
-    smarty_creds.SMARTY_AUTH_ID, smarty_creds.SMARTY_AUTH_TOKEN)
+
+SMARTY_API_URL = os.environ.get(
+    'SMARTY_API_URL', 'https://api.smartystreets.com/street-address')
+
+BATCH_SIZE = 100  # most addresses smarty accepts in one POST
+
+GEOCODE_CACHE = os.environ.get('GEOCODE_CACHE', 'geocode_cache.sqlite')
+LOCAL_GEOCODER = os.environ.get('LOCAL_GEOCODER')  # see local_geocoder.py
+
+
+class SmartyClient(object):
+    """
+    Minimal client for the smarty streets US street address API.
+
+    `base_url` can point at a local stub (see smarty_stub.py) for testing.
+    """
+
+    def __init__(self, auth_id, auth_token, base_url=SMARTY_API_URL,
+                 rate=10, retries=4, timeout=30):
+        self.auth_id = auth_id
+        self.auth_token = auth_token
+        self.base_url = base_url
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.timeout = timeout
+
+    def post(self, addresses):
+        import socket
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+
+        query = urllib.parse.urlencode({
+            'auth-id': self.auth_id, 'auth-token': self.auth_token})
+        request = urllib.request.Request(
+            '%s?%s' % (self.base_url, query),
+            data=json.dumps(addresses).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        metrics.incr('geocode_api_requests')
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                return json.loads(r.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                raise TransientError('HTTP %d from %s' % (e.code, e.url))
+            raise
+        except (urllib.error.URLError, socket.timeout) as e:
+            raise TransientError(str(e))
+        finally:
+            metrics.observe('geocode_api_seconds', time.perf_counter() - start)
+
+    def street_addresses(self, addresses):
+        """
+        Look up a batch of addresses.
+
+        Returns a list the same length as `addresses`, holding the first
+        candidate for each or None if there was no match.
+        """
+        candidates = retry(lambda: self.post(addresses),
+                           retries=self.retries,
+                           retryable=(TransientError,),
+                           limiter=self.limiter)
+        results = [None] * len(addresses)
+        for candidate in candidates:
+            index = candidate['input_index']
+            if results[index] is None:
+                results[index] = candidate
+        return results
+
+    def street_address(self, address):
+        return self.street_addresses([address])[0]
+
+
+smarty = None
+
+
+def has_credentials():
+    """
+    Whether credentials are available, without loading them.
+    """
+    return bool(os.environ.get('SMARTY_AUTH_ID') or
+                importlib.util.find_spec('smarty_creds'))
+
+
+def get_client():
+    """
+    The shared client, created on first use from the SMARTY_AUTH_ID and
+    SMARTY_AUTH_TOKEN environment variables or else smarty_creds.py.
+    """
+    global smarty
+    if smarty is None:
+        auth_id = os.environ.get('SMARTY_AUTH_ID')
+        auth_token = os.environ.get('SMARTY_AUTH_TOKEN')
+        if not auth_id:
+            import smarty_creds
+            auth_id = smarty_creds.SMARTY_AUTH_ID
+            auth_token = smarty_creds.SMARTY_AUTH_TOKEN
+        smarty = SmartyClient(auth_id, auth_token)
+    return smarty
 
 
 HIGH_PRECISION = ('Zip7', 'Zip8', 'Zip9')
 
 
-memo = {}
+cache = None
 
 
-def normalize_address(row):
+def configure_cache(path=GEOCODE_CACHE, **kwargs):
     """
-    Normalize and geocode using smartystreets.
+    Open the persistent lookup cache; see GeocodeCache for options.
+    """
+    global cache
+    if cache is not None:
+        cache.close()
+    cache = GeocodeCache(path, **kwargs)
+    return cache
 
-    Updates given row in place.
+
+def get_cache():
+    if cache is None:
+        configure_cache()
+    return cache
+
+
+local = None
+
+
+def configure_local(path):
+    """
+    Answer lookups from a local_geocoder.py index first, going to the
+    remote service only for addresses it doesn't have.
+    """
+    global local
+    from local_geocoder import LocalGeocoder
+    if local is not None:
+        local.close()
+    local = LocalGeocoder(path)
+    return local
+
+
+def local_lookup(before):
+    """
+    (result, precise) from the local index, or (None, False).
+    """
+    if local is None:
+        return None, False
+    r = local.street_address(before)
+    return r, bool(r and r['metadata'].get('precision') in HIGH_PRECISION)
+
+
+def address_query(row):
+    """
+    Build the lookup for a row, or None if it has too little to look up.
     """
     before = {
         'street': row["Answer.address"].strip(),
@@ -28,21 +173,126 @@ def normalize_address(row):
     if not before.get('street') and (
             before.get('zipcode') or
             (before.get('city') and before.get('state'))):
-        return
+        return None
+    return before
+
 
-    memo_key = tuple(sorted(before.items()))
+def memo_key(before):
+    return tuple(sorted(before.items()))
 
-    kwargs = {
+
+def lookup_kwargs(before):
+    return {
         'candidates': 1,
         'match': 'range',
         **before
     }
 
-    if memo_key in memo:
-        r = memo[memo_key]
+
+def normalize_address(row):
+    """
+    Normalize and geocode using the local index, if configured, and
+    smartystreets.
+
+    Updates given row in place.
+    """
+    before = address_query(row)
+    if before is None:
+        return
+
+    key = memo_key(before)
+
+    with metrics.timed('normalize_address'):
+        r, precise = local_lookup(before)
+        if precise:
+            metrics.incr('local_geocode_hits')
+        elif has_credentials():
+            remote = get_cache().get(key)
+            if remote is MISSING:
+                metrics.incr('geocode_cache_misses')
+                remote = get_client().street_address(lookup_kwargs(before))
+                cache.set(key, remote)
+            else:
+                metrics.incr('geocode_cache_hits')
+            r = remote or r
+
+        apply_result(row, r)
+
+
+def normalize_addresses(rows, workers=4, batch_size=BATCH_SIZE):
+    """
+    Normalize and geocode many rows at once.
+
+    Unique addresses are looked up in the local index, if configured;
+    those it doesn't have precisely (all of them, without one) and that
+    aren't already cached are sent to the remote service in batches of up
+    to `batch_size` over a pool of `workers` threads. Rows are updated in
+    place; rows in a batch that fails even after retries keep the local
+    index's ZIP level result, if any, or are left as is.
+    """
+    queries = {}
+    for row in rows:
+        before = address_query(row)
+        if before is not None:
+            queries.setdefault(memo_key(before), before)
+
+    found = {}
+    imprecise = {}
+    if local is not None:
+        with metrics.timed('local_geocode'):
+            for k, before in queries.items():
+                r, precise = local_lookup(before)
+                if precise:
+                    found[k] = r
+                elif r:
+                    imprecise[k] = r
+        metrics.incr('local_geocode_hits', len(found))
+
+    remote = [k for k in queries if k not in found]
+    if remote and has_credentials():
+        with metrics.timed('geocode_cache'):
+            cached = get_cache().get_many(remote)
+        found.update((k, r) for k, r in cached.items() if r)
+        pending = [k for k in remote if k not in cached]
+        metrics.incr('geocode_cache_hits', len(cached))
+        metrics.incr('geocode_cache_misses', len(pending))
     else:
-        r = memo[memo_key] = smarty.street_address(kwargs)
+        pending = []
+    batches = [pending[i:i + batch_size]
+               for i in range(0, len(pending), batch_size)]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = get_client() if batches else None
+
+    def lookup(keys):
+        return keys, client.street_addresses(
+            [lookup_kwargs(queries[k]) for k in keys])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            metrics.timed('normalize_address'):
+        futures = [pool.submit(lookup, batch) for batch in batches]
+        for future in futures:
+            try:
+                keys, results = future.result()
+            except Exception as e:
+                print("Error normalizing batch: %s" % e)
+                continue
+            cache.set_many(zip(keys, results))
+            found.update((k, r) for k, r in zip(keys, results) if r)
 
+    for k, r in imprecise.items():
+        found.setdefault(k, r)
+
+    for row in rows:
+        before = address_query(row)
+        if before is not None and memo_key(before) in found:
+            apply_result(row, found[memo_key(before)])
+
+    return rows
+
+
+def apply_result(row, r):
     if not r:
         return
 
@@ -73,3 +323,63 @@ def normalize_address(row):
         after['longitude'] = metadata['longitude']
 
     row.update(after)
+
+
+def main(argv=None):
+    """
+    Normalize and geocode the addresses of a detail results CSV, without
+    reconciling it.
+    """
+    import argparse
+    import csv
+    from itertools import islice
+
+    from geocode_cache import DAY
+
+    parser = argparse.ArgumentParser(description=
+        'Normalize and geocode the addresses in detail HIT results')
+    parser.add_argument("source", type=argparse.FileType('r'),
+        help="CSV results of MTurk detail HITs")
+    parser.add_argument("-o", "--out", type=argparse.FileType('w'),
+        default='-', help="destination for the normalized CSV")
+    parser.add_argument("--geocode-workers", type=int, default=4,
+        help="Concurrent address normalization requests")
+    parser.add_argument("--geocode-cache", default=GEOCODE_CACHE,
+        help="SQLite file caching address lookups between runs")
+    parser.add_argument("--geocode-cache-days", type=float, default=365,
+        help="Days before a cached address lookup expires")
+    parser.add_argument("--local-geocoder", default=LOCAL_GEOCODER,
+        help="Index built by local_geocoder.py to look addresses up in "
+             "before the remote service")
+    parser.add_argument("--rows", type=int, default=5000,
+        help="Rows normalized together")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args)
+
+    if not (has_credentials() or args.local_geocoder):
+        parser.error("needs smarty credentials or --local-geocoder")
+    if args.local_geocoder:
+        configure_local(args.local_geocoder)
+    if has_credentials():
+        configure_cache(args.geocode_cache,
+                        ttl=args.geocode_cache_days * DAY)
+
+    reader = csv.DictReader(args.source)
+    fields = list(reader.fieldnames)
+    fields += [f for f in ('latitude', 'longitude') if f not in fields]
+    writer = csv.DictWriter(args.out, fieldnames=fields)
+    writer.writeheader()
+    while True:
+        rows = list(islice(reader, args.rows))
+        if not rows:
+            break
+        metrics.incr('rows_read', len(rows))
+        writer.writerows(normalize_addresses(rows,
+                                             workers=args.geocode_workers))
+    if cache is not None:
+        print(cache.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+A stand-in for the smarty streets street address endpoint, for testing.
+
+Run it and point smarty_normalize at it:
+
+    python smarty_stub.py --port 8765 &
+    SMARTY_API_URL=http://localhost:8765/street-address \
+        python reconcile_detail_results.py ...
+
+Every address "matches", with made up but stable components and
+coordinates, except streets containing "nowhere". A fraction of requests
+can be made to fail with 429/503 to exercise retries.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_candidate(index, address):
+    street = address.get('street', '').strip()
+    if not street or 'nowhere' in street.lower():
+        return None
+
+    digest = hashlib.md5(json.dumps(address, sort_keys=True).encode('utf-8'))
+    n = int(digest.hexdigest(), 16)
+    zipcode = (address.get('zipcode') or '%05d' % (n % 100000))[:5]
+    return {
+        'input_index': index,
+        'candidate_index': 0,
+        'delivery_line_1': street.upper(),
+        'components': {
+            'city_name': address.get('city', '').strip().title(),
+            'state_abbreviation': address.get('state', '').strip().upper(),
+            'zipcode': zipcode,
+            'plus4_code': '%04d' % (n % 10000),
+        },
+        'metadata': {
+            'precision': 'Zip9',
+            'latitude': round(25 + (n % 2400) / 100.0, 5),
+            'longitude': round(-125 + (n // 2400 % 5800) / 100.0, 5),
+        },
+        'analysis': {'dpv_match_code': 'Y'},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # set on the server: failure_rate, latency, stats
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        with server.lock:
+            server.stats['requests'] += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if random.random() < server.failure_rate:
+            with server.lock:
+                server.stats['failures'] += 1
+            self.send_response(random.choice([429, 503]))
+            self.end_headers()
+            return
+
+        addresses = json.loads(body.decode('utf-8'))
+        with server.lock:
+            server.stats['addresses'] += len(addresses)
+        candidates = [fake_candidate(i, a) for i, a in enumerate(addresses)]
+        out = json.dumps([c for c in candidates if c]).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=0, failure_rate=0, latency=0):
+    """
+    Create (but don't start) a stub server; port 0 picks a free port.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.failure_rate = failure_rate
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.stats = {'requests': 0, 'failures': 0, 'addresses': 0}
+    server.url = 'http://127.0.0.1:%d/street-address' % server.server_port
+    return server
+
+
+def start_server(**kwargs):
+    """
+    Start a stub server in a background thread and return it.
+    """
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+        'Stub smarty streets street address endpoint')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--failure-rate", type=float, default=0,
+        help="Fraction of requests to fail with 429/503")
+    parser.add_argument("--latency", type=float, default=0,
+        help="Seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.failure_rate, args.latency)
+    print("Listening on %s" % server.url)
+    server.serve_forever()
@@ -0,0 +1,110 @@
+"""
+Find offices that are in (nearly) the same place.
+
+Geocoded offices go into a grid of cells at least as large as the
+distance of interest, so each office only needs comparing with the offices
+in its own and the eight neighbouring cells, rather than with every other
+office. Two offices of one legislator that close together are probably the
+same office entered twice; offices of different legislators are flagged
+as sharing a location, which is sometimes right (federal buildings) and
+sometimes a copy and paste error.
+"""
+import csv
+import math
+from collections import defaultdict, namedtuple
+
+EARTH_RADIUS = 6371000  # meters
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+NEAR = 30  # meters
+
+Point = namedtuple('Point', 'bioguide office_id latitude longitude')
+
+Finding = namedtuple('Finding', 'kind meters a b')
+
+REPORT_FIELDS = ['kind', 'meters', 'bioguide_a', 'office_a',
+                 'bioguide_b', 'office_b']
+
+
+def distance(a, b):
+    """
+    Great circle distance in meters between two points.
+    """
+    lat1, lat2 = math.radians(a.latitude), math.radians(b.latitude)
+    dlat = lat2 - lat1
+    dlon = math.radians(b.longitude - a.longitude)
+    h = (math.sin(dlat / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(h)))
+
+
+class GridIndex(object):
+    """
+    Points bucketed into cells at least `cell_size` meters on a side.
+
+    Degrees of longitude shrink towards the poles, so cells are made wide
+    enough in longitude to span `cell_size` meters at `max_latitude`, and
+    a little wider than needed closer to the equator.
+    """
+
+    def __init__(self, cell_size, max_latitude=85):
+        self.cell_size = cell_size
+        self.lat_step = cell_size / METERS_PER_DEGREE
+        self.lon_step = self.lat_step / math.cos(
+            math.radians(min(abs(max_latitude), 89)))
+        self.cells = defaultdict(list)
+
+    def cell(self, point):
+        return (int(math.floor(point.latitude / self.lat_step)),
+                int(math.floor(point.longitude / self.lon_step)))
+
+    def add(self, point):
+        self.cells[self.cell(point)].append(point)
+
+    def near(self, point, radius):
+        """
+        (point, meters) for indexed points within `radius` meters of
+        `point`; `radius` may not exceed the cell size.
+        """
+        cx, cy = self.cell(point)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other in self.cells.get((cx + dx, cy + dy), ()):
+                    meters = distance(point, other)
+                    if meters <= radius:
+                        yield other, meters
+
+
+def close_offices(points, near=NEAR):
+    """
+    Findings for each pair of offices within `near` meters: 'duplicate'
+    for two of one legislator's offices, 'shared' across legislators.
+    """
+    points = list(points)
+    index = GridIndex(near, max((abs(p.latitude) for p in points),
+                                default=0))
+    findings = []
+    for point in points:
+        for other, meters in index.near(point, near):
+            kind = 'duplicate' if other.bioguide == point.bioguide else (
+                'shared')
+            a, b = sorted((other, point), key=lambda p: p[:2])
+            findings.append(Finding(kind, meters, a, b))
+        index.add(point)
+    findings.sort(key=lambda f: (f.kind, f.a.bioguide, f.a.office_id,
+                                 f.b.office_id))
+    return findings
+
+
+def summary(findings):
+    duplicates = sum(f.kind == 'duplicate' for f in findings)
+    return ("%d possible duplicate offices, %d locations shared between "
+            "legislators" % (duplicates, len(findings) - duplicates))
+
+
+def write_report(findings, outfile):
+    writer = csv.writer(outfile)
+    writer.writerow(REPORT_FIELDS)
+    for f in findings:
+        writer.writerow([f.kind, '%.1f' % f.meters, f.a.bioguide,
+                         f.a.office_id, f.b.bioguide, f.b.office_id])
@@ -1,8 +1,28 @@
+"""
+Split reconciled office lists into one detail HIT per office.
+
+With --existing, offices already in the district offices file are carried
+over rather than looked up again: the file is indexed by bioguide id and
+city, and a listed office whose name matches exactly one of the
+legislator's current offices is written to the --carried manifest, which
+convert_office_results merges back in. New offices, and names that match
+no office or several, still become HITs.
+
+With --pack, a legislator's offices are bundled into as few HITs as the
+--pack limit and --target-seconds of estimated work allow (see packing.py
+and office_details_packed.html), rather than one HIT per office.
+"""
 import csv
 import argparse
+import re
+import sys
+from collections import defaultdict
+
+import metrics
+import packing
 
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description=
         'Generate a CSV for Mech Turk HITs gathering district office data.')
     parser.add_argument("office_lists",
@@ -11,8 +31,38 @@ def parse_args():
         help="destination for CSV file",
         type=argparse.FileType('w'),
         default='-')  # '-' => stdout
+    parser.add_argument("--existing",
+        help="Current district offices file (legislators-district-offices."
+             "yaml); only offices not found in it become HITs")
+    parser.add_argument("--carried",
+        help="Write offices carried over from --existing to this YAML file "
+             "(default: carried_offices.yaml)",
+        default='carried_offices.yaml')
+    parser.add_argument("--pack",
+        help="Put up to this many of a legislator's offices in one HIT "
+             "(at most %d)" % packing.MAX_OFFICES,
+        type=int)
+    parser.add_argument("--target-seconds",
+        help="With --pack, put no more offices in a HIT than fit in this "
+             "many seconds of estimated work",
+        type=float)
+    parser.add_argument("--site-seconds",
+        help="Estimated seconds to find a legislator's offices "
+             "(default: %(default)s)",
+        type=float, default=packing.SITE_SECONDS)
+    parser.add_argument("--office-seconds",
+        help="Estimated seconds to fill in each office "
+             "(default: %(default)s)",
+        type=float, default=packing.OFFICE_SECONDS)
+    metrics.add_arguments(parser)
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.pack is not None and not 1 <= args.pack <= packing.MAX_OFFICES:
+        parser.error("--pack must be from 1 to %d" % packing.MAX_OFFICES)
+    if args.target_seconds and not args.pack:
+        parser.error("--target-seconds needs --pack")
+    metrics.start(args)
+    return args
 
 
 def convert_row(row):
@@ -24,17 +74,115 @@ def convert_row(row):
                'state': row['Input.state'],
                'office': office.strip()}
 
-def split_to_office_hits():
-    args = parse_args()
 
-    out_fields = "id url name state office".split()
+def locality_key(name):
+    """
+    Office name or city reduced to lowercase words, for matching.
+    """
+    key = re.sub(r'[^a-z0-9]+', ' ', name.lower()).strip()
+    return re.sub(r' (district )?office$', '', key)
+
+
+def index_offices(path):
+    """
+    {bioguide: {locality key: [offices]}} for a district offices file.
+    """
+    import yaml
+    Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+    with metrics.timed('yaml_load'), open(path) as f:
+        entries = yaml.load(f, Loader=Loader) or []
+
+    index = {}
+    for entry in entries:
+        by_locality = defaultdict(list)
+        for office in entry.get('offices') or []:
+            by_locality[locality_key(office.get('city', ''))].append(office)
+        index[entry['id']['bioguide']] = by_locality
+    return index
+
+
+class CarryOver(object):
+    """
+    Matches listed offices against a legislator's current offices.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.carried = defaultdict(list)
+        self.used = set()
+
+    def match(self, row_out):
+        """
+        The current office `row_out` names, or None if it's new or
+        ambiguous. Each current office is only carried over once.
+        """
+        by_locality = self.index.get(row_out['id'], {})
+        found = by_locality.get(locality_key(row_out['office']), [])
+        if len(found) != 1 or found[0]['id'] in self.used:
+            return None
+        office = found[0]
+        self.used.add(office['id'])
+        self.carried[row_out['id']].append(office)
+        return office
+
+    def write(self, path):
+        import yaml
+        with open(path, 'w') as f:
+            yaml.safe_dump({k: self.carried[k] for k in sorted(self.carried)},
+                           f, default_flow_style=False, sort_keys=False)
+
+
+def split_to_office_hits(argv=None):
+    args = parse_args(argv)
+
+    carry = None
+    if args.existing:
+        carry = CarryOver(index_offices(args.existing))
+
+    per_hit = None
+    if args.pack:
+        per_hit = packing.offices_per_hit(
+            args.pack, args.target_seconds, site_seconds=args.site_seconds,
+            office_seconds=args.office_seconds)
+        out_fields = packing.HIT_FIELDS
+    else:
+        out_fields = "id url name state office".split()
     writer = csv.DictWriter(args.out, fieldnames=out_fields)
     writer.writeheader()
 
-    for row in csv.DictReader(open(args.office_lists)):
+    hits = offices = carried = 0
+    rows = csv.DictReader(open(args.office_lists))
+    for row in metrics.timed_iter('csv_parse', rows):
+        metrics.incr('rows_read')
+        rows_out = []
         for row_out in convert_row(row):
-            writer.writerow(row_out)
+            if carry and carry.match(row_out):
+                carried += 1
+                continue
+            rows_out.append(row_out)
+        offices += len(rows_out)
+        if per_hit:
+            rows_out = list(packing.pack_offices(rows_out, per_hit))
+        hits += len(rows_out)
+        writer.writerows(rows_out)
+    metrics.incr('hits_written', hits)
+
+    if per_hit:
+        print("%d offices packed into %d HITs of up to %d (~%ds each)" % (
+            offices, hits, per_hit, packing.estimate_seconds(
+                per_hit, args.site_seconds, args.office_seconds)),
+            file=sys.stderr)
+
+    if carry:
+        metrics.incr('offices_carried', carried)
+        carry.write(args.carried)
+        print("%d offices carried over to %s, %d HITs for the rest" % (
+            carried, args.carried, hits), file=sys.stderr)
+
+
+main = split_to_office_hits
 
 
 if __name__ == '__main__':
-    split_to_office_hits()
+    main()
@@ -0,0 +1,253 @@
+"""
+Generate synthetic data for exercising the pipeline at scale.
+
+Writes, for a given scale (1 = today's ~540 legislators / ~1500 offices):
+
+    legislators.yaml            congress-legislators style legislators file
+    list_results.csv            MTurk results of List Offices HITs
+    list_results_out.csv        the same, reconciled (one row per HIT)
+    detail_results.csv          MTurk results of Office Details HITs
+    detail_results_out.csv      the same, reconciled, with coordinates
+
+`--disagreement` is the chance that one assignment of a HIT differs from
+the others, i.e. roughly the share of groups needing reconciliation.
+
+    python synthetic_data.py data/ --scale 10 --disagreement 0.2
+"""
+import argparse
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+import yaml
+
+
+LEGISLATORS = 540  # senators, representatives and delegates at scale 1
+
+STATES = """
+    AK AL AR AS AZ CA CO CT DC DE FL GA GU HI IA ID IL IN KS KY LA MA MD ME
+    MI MN MO MP MS MT NC ND NE NH NJ NM NV NY OH OK OR PA PR RI SC SD TN TX
+    UT VA VI VT WA WI WV WY
+""".split()
+
+CITIES = """
+    Springfield Riverside Franklin Greenville Bristol Clinton Fairview Salem
+    Madison Georgetown Arlington Ashland Dover Oxford Jackson Burlington
+    Manchester Milton Newport Auburn Dayton Lexington Milford Winchester
+    Hudson Kingston Mount Vernon Centerville Oakland Marion
+""".split()
+
+STREETS = "Main Oak Pine Maple Cedar Elm Washington Lake Hill Park".split()
+
+MTURK_FIELDS = """
+    HITId HITTypeId Title Reward CreationTime MaxAssignments
+    AssignmentId WorkerId AssignmentStatus AcceptTime SubmitTime
+    WorkTimeInSeconds
+""".split()
+
+LIST_ANSWERS = ['Answer.district_offices']
+
+DETAIL_ANSWERS = ['Answer.' + f for f in
+                  'address suite building city state zip phone fax hours'
+                  .split()]
+
+MEDIAN_SECONDS = {'list': 53, 'detail': 133}  # from the readme
+
+
+def mturk_time(t):
+    return t.strftime('%a %b %d %H:%M:%S PDT %Y')
+
+
+class Generator(object):
+
+    def __init__(self, scale=1, disagreement=0.2, assignments=2, seed=0,
+                 workers=None):
+        self.random = random.Random(seed)
+        self.scale = scale
+        self.disagreement = disagreement
+        self.assignments = assignments
+        self.workers = ['A%013d' % i
+                        for i in range(workers or max(20, int(50 * scale)))]
+        self.start = datetime(2016, 10, 17, 9, 0, 0)
+        self.hit_count = 0
+
+    def legislators(self):
+        n = int(LEGISLATORS * self.scale)
+        senators = min(n // 5, 2 * len(STATES))
+        districts = {}
+        records = []
+        for i in range(n):
+            state = STATES[i % len(STATES)]
+            if i < senators:
+                term = {'type': 'sen', 'state': state,
+                        'state_rank': ['senior', 'junior'][i // len(STATES)]}
+            else:
+                districts[state] = districts.get(state, 0) + 1
+                term = {'type': 'rep', 'state': state,
+                        'district': districts[state]}
+            term['url'] = 'https://legislator%d.example.gov' % i
+            records.append({
+                'id': {'bioguide': 'S%06d' % i, 'thomas': '%05d' % i,
+                       'govtrack': 400000 + i},
+                'name': {'first': 'First%d' % i, 'last': 'Last%d' % (i % 997)},
+                'terms': [term],
+            })
+        return records
+
+    def offices(self, record):
+        cities = self.random.sample(CITIES, self.random.choice(
+            [1, 1, 2, 2, 3, 3, 3, 4, 5, 6]))
+        return [{
+            'name': city,
+            'address': '%d %s St' % (self.random.randint(1, 9999),
+                                     self.random.choice(STREETS)),
+            'suite': str(self.random.randint(100, 999))
+                     if self.random.random() < 0.5 else '',
+            'building': '',
+            'city': city.replace(' ', ' '),
+            'state': record['terms'][-1]['state'],
+            'zip': '%05d' % self.random.randint(10000, 99999),
+            'phone': '(%03d) 555-%04d' % (self.random.randint(200, 999),
+                                          self.random.randint(0, 9999)),
+            'fax': '' if self.random.random() < 0.3 else
+                   '%03d-555-%04d' % (self.random.randint(200, 999),
+                                      self.random.randint(0, 9999)),
+            'hours': 'M-F 9-5' if self.random.random() < 0.5 else '',
+        } for city in cities]
+
+    def metadata(self, kind, hit_id):
+        accept = self.start + timedelta(
+            seconds=self.random.randint(0, int(3 * 24 * 3600)))
+        seconds = max(5, int(self.random.lognormvariate(0, 0.9) *
+                             MEDIAN_SECONDS[kind]))
+        return {
+            'HITId': hit_id,
+            'HITTypeId': '%s_TYPE' % kind.upper(),
+            'Title': {'list': 'List Offices',
+                      'detail': 'Office Details'}[kind],
+            'Reward': '$0.50',
+            'CreationTime': mturk_time(self.start),
+            'MaxAssignments': self.assignments,
+            'AssignmentId': '%s_%s' % (hit_id, self.random.randint(0, 10**9)),
+            'WorkerId': self.random.choice(self.workers),
+            'AssignmentStatus': 'Submitted',
+            'AcceptTime': mturk_time(accept),
+            'SubmitTime': mturk_time(accept + timedelta(seconds=seconds)),
+            'WorkTimeInSeconds': seconds,
+        }
+
+    def hit_id(self):
+        self.hit_count += 1
+        return '3H%018d' % self.hit_count
+
+    def assignments_for(self, kind, hit_id, inputs, answers, disagree):
+        rows = []
+        odd_one = self.random.randrange(self.assignments)
+        for a in range(self.assignments):
+            row = self.metadata(kind, hit_id)
+            row.update(inputs)
+            row.update(answers)
+            if a == odd_one and self.random.random() < self.disagreement:
+                disagree(row)
+            row.update({'Approve': '', 'Reject': ''})
+            rows.append(row)
+        return rows
+
+    def disagree_list(self, row):
+        offices = row['Answer.district_offices'].split('\n')
+        if len(offices) > 1 and self.random.random() < 0.5:
+            offices.pop()
+        else:
+            offices.append(self.random.choice(CITIES) + ' Satellite')
+        row['Answer.district_offices'] = '\n'.join(offices)
+
+    def disagree_detail(self, row):
+        field = self.random.choice(['address', 'phone', 'suite', 'hours'])
+        row['Answer.' + field] = '%s %d' % (row['Answer.' + field],
+                                            self.random.randint(1, 9))
+
+    def write(self, outdir, shuffle=False):
+        os.makedirs(outdir, exist_ok=True)
+        records = self.legislators()
+        with open(os.path.join(outdir, 'legislators.yaml'), 'w') as f:
+            yaml.dump(records, f, default_flow_style=False)
+
+        list_rows, list_out, detail_rows, detail_out = [], [], [], []
+        for record in records:
+            term = record['terms'][-1]
+            inputs = {
+                'Input.id': record['id']['bioguide'],
+                'Input.name': 'Rep. First Last',
+                'Input.state': term['state'],
+                'Input.url': term['url'],
+            }
+            offices = self.offices(record)
+            names = '\n'.join(o['name'] for o in offices)
+
+            hit_id = self.hit_id()
+            rows = self.assignments_for(
+                'list', hit_id, inputs, {'Answer.district_offices': names},
+                self.disagree_list)
+            list_rows.extend(rows)
+            list_out.append(dict(rows[0], **{
+                'Answer.district_offices': names}))
+
+            for office in offices:
+                hit_id = self.hit_id()
+                answers = {'Answer.' + k: v for k, v in office.items()
+                           if k != 'name'}
+                rows = self.assignments_for(
+                    'detail', hit_id,
+                    dict(inputs, **{'Input.office': office['name']}),
+                    answers, self.disagree_detail)
+                detail_rows.extend(rows)
+                detail_out.append(dict(rows[0], latitude='%.5f' % (
+                    self.random.uniform(25, 49)), longitude='%.5f' % (
+                    self.random.uniform(-124, -67)), **answers))
+
+        if shuffle:
+            self.random.shuffle(list_rows)
+            self.random.shuffle(detail_rows)
+
+        input_fields = ['Input.id', 'Input.name', 'Input.state', 'Input.url']
+        tail = ['Approve', 'Reject']
+        for name, rows, fields in [
+                ('list_results.csv', list_rows,
+                 MTURK_FIELDS + input_fields + LIST_ANSWERS + tail),
+                ('list_results_out.csv', list_out,
+                 MTURK_FIELDS + input_fields + LIST_ANSWERS + tail),
+                ('detail_results.csv', detail_rows,
+                 MTURK_FIELDS + input_fields + ['Input.office'] +
+                 DETAIL_ANSWERS + tail),
+                ('detail_results_out.csv', detail_out,
+                 MTURK_FIELDS + input_fields + ['Input.office'] +
+                 DETAIL_ANSWERS + tail + ['latitude', 'longitude'])]:
+            with open(os.path.join(outdir, name), 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(rows)
+
+        return {'legislators': len(records), 'offices': len(detail_out),
+                'list_assignments': len(list_rows),
+                'detail_assignments': len(detail_rows)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+        'Generate synthetic legislators and MTurk results')
+    parser.add_argument("outdir", help="directory to write files into")
+    parser.add_argument("--scale", type=float, default=1,
+        help="Multiple of today's ~1500 offices (e.g. 1, 10, 100)")
+    parser.add_argument("--disagreement", type=float, default=0.2,
+        help="Chance that an assignment disagrees with the others")
+    parser.add_argument("--assignments", type=int, default=2,
+        help="Assignments per HIT")
+    parser.add_argument("--shuffle", action="store_true",
+        help="Don't keep each HIT's assignments together")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generator = Generator(args.scale, args.disagreement, args.assignments,
+                          args.seed)
+    print(generator.write(args.outdir, args.shuffle))
@@ -0,0 +1,58 @@
+import pytest
+
+import smarty_normalize
+from local_geocoder import LocalGeocoder, build
+
+
+ADDRESSES = """\
+LON,LAT,NUMBER,STREET,POSTCODE
+-89.650148,39.798363,123,Main Street,62701
+"""
+
+ZCTA = """\
+GEOID\tALAND\tINTPTLAT\tINTPTLONG
+62701\t4806155\t39.800\t-89.650
+"""
+
+
+@pytest.fixture
+def index(tmp_path):
+    (tmp_path / 'addresses.csv').write_text(ADDRESSES)
+    (tmp_path / 'zcta.txt').write_text(ZCTA)
+    path = str(tmp_path / 'local.idx')
+    build(path, [str(tmp_path / 'zcta.txt')],
+          [str(tmp_path / 'addresses.csv')])
+    yield path
+    if smarty_normalize.local is not None:
+        smarty_normalize.local.close()
+        smarty_normalize.local = None
+
+
+def detail_row(address, zipcode='62701-1234'):
+    return {'Answer.address': address, 'Answer.city': 'Springfield',
+            'Answer.state': 'IL', 'Answer.zip': zipcode}
+
+
+def test_precise_match_keeps_address(index):
+    geocoder = LocalGeocoder(index)
+    r = geocoder.street_address({'street': '123 Main Street Suite 400',
+                                 'zipcode': '62701-1234'})
+    assert r['metadata']['precision'] == 'Zip9'
+    assert r['delivery_line_1'] == '123 Main Street Suite 400'
+    geocoder.close()
+
+
+def test_normalize_keeps_suite(index):
+    smarty_normalize.configure_local(index)
+    rows = [detail_row('123 Main Street Suite 400'), detail_row('9 Elm St')]
+    smarty_normalize.normalize_addresses(rows)
+
+    precise, centroid = rows
+    assert precise['Answer.address'] == '123 Main Street Suite 400'
+    assert precise['Answer.zip'] == '62701-1234'
+    assert precise['latitude'] == pytest.approx(39.798363)
+    assert precise['longitude'] == pytest.approx(-89.650148)
+
+    # only the ZIP code is known: the row keeps its address, ungeocoded
+    assert centroid['Answer.address'] == '9 Elm St'
+    assert 'latitude' not in centroid
@@ -0,0 +1,81 @@
+import csv
+import io
+
+from packing import (collapse_review, merge_decisions, office_counts,
+                     original_id, pack_offices, unpack_row, unpacked_fields)
+
+
+def packed_row(offices, assignment='A1'):
+    row = {'HITId': 'H1', 'AssignmentId': assignment, 'WorkerId': 'W1',
+           'Input.id': 'S000001', 'Input.office_count': str(len(offices))}
+    for n in range(1, 4):
+        office = offices[n - 1] if n <= len(offices) else ''
+        row['Input.office_%d' % n] = office
+        row['Answer.address_%d' % n] = office and '%s Main St' % n
+    return row
+
+
+def unpacked_rows(offices, assignment='A1'):
+    return list(unpack_row(packed_row(offices, assignment)))
+
+
+def test_pack_and_unpack():
+    offices = [{'id': 'S000001', 'url': 'u', 'name': 'n', 'state': 'IL',
+                'office': o} for o in ('springfield', 'chicago', 'peoria')]
+    packed = list(pack_offices(offices, 2))
+    assert [p['office_count'] for p in packed] == [2, 1]
+    assert packed[0]['office_2'] == 'chicago'
+    assert packed[1]['office_1'] == 'peoria'
+
+    rows = unpacked_rows(['springfield', 'chicago'])
+    assert [r['Input.office'] for r in rows] == ['springfield', 'chicago']
+    assert [r['Answer.address'] for r in rows] == ['1 Main St', '2 Main St']
+    assert [r['AssignmentId'] for r in rows] == ['A1/1', 'A1/2']
+    assert {original_id(r['HITId']) for r in rows} == {'H1'}
+    assert rows[0]['Input.office_count'] == '2'
+    assert 'Input.office_1' not in rows[0]
+    assert set(unpacked_fields(packed_row(['x']))) == set(rows[0])
+
+
+def test_merge_decisions():
+    rows = unpacked_rows(['a', 'b']) + unpacked_rows(['c', 'd'], 'A2')
+    decisions = [('A1/1', 'approve', None), ('A1/2', 'reject', 'No zip'),
+                 ('A2/1', 'approve', None), ('A2/2', 'approve', None),
+                 ('B1', 'reject', 'Blank')]
+    merged, incomplete = merge_decisions(decisions, office_counts(rows))
+    assert merged == [('A1', 'reject', 'Office 2: No zip'),
+                      ('A2', 'approve', None), ('B1', 'reject', 'Blank')]
+    assert incomplete == []
+
+
+def test_merge_waits_for_every_office():
+    rows = unpacked_rows(['a', 'b', 'c'])
+    decisions = [('A1/1', 'approve', None), ('A1/2', 'approve', None)]
+    merged, incomplete = merge_decisions(decisions, office_counts(rows))
+    assert merged == []
+    assert incomplete == ['A1']
+
+    # without knowing how many offices there are, nothing is merged
+    merged, incomplete = merge_decisions(decisions, {})
+    assert merged == [] and incomplete == ['A1']
+
+
+def test_collapse_partial_review():
+    rows = unpacked_rows(['a', 'b']) + unpacked_rows(['c', 'd'], 'A2')
+    for row in rows:
+        row['Approve'] = 'x'
+        row['Reject'] = ''
+    del rows[3]  # A2's second office isn't reconciled yet
+
+    review = io.StringIO()
+    writer = csv.DictWriter(review, list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    review.seek(0)
+    out = io.StringIO()
+    assert collapse_review(review, out) == 1
+
+    out.seek(0)
+    collapsed = list(csv.DictReader(out))
+    assert [(r['HITId'], r['AssignmentId'], r['Approve'])
+            for r in collapsed] == [('H1', 'A1', 'x')]
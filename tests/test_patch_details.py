@@ -0,0 +1,55 @@
+from patch_details import index_blocks, patch
+
+MAIN = b"""\
+- id:
+    bioguide: A000001
+  offices:
+  - id: A000001-springfield
+    city:   Springfield   # spacing and comments are kept
+- id:
+    bioguide: C000003
+  offices:
+  - id: C000003-chicago
+    city: Chicago
+"""
+
+PATCH = b"""\
+- id:
+    bioguide: C000003
+  offices:
+  - id: C000003-peoria
+    city: Peoria
+- id:
+    bioguide: B000002
+  offices:
+  - id: B000002-rockford
+    city: Rockford
+"""
+
+
+def patches(data):
+    return {b.bioguide: (data, b) for b in index_blocks(data)}
+
+
+def test_patch_is_idempotent():
+    once, report = patch(MAIN, patches(PATCH))
+    assert report == {'changed': ['C000003'], 'added': ['B000002'],
+                      'unchanged': []}
+    assert [b.bioguide for b in index_blocks(once)] == [
+        'A000001', 'B000002', 'C000003']
+    assert once.startswith(MAIN[:MAIN.index(b'- id:\n    bioguide: C')])
+    assert b'Chicago' not in once and b'Peoria' in once
+
+    twice, report = patch(once, patches(PATCH))
+    assert twice == once
+    assert report == {'changed': [], 'added': [],
+                      'unchanged': ['B000002', 'C000003']}
+
+
+def test_patch_without_changes_keeps_every_byte():
+    data, report = patch(MAIN, patches(MAIN))
+    assert data == MAIN
+    assert report['unchanged'] == ['A000001', 'C000003']
+
+    assert patch(MAIN, {}) == (MAIN, {'changed': [], 'added': [],
+                                      'unchanged': []})
@@ -0,0 +1,67 @@
+import argparse
+
+import pytest
+
+from reconcile_turk_results import TurkResultReconciler, quorum
+
+FIELDS = ['HITId', 'AssignmentId', 'WorkerId', 'Input.id', 'Answer.address',
+          'Answer.city']
+
+
+@pytest.fixture
+def reconciler(tmp_path):
+    def make(*options):
+        source = tmp_path / 'results.csv'
+        source.write_text(','.join(FIELDS) + '\n')
+        return TurkResultReconciler(
+            [str(source), str(tmp_path / 'out.csv'),
+             str(tmp_path / 'review.csv')] + list(options))
+    return make
+
+
+def group(reconciler, *answers):
+    return [reconciler.schema.row(['H1', 'A%d' % n, 'W%d' % n, 'S000001'] +
+                                  list(a))
+            for n, a in enumerate(answers, 1)]
+
+
+def test_tie_is_never_settled(reconciler):
+    r = reconciler('--quorum', '0.6')
+    rows = group(r, ('1 Main St', 'Springfield'), ('2 Main St', 'springfield'))
+    assert r.vote(rows)['Answer.address'][1] == 0.5
+    assert r.contested(rows) == ['Answer.address']
+
+
+def test_quorum_settles_majority(reconciler):
+    r = reconciler('--quorum', '0.6')
+    rows = group(r, ('1 Main St', 'Springfield'), ('2 Main St', 'Springfield'),
+                 ('1 main st', 'Springfield'))
+    assert r.contested(rows) == []
+    result = r.resolve(rows, chosen=rows[1])
+    assert result['AssignmentId'] == 'A2'
+    assert result['Answer.address'] == '1 Main St'
+
+    # by default everyone has to agree
+    assert reconciler().contested(rows) == ['Answer.address']
+
+
+def test_field_missing_from_first_row(reconciler):
+    r = reconciler('--quorum', '0.6')
+    rows = group(r, ('1 Main St',), ('1 Main St', 'Springfield'),
+                 ('1 Main St', 'Chicago'))
+    votes = r.vote(rows)
+    assert votes['Answer.city'][1] == pytest.approx(1 / 3)
+    assert r.contested(rows) == ['Answer.city']
+
+    rows = group(r, ('1 Main St',), ('1 Main St', 'Springfield'),
+                 ('1 Main St', 'Springfield'))
+    assert r.contested(rows) == []
+    assert r.resolve(rows, chosen=rows[0])['Answer.city'] == 'Springfield'
+
+
+def test_quorum_must_be_a_majority():
+    assert quorum('0.6') == 0.6
+    assert quorum('1') == 1
+    for text in ('0.5', '0.4', '1.1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            quorum(text)
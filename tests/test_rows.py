@@ -0,0 +1,44 @@
+import pickle
+
+from grouping import external_sort
+from rows import MISSING, RowSchema
+
+
+FIELDS = ['HITId', 'Title', 'AssignmentId', 'WorkerId', 'Answer.address',
+          'Answer.city', 'Input.id']
+
+
+def make_rows(schema, count):
+    return [schema.row(['HIT%03d' % (i // 2), 'Office Details',
+                        'A%04d' % i, 'W%d' % (i % 7),
+                        '%d Main St' % i, 'Springfield'])
+            for i in reversed(range(count))]
+
+
+def test_sorted_rows_share_schema():
+    schema = RowSchema(FIELDS)
+    rows = list(external_sort(make_rows(schema, 50),
+                              key=lambda r: r['AssignmentId'], chunk_size=7))
+    assert [r['AssignmentId'] for r in rows] == sorted(
+        'A%04d' % i for i in range(50))
+    assert all(r.schema is schema for r in rows)
+
+    # a field added through one row is seen by the others
+    rows[0]['latitude'] = 1.5
+    assert 'latitude' in rows[1].schema.index
+    assert rows[1].get('latitude') is None
+
+
+def test_missing_survives_pickling():
+    schema = RowSchema(FIELDS)
+    row = pickle.loads(pickle.dumps(make_rows(schema, 1)[0]))
+    assert row.values[-1] is MISSING
+    assert 'Input.id' not in row
+
+
+def test_pickled_size_is_close_to_values():
+    schema = RowSchema(FIELDS)
+    row = make_rows(schema, 1)[0]
+    size = len(pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+    values = len(pickle.dumps(row.values, pickle.HIGHEST_PROTOCOL))
+    assert size < values + 40
@@ -0,0 +1,18 @@
+from worker_trust import TrustIndex
+
+
+def test_shared_file_adds_counts(tmp_path):
+    path = str(tmp_path / 'trust.sqlite')
+    first, second = TrustIndex(path), TrustIndex(path)
+
+    assert first.record([('A1', 'W1', True, True, False)]) == 1
+    # `second` loaded its counts before `first` recorded anything
+    assert second.record([('A2', 'W1', False, False, True),
+                          ('A1', 'W1', True, True, False)]) == 1
+    assert second.counts['W1'] == [2, 1, 1, 1]
+
+    first.close()
+    second.close()
+    reopened = TrustIndex(path)
+    assert reopened.counts['W1'] == [2, 1, 1, 1]
+    reopened.close()
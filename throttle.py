@@ -0,0 +1,56 @@
+import random
+import threading
+import time
+
+
+class TransientError(Exception):
+    """A failure worth retrying (throttled, server error, timeout)."""
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls so no more than `rate` happen per second.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def backoff_delays(retries, base=0.5, cap=30):
+    """
+    Exponential backoff with jitter, e.g. ~0.5s, ~1s, ~2s, ...
+    """
+    for attempt in range(retries):
+        delay = min(cap, base * 2 ** attempt)
+        yield delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry(func, retries=4, retryable=(Exception,), limiter=None, **backoff):
+    """
+    Call func(), retrying with backoff when it raises a `retryable` error.
+
+    The last error is re-raised once retries are used up.
+    """
+    for delay in list(backoff_delays(retries, **backoff)) + [None]:
+        if limiter:
+            limiter.wait()
+        try:
+            return func()
+        except retryable:
+            if delay is None:
+                raise
+            time.sleep(delay)
@@ -0,0 +1,370 @@
+"""
+Worker throughput from MTurk result exports, and a forecast for a batch.
+
+Streams one or more result CSVs (List or Details, packed or not) and
+reports, per task type:
+
+- the distribution of WorkTimeInSeconds per unit of work (a legislator
+  for List tasks, an office for Details tasks, so packed tasks compare
+  with unpacked ones), overall and for the busiest workers
+- assignments submitted per hour (SubmitTime), over time
+- how often the assignments of a HIT disagree, by answer field
+
+    python turk_stats.py list_results.csv detail_results.csv
+
+With `--plan`, a HITs CSV from generate_hits.py or split_to_office_hits.py
+is forecast from the exports' task type: worker time, elapsed time at the
+rate units were completed in the hours work was being submitted, and cost
+including MTurk's fee. `--wage` suggests a reward for an hourly wage at the
+median time per unit.
+
+    python turk_stats.py detail_results.csv --plan detail_hits.csv --wage 12
+"""
+import argparse
+import csv
+import sys
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from packing import MAX_OFFICES, is_packed, unpack_row
+from reconcile_turk_results import canonical
+
+
+HOUR = 3600
+
+FEE = 0.20  # MTurk's commission on rewards
+LARGE_BATCH_FEE = 0.20  # more for HITs with 10 or more assignments
+
+# the zones requester website exports are written in
+TIMEZONES = {'UTC': 0, 'GMT': 0, 'EST': -5, 'EDT': -4, 'CST': -6,
+             'CDT': -5, 'MST': -7, 'MDT': -6, 'PST': -8, 'PDT': -7}
+
+
+def parse_time(text):
+    """
+    Seconds since the epoch of an export timestamp ("Wed Oct 19 21:17:51
+    PDT 2016"), or None.
+    """
+    parts = (text or '').split()
+    if len(parts) != 6 or parts[4] not in TIMEZONES:
+        return None
+    try:
+        t = datetime.strptime(' '.join(parts[:4] + parts[5:]),
+                              '%a %b %d %H:%M:%S %Y')
+    except ValueError:
+        return None
+    zone = timezone(timedelta(hours=TIMEZONES[parts[4]]))
+    return t.replace(tzinfo=zone).timestamp()
+
+
+def parse_reward(text):
+    try:
+        return float((text or '').strip().lstrip('$'))
+    except ValueError:
+        return None
+
+
+def task_kind(fieldnames):
+    """
+    'list' or 'detail' for the columns of a results or HITs CSV.
+    """
+    fieldnames = set(fieldnames or ())
+    if fieldnames & {'Answer.district_offices'}:
+        return 'list'
+    if fieldnames & {'Input.office', 'Input.office_1', 'office', 'office_1'}:
+        return 'detail'
+    return 'list'
+
+
+def units(row, prefix='Input.'):
+    """
+    Units of work in a HIT: its offices if it's packed, otherwise one.
+    """
+    count = row.get(prefix + 'office_count')
+    if count and count.isdigit():
+        return max(int(count), 1)
+    offices = sum(1 for n in range(1, MAX_OFFICES + 1)
+                  if (row.get('%soffice_%d' % (prefix, n)) or '').strip())
+    return offices or 1
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(int(p * len(values)), len(values) - 1)]
+
+
+def answer_key(value):
+    return canonical(value.strip())
+
+
+class TaskStats(object):
+    """
+    Running totals for the assignments of one task type.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.titles = Counter()
+        self.assignments = 0
+        self.units = 0
+        self.seconds = array('d')  # work time per unit, per assignment
+        self.by_worker = defaultdict(lambda: array('d'))
+        self.hours = Counter()  # hour: assignments submitted
+        self.hour_units = Counter()
+        self.rewards = 0  # total of the reward per unit of each assignment
+        self.rewarded = 0
+        self.max_assignments = Counter()
+        # HIT id: (answer hashes of its first row, mask of fields that
+        # differed from them since, assignments)
+        self.hits = {}
+        self.fields = []
+        self.field_index = {}
+
+    def add(self, row, packed=False):
+        self.assignments += 1
+        self.titles[row.get('Title', '')] += 1
+        n = units(row)
+        self.units += n
+
+        try:
+            per_unit = float(row['WorkTimeInSeconds']) / n
+        except (KeyError, TypeError, ValueError):
+            per_unit = None
+        if per_unit is not None:
+            self.seconds.append(per_unit)
+            self.by_worker[row.get('WorkerId', '')].append(per_unit)
+
+        submitted = parse_time(row.get('SubmitTime'))
+        if submitted is not None:
+            hour = int(submitted // HOUR) * HOUR
+            self.hours[hour] += 1
+            self.hour_units[hour] += n
+
+        reward = parse_reward(row.get('Reward'))
+        if reward is not None:
+            self.rewards += reward / n
+            self.rewarded += 1
+
+        if row.get('MaxAssignments'):
+            self.max_assignments[row['MaxAssignments']] += 1
+
+        for office in unpack_row(row) if packed else [row]:
+            self.add_answers(office)
+
+    def add_answers(self, row):
+        values = []
+        for field, value in row.items():
+            if not field.startswith('Answer.'):
+                continue
+            if field not in self.field_index:
+                self.field_index[field] = len(self.fields)
+                self.fields.append(field)
+            values.append((self.field_index[field], value or ''))
+        hashes = [0] * len(self.fields)
+        for i, value in values:
+            hashes[i] = hash(answer_key(value))
+
+        hit = row.get('HITId')
+        if hit not in self.hits:
+            self.hits[hit] = (hashes, 0, 1)
+            return
+        first, mask, count = self.hits[hit]
+        for i, h in enumerate(hashes):
+            if h != (first[i] if i < len(first) else 0):
+                mask |= 1 << i
+        self.hits[hit] = (first, mask, count + 1)
+
+    def active_hours(self):
+        return len(self.hours)
+
+    def units_per_hour(self):
+        hours = self.active_hours()
+        return sum(self.hour_units.values()) / hours if hours else 0
+
+    def reward_per_unit(self):
+        return self.rewards / self.rewarded if self.rewarded else None
+
+    def assignments_per_hit(self):
+        if not self.max_assignments:
+            return None
+        return int(self.max_assignments.most_common(1)[0][0])
+
+    def disagreement(self):
+        """
+        (field, HITs disagreeing on it, HITs with several assignments).
+        """
+        compared = [mask for _, mask, count in self.hits.values()
+                    if count > 1]
+        return [(field, sum(1 for mask in compared if mask >> i & 1),
+                 len(compared))
+                for i, field in enumerate(self.fields)]
+
+
+def read_exports(paths):
+    """
+    {task type: TaskStats} for the rows of result export CSVs.
+    """
+    stats = {}
+    for path in paths:
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            kind = task_kind(reader.fieldnames)
+            task = stats.setdefault(kind, TaskStats(kind))
+            packed = is_packed(reader.fieldnames)
+            for row in reader:
+                task.add(row, packed)
+    return stats
+
+
+def fee_rate(assignments):
+    return FEE + (LARGE_BATCH_FEE if assignments >= 10 else 0)
+
+
+def report_times(task, workers=10):
+    unit = 'legislator' if task.kind == 'list' else 'office'
+    title = task.titles.most_common(1)[0][0] if task.titles else ''
+    print("%s tasks (%s): %d assignments, %d %ss" % (
+        task.kind, title, task.assignments, task.units, unit))
+    if not task.seconds:
+        return
+    s = task.seconds
+    print("  seconds per %s: mean %d, p10 %d, median %d, p90 %d" % (
+        unit, sum(s) / len(s), percentile(s, 0.1), percentile(s, 0.5),
+        percentile(s, 0.9)))
+
+    print("  %-20s %11s %7s %7s" % ('worker', 'assignments', 'median',
+                                    'p90'))
+    busiest = sorted(task.by_worker.items(), key=lambda w: (-len(w[1]), w[0]))
+    for worker, seconds in busiest[:workers]:
+        print("  %-20s %11d %7d %7d" % (
+            worker, len(seconds), percentile(seconds, 0.5),
+            percentile(seconds, 0.9)))
+    if len(busiest) > workers:
+        print("  (%d more workers)" % (len(busiest) - workers))
+
+
+def report_hours(task, width=40):
+    if not task.hours:
+        return
+    peak = max(task.hours.values())
+    print("  submitted per hour (UTC):")
+    for hour in sorted(task.hours):
+        count = task.hours[hour]
+        print("  %s %6d %s" % (
+            datetime.fromtimestamp(hour, timezone.utc).strftime(
+                '%Y-%m-%d %H:00'),
+            count, '#' * max(1, round(width * count / peak))))
+    print("  %.1f %ss per active hour over %d hours" % (
+        task.units_per_hour(),
+        'legislator' if task.kind == 'list' else 'office',
+        task.active_hours()))
+
+
+def report_disagreement(task):
+    rows = task.disagreement()
+    if not rows or not rows[0][2]:
+        return
+    print("  HITs whose assignments disagree, of %d:" % rows[0][2])
+    for field, disagree, compared in sorted(rows, key=lambda r: -r[1]):
+        print("  %-28s %6d %5.1f%%" % (
+            field, disagree, 100.0 * disagree / compared))
+
+
+def read_plan(path):
+    """
+    (task type, HITs, units of work) of a HITs CSV.
+    """
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        kind = task_kind(reader.fieldnames)
+        hits = work = 0
+        for row in reader:
+            hits += 1
+            work += units(row, prefix='')
+    return kind, hits, work
+
+
+def forecast(task, hits, work, assignments=None, reward=None, wage=None):
+    """
+    Print worker time, elapsed time and cost for `hits` HITs holding `work`
+    units, at the rates in `task`.
+    """
+    assignments = assignments or task.assignments_per_hit() or 1
+    unit = 'legislator' if task.kind == 'list' else 'office'
+    per_hit = work / hits if hits else 0
+
+    median = percentile(task.seconds, 0.5)
+    mean = sum(task.seconds) / len(task.seconds) if task.seconds else 0
+    rate = task.units_per_hour()
+    total_units = work * assignments
+
+    print("forecast: %d HITs, %d %ss (%.1f per HIT), %d assignments each" % (
+        hits, work, unit, per_hit, assignments))
+    print("  worker time: %.1f hours (%d seconds per HIT at the median)" % (
+        total_units * mean / HOUR, median * per_hit))
+    if rate:
+        print("  elapsed: %.1f hours at %.1f %ss per hour" % (
+            total_units / rate, rate, unit))
+
+    if reward is None:
+        reward_per_unit = task.reward_per_unit()
+        if reward_per_unit is not None:
+            reward = reward_per_unit * per_hit
+    if reward is not None:
+        rewards = reward * hits * assignments
+        print("  cost: $%.2f ($%.2f per HIT, $%.2f in rewards + %d%% fee)" % (
+            rewards * (1 + fee_rate(assignments)), reward, rewards,
+            100 * fee_rate(assignments)))
+    if wage:
+        print("  reward for $%.2f/hour at the median time: $%.2f per HIT" % (
+            wage, wage * median * per_hit / HOUR))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'Work time, throughput and disagreement from MTurk result exports, '
+        'and a forecast for a planned batch')
+    parser.add_argument("results", nargs='+',
+        help="Result CSVs downloaded from mturk.com (or mturk.py harvest)")
+    parser.add_argument("--workers", type=int, default=10,
+        help="Busiest workers to list (default: %(default)s)")
+    parser.add_argument("--plan",
+        help="HITs CSV (generate_hits.py or split_to_office_hits.py "
+             "output) to forecast")
+    parser.add_argument("--assignments", type=int,
+        help="Assignments per planned HIT (default: as in the results)")
+    parser.add_argument("--reward", type=float,
+        help="Reward per planned HIT in dollars (default: the results' "
+             "reward for the same amount of work)")
+    parser.add_argument("--wage", type=float,
+        help="Suggest a reward paying this much per hour")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stats = read_exports(args.results)
+
+    for kind in sorted(stats, key=['list', 'detail'].index):
+        task = stats[kind]
+        report_times(task, args.workers)
+        report_hours(task)
+        report_disagreement(task)
+        print()
+
+    if args.plan:
+        kind, hits, work = read_plan(args.plan)
+        if kind not in stats:
+            print("no %s results to forecast %s from" % (kind, args.plan),
+                  file=sys.stderr)
+            return 1
+        forecast(stats[kind], hits, work, args.assignments, args.reward,
+                 args.wage)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
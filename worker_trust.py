@@ -0,0 +1,146 @@
+"""
+Persistent record of how reliable each worker has been.
+
+After each reconciled group, every assignment in it is counted for its
+worker: whether its answers agreed with the reconciled result, whether it
+was the one chosen, and whether it was rejected. A worker's trust is the
+share of their groups they agreed on, with PRIOR groups of disagreement
+added so that nobody is trusted on the strength of a handful of HITs.
+
+The counts live in a SQLite file and carry across runs (and reconcile
+scripts, if they share the file). Assignments are recorded by id, so
+counting the same assignment twice, e.g. when the index is seeded from a
+state store that already counted some, has no effect.
+
+    python worker_trust.py worker_trust.sqlite
+
+lists the workers, most trusted first.
+"""
+import argparse
+import sqlite3
+import threading
+import time
+
+
+PRIOR = 5  # groups of disagreement every worker starts with
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id TEXT PRIMARY KEY,
+        groups INTEGER NOT NULL DEFAULT 0,
+        agreed INTEGER NOT NULL DEFAULT 0,
+        chosen INTEGER NOT NULL DEFAULT 0,
+        rejected INTEGER NOT NULL DEFAULT 0,
+        updated REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS assignments (
+        assignment_id TEXT PRIMARY KEY,
+        worker_id TEXT NOT NULL
+    );
+"""
+
+
+class TrustIndex(object):
+    """
+    Per-worker agreement counts, kept in memory and in a SQLite file.
+    """
+
+    def __init__(self, path, prior=PRIOR):
+        self.path = path
+        self.prior = prior
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False,
+                                  isolation_level=None)
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.counts = {
+            row[0]: list(row[1:]) for row in self.db.execute(
+                'SELECT worker_id, groups, agreed, chosen, rejected '
+                'FROM workers')}
+
+    def is_empty(self):
+        return not self.counts
+
+    def trust(self, worker_id):
+        """
+        Share of a worker's groups they agreed on, from 0 to just under 1.
+        """
+        groups, agreed = self.counts.get(worker_id, (0, 0))[:2]
+        return agreed / (groups + self.prior)
+
+    def record(self, outcomes):
+        """
+        Count (assignment id, worker id, agreed, chosen, rejected) outcomes,
+        skipping assignments counted before. Returns how many were new.
+
+        The counts are added to those in the file, not written over them, so
+        other processes recording into the same file at the same time don't
+        lose each other's; the touched workers are then read back.
+        """
+        now = time.time()
+        added = {}
+        new = 0
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                for assignment_id, worker_id, agreed, chosen, rejected in (
+                        outcomes):
+                    if not worker_id or not self.db.execute(
+                            'INSERT OR IGNORE INTO assignments VALUES (?, ?)',
+                            (assignment_id, worker_id)).rowcount:
+                        continue
+                    counts = added.setdefault(worker_id, [0, 0, 0, 0])
+                    for i, n in enumerate((1, agreed, chosen, rejected)):
+                        counts[i] += bool(n)
+                    new += 1
+                for worker_id, counts in added.items():
+                    self.db.execute(
+                        'INSERT INTO workers VALUES (?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT(worker_id) DO UPDATE SET '
+                        'groups = groups + excluded.groups, '
+                        'agreed = agreed + excluded.agreed, '
+                        'chosen = chosen + excluded.chosen, '
+                        'rejected = rejected + excluded.rejected, '
+                        'updated = excluded.updated',
+                        [worker_id] + counts + [now])
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+            for worker_id in added:
+                self.counts[worker_id] = list(self.db.execute(
+                    'SELECT groups, agreed, chosen, rejected FROM workers '
+                    'WHERE worker_id = ?', (worker_id,)).fetchone())
+        return new
+
+    def workers(self):
+        """
+        (worker id, trust, groups, agreed, chosen, rejected), most trusted
+        first.
+        """
+        rows = [(w, self.trust(w)) + tuple(c) for w, c in self.counts.items()]
+        return sorted(rows, key=lambda r: (-r[1], r[0]))
+
+    def close(self):
+        self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=
+        'List workers by how often their answers agreed with the results')
+    parser.add_argument("index", help="SQLite worker trust index")
+    parser.add_argument("--prior", type=int, default=PRIOR,
+        help="Groups of disagreement every worker starts with "
+             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    index = TrustIndex(args.index, args.prior)
+    print("%-20s %6s %7s %7s %7s %8s" % (
+        'worker', 'trust', 'groups', 'agreed', 'chosen', 'rejected'))
+    for worker in index.workers():
+        print("%-20s %6.3f %7d %7d %7d %8d" % worker)
+
+
+if __name__ == '__main__':
+    main()